@@ -0,0 +1,5 @@
+"""
+Microbenchmarks for i3-resurrect.
+
+Run with `python -m benchmarks` from the repository root.
+"""
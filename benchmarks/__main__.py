@@ -0,0 +1,167 @@
+"""
+Benchmark runner.
+
+Timings are stored relative to a fixed calibration workload so that baselines
+recorded on one machine remain meaningful on another.
+"""
+
+import fnmatch
+import gc
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import click
+
+from .suite import BENCHMARKS
+
+BASELINES_FILE = Path(__file__).parent / "baselines.json"
+
+# The spread above which a measurement is taken again, as its rounds disagree
+# too much for it to be trusted, and how many times.
+MAX_SPREAD = 0.25
+RETRIES = 2
+
+
+def workload():
+    """
+    A fixed pure Python workload of dict building and list traversal, which is
+    representative of what the benchmarked code does.
+    """
+    # Building a string per node made the timing depend on the state of the
+    # allocator, which varied by up to half between runs.
+    nodes = [{"id": i, "name": i, "nodes": None} for i in range(20000)]
+    total = 0
+    for node in nodes:
+        if "nodes" in node and node["name"] != "":
+            total += node["id"]
+    return total
+
+
+def measure(func, rounds=11, min_time=0.05):
+    """
+    Time func against the calibration workload. Returns the median per-call
+    times of func and of the workload in seconds, the median of their ratios
+    and the spread of the ratios (their interquartile range over the median).
+
+    Each round times a batch of calls of func and then a batch of calls of the
+    workload, each taking at least min_time seconds. The speed of a shared
+    machine drifts over a run, but is about the same for the two batches of a
+    round, and taking the median leaves out rounds which were interrupted. As
+    with timeit, garbage collection is turned off while timing, since when
+    collections happen to run depends on everything allocated before.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        numbers = [_batch_size(f, min_time) for f in (func, workload)]
+        times = []
+        for _ in range(rounds):
+            times.append(
+                [_time(f, n) / n for f, n in zip((func, workload), numbers)]
+            )
+    finally:
+        if enabled:
+            gc.enable()
+
+    ratios = sorted(seconds / unit for seconds, unit in times)
+    relative = statistics.median(ratios)
+    spread = (ratios[3 * rounds // 4] - ratios[rounds // 4]) / relative
+    seconds = statistics.median(seconds for seconds, _ in times)
+    unit = statistics.median(unit for _, unit in times)
+    return seconds, unit, relative, spread
+
+
+def _batch_size(func, min_time):
+    number = 1
+    while number < 1 << 20 and _time(func, number) < min_time:
+        number *= 2
+    return number
+
+
+def _time(func, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start
+
+
+def read_baselines(path):
+    try:
+        return json.loads(Path(path).read_text())
+    except FileNotFoundError:
+        return {}
+
+
+@click.command()
+@click.option(
+    "--baselines",
+    "-b",
+    type=click.Path(dir_okay=False),
+    default=str(BASELINES_FILE),
+    help="The baselines file to compare against.",
+)
+@click.option(
+    "--update", "-u", is_flag=True, help="Write the results to the baselines file."
+)
+@click.option(
+    "--tolerance",
+    "-t",
+    type=float,
+    default=0.5,
+    help="Allowed slowdown relative to the baseline.\n[default: 0.5 (50%)]",
+)
+@click.option(
+    "--filter",
+    "-k",
+    "pattern",
+    default="*",
+    help="Only run benchmarks whose name matches this glob.",
+)
+def main(baselines, update, tolerance, pattern):
+    """
+    Run the benchmark suite and fail on regressions.
+    """
+    stored = read_baselines(baselines)
+    results = {}
+    regressions = []
+    for name, setup in BENCHMARKS.items():
+        if not fnmatch.fnmatchcase(name, pattern):
+            continue
+        func = setup()
+        seconds, unit, relative, spread = measure(func)
+        for _ in range(RETRIES):
+            if spread <= MAX_SPREAD:
+                break
+            retry = measure(func)
+            if retry[3] < spread:
+                seconds, unit, relative, spread = retry
+        results[name] = round(relative, 4)
+
+        line = (
+            f"{name:<50} {seconds * 1000:10.3f} ms {relative:10.4f} x "
+            f"(calibration {unit * 1000:.3f} ms, spread {spread:5.1%})"
+        )
+        if name in stored:
+            change = relative / stored[name] - 1
+            line += f" {change:+8.1%}"
+            if change > tolerance:
+                line += "  REGRESSION"
+                regressions.append(name)
+        if spread > MAX_SPREAD:
+            line += "  UNSTABLE"
+        click.echo(line)
+
+    if update:
+        stored.update(results)
+        Path(baselines).write_text(json.dumps(stored, indent=2, sort_keys=True) + "\n")
+        click.echo(f"Updated {baselines}")
+    elif regressions:
+        click.echo(f"{len(regressions)} benchmark(s) regressed.", err=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Peak memory benchmark for `save --session`.
+
+Runs a full session save against a fake i3 with a growing number of windows
+and checks that peak memory grows no faster than linearly with the window
+count and stays under a per-window budget.
+
+The fake i3 runs in a child process so that its own allocations are not
+traced.
+
+Run with `python -m benchmarks.memory`.
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import click
+from click.testing import CliRunner
+
+from i3_resurrect import main as cli
+from i3_resurrect.profiling import format_size
+
+from . import synthetic
+from .suite import FakeI3
+from .suite import use_config
+
+
+def _serve(tree, socket_path):
+    FakeI3(tree, socket_path=socket_path).start()
+    while True:
+        time.sleep(3600)
+
+
+def measure_save(windows, workdir):
+    """
+    Return the peak traced memory in bytes of a session save of a synthetic
+    tree with the given number of windows.
+    """
+    tree = synthetic.generate_tree(windows=windows, outputs=2, workspaces=10)
+    socket_path = str(workdir / f"i3-{windows}.sock")
+    server = multiprocessing.Process(target=_serve, args=(tree, socket_path))
+    server.daemon = True
+    server.start()
+    try:
+        while not os.path.exists(socket_path):
+            time.sleep(0.01)
+        # The fake is only used for its environment, the server itself is
+        # the one running in the child process.
+        fake = FakeI3({}, socket_path=socket_path)
+        args = ["save", "--session", "mem", "-d", str(workdir / f"data-{windows}")]
+        with fake.environment(workdir / "bin"):
+            tracemalloc.start()
+            try:
+                result = CliRunner().invoke(cli.main, args)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        if result.exit_code != 0:
+            raise RuntimeError(result.output) from result.exception
+        return peak
+    finally:
+        server.terminate()
+        server.join()
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default="100,200,400,800",
+    help="Comma separated window counts to measure.\n[default: 100,200,400,800]",
+)
+@click.option(
+    "--budget",
+    type=int,
+    default=64 * 1024,
+    help="Maximum peak bytes per window.\n[default: 65536]",
+)
+@click.option(
+    "--slack",
+    type=float,
+    default=0.5,
+    help="Allowed growth in bytes per window from the smallest to the largest "
+    "size.\n[default: 0.5 (50%)]",
+)
+def main(sizes, budget, slack):
+    """
+    Check that save peak memory stays bounded as the window count grows.
+    """
+    if FakeI3 is None:
+        click.echo("Skipped: the fake i3 in tests/ can't be imported.", err=True)
+        return
+    use_config()
+    sizes = sorted(int(size) for size in sizes.split(","))
+    failures = []
+    per_window = {}
+    with tempfile.TemporaryDirectory(prefix="i3-resurrect-mem-") as tmp:
+        for windows in sizes:
+            peak = measure_save(windows, Path(tmp))
+            per_window[windows] = peak / windows
+            click.echo(
+                f"{windows:>6} windows  peak {format_size(peak):>12}  "
+                f"{format_size(peak / windows):>12}/window"
+            )
+            if peak / windows > budget:
+                failures.append(f"{windows} windows exceeds the per-window budget")
+
+    growth = per_window[sizes[-1]] / per_window[sizes[0]] - 1
+    click.echo(f"per-window growth {sizes[0]} -> {sizes[-1]}: {growth:+.1%}")
+    if growth > slack:
+        failures.append("peak memory grows faster than the window count")
+
+    for failure in failures:
+        click.echo(failure, err=True)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Benchmark definitions.
+
+Each benchmark is a setup function which builds its input data and returns a
+zero-argument callable. Only the callable is timed.
+"""
+
+import atexit
+import tempfile
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from i3_resurrect import config
+from i3_resurrect import main
+from i3_resurrect import programs
+from i3_resurrect import serializer
+from i3_resurrect import storage
+from i3_resurrect import treeutils
+
+from . import synthetic
+
+try:
+    from tests.fake_i3 import FakeI3
+except ImportError:
+    # The fake i3 is in the test tree, which is only importable from the root
+    # of a checkout.
+    FakeI3 = None
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Decorator which registers a benchmark setup function under a name.
+    """
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def fake_i3_benchmark(name):
+    """
+    Like benchmark(), for a benchmark against the fake i3, which is skipped
+    if the fake i3 can't be imported.
+    """
+    if FakeI3 is None:
+        return lambda setup: setup
+    return benchmark(name)
+
+
+def use_config(mappings=200):
+    """
+    Replace the loaded config with a synthetic one.
+    """
+    config._config = {
+        "window_command_mappings": synthetic.generate_mappings(mappings),
+        "window_swallow_criteria": {"mpv": ["class"]},
+        "terminals": ["Gnome-terminal", "Alacritty"],
+    }
+
+
+def _process_node(windows):
+    use_config()
+    tree = synthetic.generate_tree(windows=windows)
+    workspaces = list(synthetic.workspaces(tree))
+    swallow = ["class", "instance", "title"]
+
+    def run():
+        for ws in workspaces:
+            treeutils.process_node(ws, swallow)
+
+    return run
+
+
+def _get_leaves(windows):
+    tree = synthetic.generate_tree(windows=windows)
+    workspaces = list(synthetic.workspaces(tree))
+
+    def run():
+        for ws in workspaces:
+            for _ in treeutils.get_leaves(ws):
+                pass
+
+    return run
+
+
+@benchmark("process_node[1k]")
+def process_node_1k():
+    return _process_node(1000)
+
+
+@benchmark("process_node[10k]")
+def process_node_10k():
+    return _process_node(10000)
+
+
+@benchmark("LayoutNode.from_con[10k]")
+def layout_node_10k():
+    use_config()
+    tree = synthetic.generate_tree(windows=10000)
+    workspaces = list(synthetic.workspaces(tree))
+    swallow = ["class", "instance", "title"]
+
+    def run():
+        for ws in workspaces:
+            treeutils.LayoutNode.from_con(ws, swallow)
+
+    return run
+
+
+@benchmark("get_leaves[1k]")
+def get_leaves_1k():
+    return _get_leaves(1000)
+
+
+@benchmark("get_leaves[10k]")
+def get_leaves_10k():
+    return _get_leaves(10000)
+
+
+@benchmark("get_window_command[1k windows, 200 rules]")
+def get_window_command():
+    use_config(200)
+    windows = synthetic.generate_window_properties(1000)
+
+    def run():
+        for window_properties, cmdline, exe in windows:
+            programs.get_window_command(window_properties, cmdline, exe)
+
+    return run
+
+
+@benchmark("calc_rule_match_score[1k windows, 200 rules]")
+def calc_rule_match_score():
+    rules = synthetic.generate_mappings(200)
+    windows = [w[0] for w in synthetic.generate_window_properties(1000)]
+
+    def run():
+        for window_properties in windows:
+            for rule in rules:
+                programs.calc_rule_match_score(rule, window_properties)
+
+    return run
+
+
+@benchmark("restore_dedup[1k saved, 1k running]")
+def restore_dedup():
+    saved = synthetic.generate_programs(1000, seed=0)
+    # Half of the running programs match saved ones.
+    running = saved[::2] + synthetic.generate_programs(500, seed=1)
+    saved = [programs.Program.from_dict(p) for p in saved]
+    running = [programs.Program.from_dict(p) for p in running]
+
+    def run():
+        programs.remove_running(saved, running)
+
+    return run
+
+
+def _load_layout(fmt, compression):
+    use_config()
+    tree = synthetic.generate_tree(windows=1000)
+    swallow = ["class", "instance", "title"]
+    files = [
+        storage.dump_layout(treeutils.LayoutNode.from_con(ws, swallow), fmt, compression)
+        for ws in synthetic.workspaces(tree)
+    ]
+
+    def run():
+        for data in files:
+            storage.load_layout(data)
+
+    return run
+
+
+@benchmark("load_layout[json, 1k]")
+def load_layout_json():
+    return _load_layout("json", None)
+
+
+@benchmark("load_layout[compact, 1k]")
+def load_layout_compact():
+    return _load_layout("compact", None)
+
+
+@benchmark("load_layout[compact+zlib, 1k]")
+def load_layout_compact_zlib():
+    return _load_layout("compact", "zlib")
+
+
+def _serializer(name, operation, windows):
+    use_config()
+    backend = serializer.get_backend(name)
+    tree = synthetic.generate_tree(windows=windows)
+    swallow = ["class", "instance", "title"]
+    layouts = [
+        treeutils.LayoutNode.from_con(ws, swallow) for ws in synthetic.workspaces(tree)
+    ]
+    data = backend.dumps(tree)
+
+    def dumps():
+        for layout in layouts:
+            backend.dumps(layout, 2, treeutils.json_default)
+
+    def loads():
+        backend.loads(data)
+
+    return dumps if operation == "dumps" else loads
+
+
+# Compare the JSON backends on large trees: dumping saved layouts and parsing
+# a get_tree reply (parsing 10k windows allocates too much to time reliably).
+# Backends which aren't installed are skipped.
+for _name in serializer.BACKENDS:
+    if _name == "orjson" and serializer.orjson is None:
+        continue
+    for _operation, _windows in [("dumps", 10000), ("loads", 1000)]:
+        benchmark(f"serializer.{_operation}[{_name}, {_windows // 1000}k]")(
+            lambda name=_name, operation=_operation, windows=_windows: _serializer(
+                name, operation, windows
+            )
+        )
+
+
+def _fake_i3(windows):
+    """
+    Start a fake i3 serving a synthetic tree and return it along with a
+    scratch directory. Both are cleaned up when the interpreter exits.
+
+    Launched programs' windows never appear: the fake would create them on
+    threads of its own while the restore is timed, which made the timings
+    depend on thread scheduling rather than on i3-resurrect.
+    """
+    use_config()
+    fake = FakeI3(
+        synthetic.generate_tree(windows=windows, outputs=2, workspaces=10),
+        window_delay=None,
+    )
+    fake.start()
+    atexit.register(fake.stop)
+    tmpdir = tempfile.TemporaryDirectory(prefix="i3-resurrect-bench-")
+    atexit.register(tmpdir.cleanup)
+    return fake, Path(tmpdir.name)
+
+
+def _invoke(fake, bin_dir, args):
+    with fake.environment(bin_dir):
+        result = CliRunner().invoke(main.main, args)
+    if result.exit_code != 0:
+        raise RuntimeError(result.output) from result.exception
+
+
+@fake_i3_benchmark("save --session[fake i3, 100 windows]")
+def save_session():
+    fake, tmp = _fake_i3(100)
+    args = ["save", "--session", "bench", "-d", str(tmp / "data")]
+
+    def run():
+        _invoke(fake, tmp / "bin", args)
+
+    return run
+
+
+@fake_i3_benchmark("restore --session[fake i3, 100 windows]")
+def restore_session():
+    fake, tmp = _fake_i3(100)
+    _invoke(fake, tmp / "bin", ["save", "--session", "bench", "-d", str(tmp / "data")])
+    args = ["restore", "--session", "bench", "-d", str(tmp / "data")]
+
+    def run():
+        fake.reset()
+        fake.clear_workspaces()
+        _invoke(fake, tmp / "bin", args)
+
+    return run
@@ -0,0 +1,231 @@
+"""
+Generators for synthetic i3 trees and config used by the benchmarks.
+
+Everything is generated from a seeded random.Random so that the same
+parameters always produce the same tree.
+"""
+
+import random
+
+LAYOUTS = ["splith", "splitv", "tabbed", "stacked"]
+
+# (class, instance, process cmdline) triples used for generated windows.
+PROGRAMS = [
+    ("Alacritty", "Alacritty", ["alacritty"]),
+    ("Gnome-terminal", "gnome-terminal-server", ["/usr/libexec/gnome-terminal-server"]),
+    ("Firefox", "Navigator", ["/usr/lib/firefox/firefox", "-P", "default"]),
+    ("Google-chrome", "google-chrome", ["/opt/google/chrome/chrome", "--app=x"]),
+    ("Code", "code", ["/usr/share/code/code", "/home/user/project"]),
+    ("Slack", "slack", ["/usr/lib/slack/slack", "--enable-crashpad"]),
+    ("Emacs", "emacs", ["emacs", "--daemon"]),
+    ("mpv", "gl", ["mpv", "/home/user/video.mkv"]),
+    ("Thunar", "thunar", ["thunar", "/home/user"]),
+    ("Zathura", "org.pwmt.zathura", ["zathura", "/home/user/paper.pdf"]),
+]
+
+
+class _Ids:
+    """
+    Monotonic container/window id allocator.
+    """
+
+    def __init__(self):
+        self.con = 94000000000000
+        self.window = 50331648
+
+    def next_con(self):
+        self.con += 16
+        return self.con
+
+    def next_window(self):
+        self.window += 1
+        return self.window
+
+
+def _rect(rng, zero=False):
+    if zero:
+        return {"x": 0, "y": 0, "width": 0, "height": 0}
+    return {
+        "x": rng.randrange(0, 3840),
+        "y": rng.randrange(0, 2160),
+        "width": rng.randrange(100, 1920),
+        "height": rng.randrange(100, 1080),
+    }
+
+
+def _con(rng, ids, con_type, name, layout, output):
+    return {
+        "id": ids.next_con(),
+        "type": con_type,
+        "orientation": "vertical" if layout == "splitv" else "horizontal",
+        "scratchpad_state": "none",
+        "percent": round(rng.random(), 3),
+        "urgent": False,
+        "focused": False,
+        "output": output,
+        "layout": layout,
+        "workspace_layout": "default",
+        "last_split_layout": "splith",
+        "border": rng.choice(["normal", "pixel", "none"]),
+        "current_border_width": rng.choice([-1, 1, 2]),
+        "rect": _rect(rng),
+        "deco_rect": _rect(rng, zero=True),
+        "window_rect": _rect(rng, zero=True),
+        "geometry": _rect(rng, zero=True),
+        "name": name,
+        "window": None,
+        "nodes": [],
+        "floating_nodes": [],
+        "focus": [],
+        "fullscreen_mode": 0,
+        "sticky": False,
+        "floating": "auto_off",
+        "swallows": [],
+        "marks": [],
+    }
+
+
+def _window(rng, ids, output):
+    window_class, instance, _ = rng.choice(PROGRAMS)
+    title = f"{window_class} - document {rng.randrange(100000)}"
+    con = _con(rng, ids, "con", title, "splith", output)
+    con["window"] = ids.next_window()
+    con["geometry"] = _rect(rng)
+    con["window_rect"] = _rect(rng)
+    con["window_properties"] = {
+        "class": window_class,
+        "instance": instance,
+        "title": title,
+        "transient_for": None,
+    }
+    return con
+
+
+def _split(rng, ids, output, windows, depth):
+    """
+    Build a container holding the given number of windows, nesting further
+    split/tabbed/stacked containers until the maximum depth is reached.
+    """
+    layout = rng.choice(LAYOUTS)
+    con = _con(rng, ids, "con", None, layout, output)
+    remaining = windows
+    while remaining > 0:
+        if depth > 0 and remaining > 2 and rng.random() < 0.35:
+            size = rng.randint(2, min(remaining, 6))
+            con["nodes"].append(_split(rng, ids, output, size, depth - 1))
+        else:
+            size = 1
+            con["nodes"].append(_window(rng, ids, output))
+        remaining -= size
+    return con
+
+
+def generate_tree(
+    windows=1000, outputs=3, workspaces=10, floating_ratio=0.05, depth=4, seed=0
+):
+    """
+    Generate a full i3 tree as returned by `i3-msg -t get_tree`.
+
+    Args:
+        windows: Approximate total number of windows in the tree.
+        outputs: Number of outputs to spread workspaces across.
+        workspaces: Number of workspaces to create.
+        floating_ratio: Fraction of windows that are floating.
+        depth: Maximum depth of nested containers below a workspace.
+        seed: Seed for the random number generator.
+    """
+    rng = random.Random(seed)
+    ids = _Ids()
+    root = _con(rng, ids, "root", "root", "splith", None)
+    output_nodes = []
+    for i in range(outputs):
+        output_name = f"DP-{i}"
+        output = _con(rng, ids, "output", output_name, "output", output_name)
+        content = _con(rng, ids, "con", "content", "splith", output_name)
+        output["nodes"].append(content)
+        output_nodes.append(output)
+        root["nodes"].append(output)
+
+    per_workspace = max(windows // workspaces, 1)
+    for num in range(1, workspaces + 1):
+        output = output_nodes[num % outputs]
+        output_name = output["name"]
+        ws = _con(rng, ids, "workspace", str(num), "splith", output_name)
+        ws["num"] = num
+        floating = int(per_workspace * floating_ratio)
+        tiled = _split(rng, ids, output_name, per_workspace - floating, depth)
+        ws["nodes"] = tiled["nodes"]
+        ws["layout"] = tiled["layout"]
+        for _ in range(floating):
+            floating_con = _con(rng, ids, "floating_con", None, "splith", output_name)
+            floating_con["floating"] = "user_on"
+            floating_con["nodes"].append(_window(rng, ids, output_name))
+            ws["floating_nodes"].append(floating_con)
+        output["nodes"][0]["nodes"].append(ws)
+
+    return root
+
+
+def workspaces(tree):
+    """
+    Yield every workspace node in a tree generated by generate_tree.
+    """
+    for output in tree["nodes"]:
+        for content in output["nodes"]:
+            yield from content["nodes"]
+
+
+def generate_mappings(rules=200, seed=0):
+    """
+    Generate a window_command_mappings config list of the given size.
+
+    Most rules match nothing so that scoring has to walk the whole list, which
+    is what happens with large real-world configs.
+    """
+    rng = random.Random(seed)
+    mappings = []
+    for i in range(rules):
+        window_class, instance, cmdline = rng.choice(PROGRAMS)
+        rule = {"class": window_class if i % 4 == 0 else f"Unused-{i}"}
+        if i % 3 == 0:
+            rule["instance"] = instance
+        if i % 7 == 0:
+            rule["title"] = f"{window_class} - document {i}"
+        if i % 5 != 0:
+            rule["command"] = " ".join(cmdline[:1] + ["{1}"])
+        mappings.append(rule)
+    return mappings
+
+
+def generate_window_properties(count=1000, seed=0):
+    """
+    Generate (window_properties, cmdline, exe) tuples for get_window_command.
+    """
+    rng = random.Random(seed)
+    result = []
+    for i in range(count):
+        window_class, instance, cmdline = rng.choice(PROGRAMS)
+        properties = {
+            "class": window_class,
+            "instance": instance,
+            "title": f"{window_class} - document {i}",
+        }
+        result.append((properties, list(cmdline) + [f"/tmp/file{i}"], cmdline[0]))
+    return result
+
+
+def generate_programs(count=1000, seed=0):
+    """
+    Generate a saved programs list as written to a programs file.
+    """
+    rng = random.Random(seed)
+    result = []
+    for i in range(count):
+        _, _, cmdline = rng.choice(PROGRAMS)
+        result.append(
+            {
+                "command": list(cmdline) + [f"/tmp/file{i}"],
+                "working_directory": f"/home/user/dir{i % 50}",
+            }
+        )
+    return result
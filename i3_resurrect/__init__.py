@@ -1,8 +1,9 @@
-__all__ = ["config", "layout", "main", "programs", "treeutils", "util"]
+__all__ = ["config", "layout", "main", "programs", "snapshot", "treeutils", "util"]
 
 from . import config
 from . import layout
 from . import main
 from . import programs
+from . import snapshot
 from . import treeutils
 from . import util
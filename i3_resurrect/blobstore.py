@@ -0,0 +1,179 @@
+"""
+Optional content-addressed storage for saved layouts and programs.
+
+When enabled (`"store": "blobs"` in the config), the contents of each saved
+layout or programs file are written once to `<directory>/blobs/` under their
+SHA-256 hash, and the usual workspace, profile and session files become small
+references to those blobs. Saving the same state into several profiles or
+sessions therefore only stores it once, and re-saving unchanged state writes
+nothing at all.
+
+References are always resolved when reading, whether or not the store is
+enabled, so switching the setting never makes saved files unreadable.
+"""
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from . import config
+from . import serializer
+
+BLOBS_DIR = "blobs"
+REF_FORMAT = "i3-resurrect-ref"
+REF_VERSION = 1
+# References are always written in this exact form so they can be recognised
+# without parsing every file.
+REF_PREFIX = ('{"format":"%s",' % REF_FORMAT).encode("utf-8")
+
+
+class BlobStore:
+    """
+    A directory of blobs named by the SHA-256 of their contents.
+
+    Args:
+        root: The top level i3-resurrect directory.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.blobs = self.root / BLOBS_DIR
+
+    def blob_path(self, digest):
+        return self.blobs / digest[:2] / digest[2:]
+
+    def put(self, data):
+        """
+        Store data and return its digest. Nothing is written if a blob with
+        the same contents already exists.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(path, data)
+        return digest
+
+    def write(self, file, data):
+        """
+        Store data as a blob and point file at it. Returns whether the file
+        changed.
+        """
+        file = Path(file)
+        digest = self.put(data)
+        blob = os.path.relpath(self.blob_path(digest), file.parent)
+        ref = serializer.dumps(
+            {
+                "format": REF_FORMAT,
+                "version": REF_VERSION,
+                "sha256": digest,
+                "blob": blob,
+            }
+        )
+        if unchanged(file, ref):
+            return False
+        write_atomic(file, ref)
+        return True
+
+    def referenced(self):
+        """
+        Return the digests of all blobs referenced from files under the root.
+        """
+        digests = set()
+        for file in self.root.rglob("*"):
+            if self.blobs in file.parents or not file.is_file():
+                continue
+            with file.open("rb") as f:
+                if f.read(len(REF_PREFIX)) != REF_PREFIX:
+                    continue
+            try:
+                digests.add(serializer.loads(file.read_bytes())["sha256"])
+            except (ValueError, KeyError):
+                continue
+        return digests
+
+    def gc(self):
+        """
+        Delete every blob that is no longer referenced. Returns the number of
+        blobs deleted.
+        """
+        if not self.blobs.is_dir():
+            return 0
+        referenced = self.referenced()
+        removed = 0
+        for prefix in self.blobs.iterdir():
+            if not prefix.is_dir():
+                continue
+            for blob in prefix.iterdir():
+                if prefix.name + blob.name not in referenced:
+                    blob.unlink()
+                    removed += 1
+            if not any(prefix.iterdir()):
+                prefix.rmdir()
+        return removed
+
+
+def from_config(root):
+    """
+    Get the blob store for a directory if it is enabled in the config,
+    otherwise None.
+    """
+    if config.get("store", "files") == "blobs":
+        return BlobStore(root)
+    return None
+
+
+def read(file):
+    """
+    Read a saved file, following it to its blob if it is a reference.
+    """
+    file = Path(file)
+    data = file.read_bytes()
+    if data.startswith(REF_PREFIX):
+        ref = serializer.loads(data)
+        data = (file.parent / ref["blob"]).read_bytes()
+    return data
+
+
+def write(file, data, store=None):
+    """
+    Write a saved file, through the blob store if one is given. Nothing is
+    written if the file already holds the same data, so that unchanged files
+    keep their modification time.
+
+    Returns whether the file changed.
+    """
+    if store is not None:
+        return store.write(file, data)
+    if unchanged(file, data):
+        return False
+    write_atomic(file, data)
+    return True
+
+
+def unchanged(file, data):
+    """
+    Check whether file already holds exactly data. The size is compared first
+    so that most changed files are detected without reading them.
+    """
+    file = Path(file)
+    try:
+        return file.stat().st_size == len(data) and file.read_bytes() == data
+    except FileNotFoundError:
+        return False
+
+
+def write_atomic(path, data):
+    """
+    Write data to a temporary file next to path and rename it into place.
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
@@ -0,0 +1,235 @@
+"""
+Single-file session bundles.
+
+When `"session_format": "bundle"` is set in the config, `save --session`
+writes every workspace's layout and programs into one file,
+`sessions/<session>.bundle`, instead of a directory of separate files. The
+bundle is written to a temporary file, synced once and renamed into place, so
+a crash during a save leaves the previous session intact.
+
+A bundle is laid out as:
+
+    MAGIC
+    the saved files, one after another
+    a JSON index of the files' offsets and lengths
+    the offset of the index (8 bytes, little endian)
+
+so the index can be read without reading the files, and each file can be
+read on its own. The saved files have exactly the contents they would have
+had as separate files.
+"""
+
+import os
+import struct
+import tempfile
+import threading
+from pathlib import Path
+
+from . import config
+from . import serializer
+from . import storage
+
+BUNDLE_SUFFIX = ".bundle"
+BUNDLE_FORMAT = "i3-resurrect-bundle"
+BUNDLE_VERSION = 1
+MAGIC = b"i3-resurrect-bundle\n"
+TRAILER = struct.Struct("<Q")
+
+
+class BundleError(storage.FormatError):
+    pass
+
+
+def session_path(directory, session):
+    """
+    Get the path of a session's bundle.
+
+    Args:
+        directory: The sessions directory.
+        session: The name of the session.
+    """
+    return Path(directory) / f"{session}{BUNDLE_SUFFIX}"
+
+
+class Bundle:
+    """
+    A saved session bundle. The index is read when first needed and files are
+    only read when requested.
+
+    Args:
+        path: The bundle file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self._read_index()
+        return self._index
+
+    def _read_index(self):
+        with self.path.open("rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise BundleError(f'"{self.path}" is not a session bundle')
+            try:
+                end = f.seek(-TRAILER.size, os.SEEK_END)
+                (offset,) = TRAILER.unpack(f.read(TRAILER.size))
+                if not len(MAGIC) <= offset <= end:
+                    raise ValueError("index offset out of range")
+                f.seek(offset)
+                index = serializer.loads(f.read(end - offset))
+            except (OSError, ValueError, struct.error) as e:
+                raise BundleError(f'Corrupt session bundle "{self.path}": {str(e)}')
+        version = index.get("version")
+        if index.get("format") != BUNDLE_FORMAT or version != BUNDLE_VERSION:
+            raise BundleError(
+                f'Session bundle "{self.path}" has unsupported version {version}'
+            )
+        return index
+
+    def workspaces(self):
+        """
+        Return the names of the workspaces in the bundle, in the order they
+        were saved.
+        """
+        return list(self.index["workspaces"])
+
+    def files(self):
+        """
+        Return (workspace, filetype) for every file in the bundle.
+        """
+        return [
+            (workspace, filetype)
+            for workspace, files in self.index["workspaces"].items()
+            for filetype in files
+        ]
+
+    def read(self, workspace, filetype):
+        """
+        Read a workspace's saved file ("layout" or "programs").
+        """
+        entry = self.index["workspaces"].get(workspace, {}).get(filetype)
+        if entry is None:
+            raise FileNotFoundError(
+                f'No saved {filetype} for workspace "{workspace}" in "{self.path}"'
+            )
+        offset, length = entry
+        with self.path.open("rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        if len(data) != length:
+            raise BundleError(f'Corrupt session bundle "{self.path}": truncated')
+        return data
+
+
+class BundleWriter:
+    """
+    Writes a session bundle. Files are streamed to a temporary file as they
+    are added, and the bundle only replaces the previous one on commit().
+    Files in the previous bundle which were not saved again are carried over.
+
+    Args:
+        path: The bundle file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, self.tmp = tempfile.mkstemp(
+            dir=self.path.parent, prefix=f".{self.path.name}."
+        )
+        self.file = os.fdopen(fd, "wb")
+        self.file.write(MAGIC)
+        self.workspaces = {}
+        self.previous = Bundle(self.path)
+        self.changed = False
+        self.lock = threading.Lock()
+        # The order to list workspaces in, if they may be added out of order.
+        self.order = None
+
+    def add(self, workspace, filetype, data):
+        """
+        Add a workspace's saved file. Returns whether it differs from the one
+        in the previous bundle. Files may be added from several threads.
+        """
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(data)
+            self.workspaces.setdefault(workspace, {})[filetype] = [offset, len(data)]
+        try:
+            changed = self.previous.read(workspace, filetype) != data
+        except (FileNotFoundError, BundleError):
+            changed = True
+        if changed:
+            self.changed = True
+        return changed
+
+    def commit(self):
+        """
+        Write the index and atomically replace the previous bundle. If no file
+        changed the previous bundle is left as it is.
+        """
+        if not self.changed:
+            self.abort()
+            return
+        try:
+            if self.order is not None:
+                position = {workspace: i for i, workspace in enumerate(self.order)}
+                self.workspaces = dict(
+                    sorted(
+                        self.workspaces.items(),
+                        key=lambda item: position.get(item[0], len(position)),
+                    )
+                )
+            self._carry_over()
+            offset = self.file.tell()
+            index = {
+                "format": BUNDLE_FORMAT,
+                "version": BUNDLE_VERSION,
+                "workspaces": self.workspaces,
+            }
+            self.file.write(serializer.dumps(index))
+            self.file.write(TRAILER.pack(offset))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            os.replace(self.tmp, self.path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        """
+        Discard everything written, leaving the previous bundle untouched.
+        """
+        self.file.close()
+        try:
+            os.unlink(self.tmp)
+        except FileNotFoundError:
+            pass
+
+    def _carry_over(self):
+        try:
+            files = self.previous.files()
+        except (FileNotFoundError, BundleError):
+            return
+        for workspace, filetype in files:
+            if filetype not in self.workspaces.get(workspace, {}):
+                self.add(workspace, filetype, self.previous.read(workspace, filetype))
+
+
+def from_config(directory, session):
+    """
+    Get a writer for a session's bundle if bundles are enabled in the config,
+    otherwise None.
+
+    Args:
+        directory: The sessions directory.
+        session: The name of the session.
+    """
+    if config.get("session_format", "directory") == "bundle":
+        return BundleWriter(session_path(directory, session))
+    return None
@@ -0,0 +1,214 @@
+"""
+Version history for saved workspaces.
+
+When `history_versions` is set in the config, every save of a workspace or
+profile also records a numbered version containing its layout and programs
+files in `<directory>/.history/<name>/`. The most recent `history_versions`
+versions are kept.
+
+File contents are stored as objects named by their SHA-256. Each object is
+either a full copy or a delta against the object saved before it. A full
+checkpoint is written whenever the delta chain reaches
+`history_checkpoint_interval`, so reconstructing any version never applies
+more than that many deltas.
+"""
+
+import difflib
+import hashlib
+import re
+import time
+import zlib
+from pathlib import Path
+
+from . import blobstore
+from . import config
+from . import serializer
+from . import storage
+
+HISTORY_DIR = ".history"
+INDEX_FILE = "index.json"
+OBJECTS_DIR = "objects"
+
+# Saved files are split after each newline and comma, which gives roughly one
+# token per attribute for both indented and minified JSON.
+TOKEN_SPLIT = re.compile(rb"(?<=[\n,])")
+
+
+class VersionNotFound(Exception):
+    pass
+
+
+class History:
+    """
+    The version history of one saved workspace or profile.
+
+    Args:
+        directory: The directory the workspace is saved in.
+        name: The name the saved files start with, e.g. "workspace_1".
+    """
+
+    def __init__(self, directory, name):
+        self.path = Path(directory) / HISTORY_DIR / name
+        self.objects = self.path / OBJECTS_DIR
+        self.pending = {}
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            try:
+                self._index = serializer.loads((self.path / INDEX_FILE).read_bytes())
+            except FileNotFoundError:
+                self._index = {"next": 1, "versions": [], "objects": {}}
+        return self._index
+
+    def versions(self):
+        return list(self.index["versions"])
+
+    def add(self, filetype, data):
+        """
+        Stage the contents of a saved file ("layout" or "programs") for the
+        next version.
+        """
+        self.pending[filetype] = storage.decompress(data)
+
+    def commit(self, versions=None, checkpoint_interval=None):
+        """
+        Record the staged files as a new version. Files which were not staged
+        are carried over from the previous version. Nothing is recorded if
+        nothing changed.
+
+        Returns the new version number, or None.
+        """
+        if versions is None:
+            versions = config.get("history_versions", 0)
+        if checkpoint_interval is None:
+            checkpoint_interval = config.get("history_checkpoint_interval", 10)
+
+        index = self.index
+        previous = index["versions"][-1]["files"] if index["versions"] else {}
+        files = dict(previous)
+        for filetype, data in self.pending.items():
+            files[filetype] = self._store(
+                data, previous.get(filetype), checkpoint_interval
+            )
+        self.pending = {}
+
+        if files == previous:
+            return None
+
+        version = index["next"]
+        index["next"] += 1
+        index["versions"].append(
+            {"version": version, "saved_at": time.time(), "files": files}
+        )
+        self._prune(versions)
+        self.path.mkdir(parents=True, exist_ok=True)
+        blobstore.write_atomic(
+            self.path / INDEX_FILE, serializer.dumps(index, indent=2)
+        )
+        return version
+
+    def read(self, version, filetype):
+        """
+        Reconstruct a file ("layout" or "programs") as it was at a version.
+        """
+        for entry in self.index["versions"]:
+            if entry["version"] == version:
+                break
+        else:
+            raise VersionNotFound(f"Version {version} not found")
+        if filetype not in entry["files"]:
+            raise VersionNotFound(f"Version {version} has no saved {filetype}")
+        return self._load(entry["files"][filetype])
+
+    def _store(self, data, base, checkpoint_interval):
+        """
+        Store data as an object, as a delta against base unless the chain
+        is already long enough to need a checkpoint.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        objects = self.index["objects"]
+        if digest in objects:
+            return digest
+
+        self.objects.mkdir(parents=True, exist_ok=True)
+        depth = objects[base]["depth"] + 1 if base in objects else 0
+        if depth == 0 or depth >= checkpoint_interval:
+            payload = data
+            objects[digest] = {"base": None, "depth": 0}
+        else:
+            payload = serializer.dumps(make_delta(self._load(base), data))
+            objects[digest] = {"base": base, "depth": depth}
+        blobstore.write_atomic(self.objects / digest, zlib.compress(payload))
+        return digest
+
+    def _load(self, digest):
+        chain = []
+        while digest is not None:
+            chain.append(digest)
+            digest = self.index["objects"][digest]["base"]
+        data = zlib.decompress((self.objects / chain.pop()).read_bytes())
+        for digest in reversed(chain):
+            delta = zlib.decompress((self.objects / digest).read_bytes())
+            data = apply_delta(data, serializer.loads(delta))
+        return data
+
+    def _prune(self, versions):
+        index = self.index
+        if versions > 0:
+            del index["versions"][:-versions]
+
+        # Keep every object referenced by a remaining version, along with
+        # the objects its deltas are based on.
+        keep = set()
+        for entry in index["versions"]:
+            for digest in entry["files"].values():
+                while digest is not None and digest not in keep:
+                    keep.add(digest)
+                    digest = index["objects"][digest]["base"]
+        for digest in list(index["objects"]):
+            if digest not in keep:
+                del index["objects"][digest]
+                try:
+                    (self.objects / digest).unlink()
+                except FileNotFoundError:
+                    pass
+
+
+def make_delta(old, new):
+    """
+    Encode new as a list of operations against old: [start, end] copies a
+    range of old's tokens and a string inserts text.
+    """
+    old_tokens = TOKEN_SPLIT.split(old)
+    new_tokens = TOKEN_SPLIT.split(new)
+    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    delta = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif j2 > j1:
+            delta.append(b"".join(new_tokens[j1:j2]).decode("utf-8"))
+    return delta
+
+
+def apply_delta(old, delta):
+    old_tokens = TOKEN_SPLIT.split(old)
+    parts = []
+    for op in delta:
+        if isinstance(op, list):
+            parts.extend(old_tokens[op[0] : op[1]])
+        else:
+            parts.append(op.encode("utf-8"))
+    return b"".join(parts)
+
+
+def from_config(directory, name):
+    """
+    Get the history for a saved workspace if history is enabled in the
+    config, otherwise None.
+    """
+    if config.get("history_versions", 0) > 0:
+        return History(directory, name)
+    return None
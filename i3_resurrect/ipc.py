@@ -0,0 +1,233 @@
+"""
+Minimal asyncio client for i3's IPC interface.
+
+i3ipc.aio reads each reply with a single recv() of the reply's length, so
+replies larger than the socket buffer, such as the tree of a busy session,
+come back truncated. This client reads replies with asyncio streams, which
+wait for the whole message.
+"""
+
+import asyncio
+import contextlib
+import os
+import select
+import struct
+from collections import deque
+
+from . import serializer
+
+MAGIC = b"i3-ipc"
+HEADER = struct.Struct("=6sII")
+
+# Message types.
+COMMAND = 0
+GET_WORKSPACES = 1
+SUBSCRIBE = 2
+GET_TREE = 4
+
+# Events have the highest bit of their type set.
+EVENT_BIT = 1 << 31
+EVENT_TYPES = {
+    0: "workspace",
+    1: "output",
+    2: "mode",
+    3: "window",
+    4: "barconfig_update",
+    5: "binding",
+    6: "shutdown",
+    7: "tick",
+}
+
+
+class IpcError(Exception):
+    pass
+
+
+async def find_socket_path():
+    """
+    Look up i3's IPC socket the way i3-msg does: from $I3SOCK, then from the
+    root window's I3_SOCKET_PATH property, then from `i3 --get-socketpath`.
+    Returns None if it isn't found.
+    """
+    socket_path = os.environ.get("I3SOCK")
+    if socket_path and os.path.exists(socket_path):
+        return socket_path
+    commands = [
+        ["xprop", "-root", "-notype", "I3_SOCKET_PATH"],
+        ["i3", "--get-socketpath"],
+    ]
+    for command in commands:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except OSError:
+            continue
+        stdout, _ = await process.communicate()
+        if process.returncode != 0:
+            continue
+        output = stdout.decode("utf-8", "replace").strip()
+        if command[0] == "xprop":
+            # I3_SOCKET_PATH = "/run/user/1000/i3/ipc-socket.1234"
+            output = output.partition("=")[2].strip().strip('"')
+        if output and os.path.exists(output):
+            return output
+    return None
+
+
+@contextlib.asynccontextmanager
+async def connect(i3=None):
+    """
+    Connect to i3 for the duration of the block.
+
+    Args:
+        i3: An open AsyncConnection, which is used as it is and left open, or
+            the IPC socket to open a connection to (None to look it up).
+    """
+    if isinstance(i3, AsyncConnection):
+        yield i3
+        return
+    async with AsyncConnection(i3) as connection:
+        yield connection
+
+
+class AsyncConnection:
+    """
+    A connection to i3's IPC socket. Requests may be made concurrently; they
+    are sent one at a time as i3 answers them in order.
+
+    Use as an async context manager, or call open() and close(). Events are
+    best read on a connection of their own, since requests on a subscribed
+    connection wait behind any events which arrive before their replies.
+    """
+
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+        self._events = deque()
+        self._next_event = None
+
+    async def open(self):
+        if self.socket_path is None:
+            self.socket_path = await find_socket_path()
+        if self.socket_path is None:
+            raise IpcError("Failed to retrieve the i3 IPC socket path")
+        self._reader, self._writer = await asyncio.open_unix_connection(
+            self.socket_path
+        )
+        return self
+
+    async def close(self):
+        if self._next_event is not None:
+            self._next_event.cancel()
+            self._next_event = None
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+    @property
+    def is_open(self):
+        """
+        Whether the connection is open and i3 hasn't closed it, e.g. because
+        it was restarted. Only meaningful while no request is being made and
+        no event is expected.
+        """
+        if self._writer is None or self._reader.at_eof():
+            return False
+        # i3 sends nothing on an idle connection, so anything to read means
+        # that it was closed.
+        sock = self._writer.get_extra_info("socket")
+        readable, _, _ = select.select([sock], [], [], 0)
+        return not readable
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def message(self, message_type, payload=""):
+        """
+        Send a message and return the raw reply.
+
+        Args:
+            message_type: The message's type, e.g. GET_TREE.
+            payload: The message's payload.
+        """
+        data = payload.encode("utf-8")
+        async with self._lock:
+            self._writer.write(HEADER.pack(MAGIC, len(data), message_type) + data)
+            await self._writer.drain()
+            while True:
+                reply_type, reply = await self._read()
+                if not reply_type & EVENT_BIT:
+                    return reply
+                # Keep events which arrive before the reply for read_event().
+                self._events.append((reply_type, reply))
+
+    async def read_event(self, timeout=None):
+        """
+        Wait for the next event on a subscribed connection. Returns the event
+        type's name (e.g. "workspace") and its decoded payload, or None if no
+        event arrives within timeout seconds.
+        """
+        if self._events:
+            event_type, data = self._events.popleft()
+        else:
+            # A read which timed out carries on in the background, so that
+            # the stream is never left part way through a message.
+            if self._next_event is None:
+                self._next_event = asyncio.ensure_future(self._read_event())
+            done, _ = await asyncio.wait({self._next_event}, timeout=timeout)
+            if not done:
+                return None
+            event_type, data = self._next_event.result()
+            self._next_event = None
+        name = EVENT_TYPES.get(event_type & ~EVENT_BIT, str(event_type))
+        return name, serializer.loads(data)
+
+    async def _read_event(self):
+        async with self._lock:
+            return await self._read()
+
+    async def _read(self):
+        try:
+            header = await self._reader.readexactly(HEADER.size)
+            magic, length, message_type = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise IpcError("Invalid reply from i3")
+            return message_type, await self._reader.readexactly(length)
+        except asyncio.IncompleteReadError as e:
+            raise IpcError("Connection to i3 closed") from e
+
+    async def get_tree(self):
+        """
+        Get the full layout tree as dicts.
+        """
+        return serializer.loads(await self.message(GET_TREE))
+
+    async def get_workspaces(self):
+        """
+        Get the list of workspaces, with whether each is focused and visible.
+        """
+        return serializer.loads(await self.message(GET_WORKSPACES))
+
+    async def command(self, command):
+        """
+        Run a command. Returns i3's list of results, one per command.
+        """
+        return serializer.loads(await self.message(COMMAND, command))
+
+    async def subscribe(self, events):
+        """
+        Subscribe to events, e.g. ["workspace"].
+        """
+        payload = serializer.dumps(events).decode("utf-8")
+        reply = serializer.loads(await self.message(SUBSCRIBE, payload))
+        if not reply.get("success"):
+            raise IpcError(f"Could not subscribe to {', '.join(events)}")
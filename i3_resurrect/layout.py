@@ -1,74 +1,153 @@
-import json
-import shlex
-import subprocess
-import sys
-import tempfile
+import asyncio
 from pathlib import Path
 
-import i3ipc
-
+from . import blobstore
+from . import config
+from . import history
+from . import profiling
+from . import storage
 from . import treeutils
 from . import util
 
 
-def save(workspace, numeric, directory, profile, swallow_criteria):
+def save(
+    workspace,
+    directory,
+    profile,
+    workspace_layout,
+    store=None,
+    history=None,
+    bundle=None,
+    manifest=None,
+):
     """
-    Save an i3 workspace layout to a file.
+    Save a workspace layout built by build() to a file, or to a session
+    bundle if one is given.
+
+    Returns whether the saved file changed.
     """
-    workspace_id = util.filename_filter(workspace)
-    filename = f"workspace_{workspace_id}_layout.json"
-    if profile is not None:
-        filename = f"{profile}_layout.json"
+    filename = f"{util.saved_name(workspace, profile)}_layout.json"
     layout_file = Path(directory) / filename
 
-    workspace_tree = treeutils.get_workspace_tree(workspace, numeric)
+    # Write it to a file.
+    with profiling.phase("write_layout"):
+        data = storage.dump_layout(
+            workspace_layout,
+            config.get("layout_format", "json"),
+            config.get("layout_compression", None),
+        )
+        if bundle is not None:
+            changed = bundle.add(workspace, "layout", data)
+        else:
+            changed = blobstore.write(layout_file, data, store)
+        if history is not None:
+            history.add("layout", data)
+        if manifest is not None:
+            manifest.add("layout", changed)
+    return changed
+
 
-    with layout_file.open("w") as f:
-        # Build new workspace tree suitable for restoring and write it to a
-        # file.
-        f.write(
-            json.dumps(
-                build_layout(workspace_tree, swallow_criteria),
-                indent=2,
-            )
+def build(workspace_tree, swallow_criteria):
+    """
+    Build the layout to save from a workspace's tree, which is {} for an
+    empty workspace. The compact form is only expanded into dicts as it is
+    written.
+    """
+    with profiling.phase("build_layout"):
+        workspace_layout = treeutils.LayoutNode.from_con(
+            workspace_tree, swallow_criteria
         )
+    if workspace_layout is None:
+        return {}
+    return workspace_layout
 
 
-def read(workspace, directory, profile):
+def read(workspace, directory, profile, version=None, bundle=None):
     """
-    Read saved layout file.
+    Read saved layout file, or a version of it from the history, or the
+    layout from a session bundle. Raises FileNotFoundError,
+    history.VersionNotFound or storage.FormatError, with a message saying
+    which layout, if it can't be read.
     """
-    workspace_id = util.filename_filter(workspace)
-    filename = f"workspace_{workspace_id}_layout.json"
-    if profile is not None:
-        filename = f"{profile}_layout.json"
-    layout_file = Path(directory) / filename
+    name = util.saved_name(workspace, profile)
+    layout_file = Path(directory) / f"{name}_layout.json"
 
-    layout = None
     try:
-        layout = json.loads(layout_file.read_text())
-    except FileNotFoundError:
+        if version is not None:
+            data = history.History(directory, name).read(version, "layout")
+        elif bundle is not None:
+            data = bundle.read(workspace, "layout")
+        else:
+            data = blobstore.read(layout_file)
+        return storage.load_layout(data)
+    except history.VersionNotFound as e:
+        raise history.VersionNotFound(
+            f'Could not restore layout of "{name}": {str(e)}'
+        ) from e
+    except FileNotFoundError as e:
         if profile is not None:
-            util.eprint(f'Could not find saved layout for profile "{profile}"')
+            message = f'Could not find saved layout for profile "{profile}"'
         else:
-            util.eprint('Could not find saved layout for workspace "{workspace}"')
-        sys.exit(1)
-    return layout
+            message = f'Could not find saved layout for workspace "{workspace}"'
+        raise FileNotFoundError(message) from e
+    except (storage.FormatError, ValueError) as e:
+        raise storage.FormatError(
+            f'Could not read saved layout "{layout_file}": {str(e)}'
+        ) from e
+
+
+def restorable_layout(layout):
+    """
+    Get the part of a saved layout which is passed to append_layout: its
+    child nodes, without the workspace node itself.
+    """
+    return (layout.get("nodes", []) + layout.get("floating_nodes", []),)
 
 
-def restore(workspace_name, layout):
+def mark_windows(layout, marks):
     """
-    Restore an i3 workspace layout.
+    Copy a saved layout, adding marks to some of its placeholders.
+
+    Args:
+        layout: The saved layout.
+        marks: Maps the index of a placeholder (in the order of
+            treeutils.get_leaves) to the mark to add to it.
+    """
+    index = 0
+
+    def copy(node):
+        nonlocal index
+        node = dict(node)
+        if "swallows" in node:
+            if index in marks:
+                node["marks"] = list(node.get("marks", [])) + [marks[index]]
+            index += 1
+        for node_type in ["nodes", "floating_nodes"]:
+            if node_type in node:
+                node[node_type] = [copy(child) for child in node[node_type]]
+        return node
+
+    return copy(layout)
+
+
+def count_placeholders(layout):
+    """
+    Count the placeholders in a saved layout.
+    """
+    return sum(1 for node in treeutils.iter_cons(layout) if "swallows" in node)
+
+
+def split_windows(workspace_tree):
+    """
+    Get the ids of a workspace's normal windows and of its placeholder
+    windows.
+
+    Args:
+        workspace_tree: The workspace's layout tree.
     """
-    if layout == {}:
-        return
     window_ids = []
     placeholder_window_ids = []
-
-    # Get ids of all placeholder or normal windows in workspace.
-    ws = treeutils.get_workspace_tree(workspace_name, False)
-    windows = treeutils.get_leaves(ws)
-    for con in windows:
+    for con in treeutils.get_leaves(workspace_tree):
         window_id = con["window"]
         if is_placeholder(con):
             # If window is a placeholder, add it to list of placeholder
@@ -77,62 +156,7 @@ def restore(workspace_name, layout):
         else:
             # Otherwise, add it to the list of regular windows.
             window_ids.append(window_id)
-
-    # Unmap all non-placeholder windows in workspace.
-    for window_id in window_ids:
-        xdo_unmap_window(window_id)
-
-    # Remove any remaining placeholder windows in workspace so that we don't
-    # have duplicates.
-    for window_id in placeholder_window_ids:
-        xdo_kill_window(window_id)
-
-    try:
-        i3 = i3ipc.Connection()
-
-        # append_layout can only insert nodes so we must separately change the
-        # layout mode of the workspace node.
-        ws_layout_mode = layout.get("layout", "default")
-        tree = i3.get_tree()
-        focused = tree.find_focused()
-        workspace_node = focused.workspace()
-        workspace_node.command(f"layout {ws_layout_mode}")
-
-        # We don't want to pass the whole layout file because we don't want to
-        # append a new workspace. append_layout requires a file path so we must
-        # extract the part of the json that we want and store it in a tempfile.
-        restorable_layout = (
-            layout.get("nodes", []) + layout.get("floating_nodes", []),
-        )
-        restorable_layout_file = tempfile.NamedTemporaryFile(
-            mode="w",
-            prefix="i3-resurrect_",
-        )
-        restorable_layout_file.write(json.dumps(restorable_layout))
-        restorable_layout_file.flush()
-
-        # Create fresh placeholder windows by appending layout to workspace.
-        i3.command(f"append_layout {restorable_layout_file.name}")
-
-        # Move workspace to original output
-        if "output" in layout:
-            i3.command(
-                f'[workspace="{workspace_name}"] move workspace to output {layout["output"]}'
-            )
-
-        # Delete tempfile.
-        restorable_layout_file.close()
-    except Exception as e:
-        util.eprint(
-            "Error occurred restoring workspace layout. Note that if the layout was saved by a "
-            "version prior to 1.4.0 it must be recreated."
-        )
-        util.eprint(str(e))
-    finally:
-        # Map all unmapped windows. We use finally because we don't want the
-        # user to lose their windows no matter what.
-        for window_id in window_ids:
-            xdo_map_window(window_id)
+    return window_ids, placeholder_window_ids
 
 
 def build_layout(tree, swallow):
@@ -154,28 +178,16 @@ def is_placeholder(container):
     return container["swallows"] not in [[], None]
 
 
-def xdo_unmap_window(window_id):
-    command = shlex.split(f"xdotool windowunmap {window_id}")
-    subprocess.call(
-        command,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
-
-
-def xdo_map_window(window_id):
-    command = shlex.split(f"xdotool windowmap {window_id}")
-    subprocess.call(
-        command,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
-
-
-def xdo_kill_window(window_id):
-    command = shlex.split(f"xdotool windowkill {window_id}")
-    subprocess.call(
-        command,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
+async def xdo_async(action, window_id):
+    """
+    Run an xdotool window action, e.g. "windowunmap", without blocking the
+    event loop.
+    """
+    process = await asyncio.create_subprocess_exec(
+        "xdotool",
+        action,
+        str(window_id),
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
     )
+    await process.wait()
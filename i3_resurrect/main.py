@@ -1,29 +1,140 @@
+import functools
+import json
 import sys
+from datetime import datetime
 from pathlib import Path
 
 import click
 import i3ipc
 import shutil
 
-from . import config
-from . import layout
-from . import programs
+from . import blobstore
+from . import bundle
+from . import history
+from . import manifest
+from . import multidisplay
+from . import priority
+from . import profiling
+from . import snapshot
+from . import startup
+from . import storage
 from . import util
 
-DEFAULT_DIRECTORY = config.get("directory", "~/.i3/i3-resurrect/")
+DEFAULT_DIRECTORY = snapshot.DEFAULT_DIRECTORY
+
+# The errors of the snapshot module, which are reported without a traceback.
+SNAPSHOT_ERRORS = (
+    snapshot.SnapshotError,
+    history.VersionNotFound,
+    storage.FormatError,
+    priority.ConfigError,
+)
+
+
+def complete_saved(kind):
+    """
+    Shell completion of saved workspace, profile or session names. Names are
+    read from the manifest so that completion doesn't scan the directory.
+
+    Args:
+        kind: "workspace", "profile" or "session".
+    """
+
+    def complete(ctx, param, incomplete):
+        directory = ctx.params.get("directory") or DEFAULT_DIRECTORY
+        index = manifest.Manifest(util.resolve_directory(directory))
+        if kind == "session":
+            names = index.sessions()
+        else:
+            session = ctx.params.get("session") if kind == "workspace" else None
+            names = [entry["name"] for entry in index.find(kind, session)]
+        return [name for name in names if name.startswith(incomplete)]
+
+    return complete
+
+
+def per_display(writes=False):
+    """
+    Add the --display, --socket and --timeout options to a command, which
+    run it for each of the given displays in parallel.
+
+    Args:
+        writes: Whether the command writes to its directory, in which case
+            the displays must each have their own.
+    """
+    return functools.partial(_per_display, writes=writes)
+
+
+def _per_display(function, writes):
+    @click.option(
+        "--display",
+        "displays",
+        multiple=True,
+        help=(
+            "An X display to run for, e.g. :1. May be given several times to run "
+            "for each display in parallel. $DISPLAY in the directory is expanded "
+            "for each display."
+        ),
+    )
+    @click.option(
+        "--socket",
+        "sockets",
+        multiple=True,
+        help=(
+            "The i3 IPC socket of a display. May be given several times, paired "
+            "in order with --display."
+        ),
+    )
+    @click.option(
+        "--timeout",
+        type=float,
+        default=None,
+        help="The number of seconds after which a display is given up on.",
+    )
+    @functools.wraps(function)
+    def command(displays, sockets, timeout, **params):
+        if not displays and not sockets:
+            return function(**params)
+        directory = params["directory"] if writes else None
+        multidisplay.run(function, params, displays, sockets, timeout, directory)
+
+    return command
+
+
+def focused_workspace(i3):
+    """
+    Get the name of the focused workspace.
+
+    Args:
+        i3: The i3ipc connection to i3.
+    """
+    # i3ipc builds an object for every container of the tree, which takes far
+    # longer than reading the list of workspaces.
+    return next(ws.name for ws in i3.get_workspaces() if ws.focused)
 
 
 @click.group(
     context_settings=dict(help_option_names=["-h", "--help"], max_content_width=150)
 )
 @click.version_option()
-def main():
-    pass
+@click.option(
+    "--trace-memory",
+    is_flag=True,
+    help="Trace memory allocations and print a report per phase to stderr.",
+)
+@click.pass_context
+def main(ctx, trace_memory):
+    if trace_memory:
+        profiling.enable()
+        ctx.call_on_close(profiling.report)
 
 
 @main.command("save")
 @click.option(
-    "--workspace", "-w", help="The workspace to save.\n[default: current workspace]"
+    "--workspace",
+    "-w",
+    help="The workspace to save.\n[default: current workspace]",
+    shell_complete=complete_saved("workspace"),
 )
 @click.option(
     "--numeric", "-n", is_flag=True, help="Select workspace by number instead of name."
@@ -36,10 +147,18 @@ def main():
     help="The directory to save the workspace to.\n[default: ~/.i3/i3-resurrect]",
 )
 @click.option(
-    "--profile", "-p", default=None, help=("The profile to save the workspace to.")
+    "--profile",
+    "-p",
+    default=None,
+    help=("The profile to save the workspace to."),
+    shell_complete=complete_saved("profile"),
 )
 @click.option(
-    "--session", "-S", default=None, help="Save all workspaces."
+    "--session",
+    "-S",
+    default=None,
+    help="Save all workspaces.",
+    shell_complete=complete_saved("session"),
 )
 @click.option(
     "--swallow",
@@ -60,40 +179,42 @@ def main():
     flag_value="programs_only",
     help="Only save running programs.",
 )
+@per_display(writes=True)
 def save_workspace(workspace, numeric, directory, profile, session, swallow, target):
     """
     Save an i3 workspace's layout and running programs to a file.
     """
-    workspaces = []
-    directory = util.resolve_directory(directory, profile, session)
-
+    i3 = None
     if session is not None:
-        i3 = i3ipc.Connection()
-        workspaces = i3.get_workspaces()
-        directory = directory / session
+        # Every workspace is saved.
+        workspaces = None
     elif workspace is None:
         i3 = i3ipc.Connection()
-        workspace = i3.get_tree().find_focused().workspace()
+        workspaces = [focused_workspace(i3)]
+    else:
         workspaces = [workspace]
 
-    # Create directory if non-existent.
-    Path(directory).mkdir(parents=True, exist_ok=True)
-
-    for ws in workspaces:
-
-        if target != "programs_only":
-            # Save workspace layout to file.
-            swallow_criteria = swallow.split(",")
-            layout.save(ws.name, numeric, directory, profile, swallow_criteria)
+    try:
+        captured = snapshot.Snapshot.capture(
+            i3, workspaces, numeric, swallow.split(","), target
+        )
+        saved = captured.save(snapshot.Store(directory, profile, session))
+    except SNAPSHOT_ERRORS as e:
+        util.eprint(str(e))
+        sys.exit(1)
 
-        if target != "layout_only":
-            # Save running programs to file.
-            programs.save(ws.name, numeric, directory, profile)
+    # Unchanged workspaces were not written, only report the ones that were.
+    for workspace in saved:
+        if workspace.changed:
+            print(f"Saved workspace {workspace.name}")
 
 
 @main.command("restore")
 @click.option(
-    "--workspace", "-w", help="The workspace to restore.\n[default: current workspace]"
+    "--workspace",
+    "-w",
+    help="The workspace to restore.\n[default: current workspace]",
+    shell_complete=complete_saved("workspace"),
 )
 @click.option(
     "--numeric", "-n", is_flag=True, help="Select workspace by number instead of name."
@@ -106,10 +227,29 @@ def save_workspace(workspace, numeric, directory, profile, session, swallow, tar
     help="The directory to restore the workspace from.\n[default: ~/.i3/i3-resurrect]",
 )
 @click.option(
-    "--profile", "-p", default=None, help=("The profile to restore the workspace from.")
+    "--profile",
+    "-p",
+    default=None,
+    help=("The profile to restore the workspace from."),
+    shell_complete=complete_saved("profile"),
 )
 @click.option(
-    "--session", "-S", default=None, help=("The session to restore the workspace from.")
+    "--session",
+    "-S",
+    default=None,
+    help=("The session to restore the workspace from."),
+    shell_complete=complete_saved("session"),
+)
+@click.option(
+    "--version",
+    "-V",
+    "version",
+    type=int,
+    default=None,
+    help=(
+        "The saved version to restore (see the history command). Can't be used "
+        "with --session."
+    ),
 )
 @click.option(
     "--layout-only", "target", flag_value="layout_only", help="Only restore layout."
@@ -120,52 +260,89 @@ def save_workspace(workspace, numeric, directory, profile, session, swallow, tar
     flag_value="programs_only",
     help="Only restore running programs.",
 )
-def restore_workspace(workspace, numeric, directory, profile, session, target):
+@click.option(
+    "--background",
+    "-b",
+    is_flag=True,
+    help="Restore without switching to each workspace.",
+)
+@click.option(
+    "--lazy",
+    "-l",
+    is_flag=True,
+    help=(
+        "Restore each workspace when it is first visited. Keeps running until "
+        "every workspace has been restored."
+    ),
+)
+@click.option(
+    "--defer-hidden",
+    is_flag=True,
+    help=(
+        "Launch the programs in hidden tabs when their placeholders are first "
+        "focused. Keeps running until every program has been launched."
+    ),
+)
+@click.option(
+    "--reuse",
+    is_flag=True,
+    help=(
+        "Take the windows of programs which are already running on other "
+        "workspaces instead of launching them again."
+    ),
+)
+# Restore only writes the learned startup times, which are updated under a lock,
+# so displays may restore from the same directory.
+@per_display()
+def restore_workspace(
+    workspace,
+    numeric,
+    directory,
+    profile,
+    session,
+    version,
+    target,
+    background,
+    lazy,
+    defer_hidden,
+    reuse,
+):
     """
     Restore i3 workspace layout and programs.
     """
+    if session is not None and version is not None:
+        # Each workspace's versions are numbered separately.
+        util.eprint("--version can't be used with --session.")
+        sys.exit(1)
+
     i3 = i3ipc.Connection()
-    workspaces = []
 
     if workspace is None:
-        workspace = i3.get_tree().find_focused().workspace().name
-
-    directory = util.resolve_directory(directory, profile, session)
+        workspace = focused_workspace(i3)
 
     if numeric and not workspace.isdigit():
         util.eprint("Invalid workspace number.")
         sys.exit(1)
 
-    if session is not None:
-        directory = directory / session
-        # Error check if directory exists
-        for file in directory.iterdir():
-            if "_layout" not in file.name:
-                continue
-            workspaces.append(file.name.split("_")[1])
-    else:
-        workspaces.append(workspace)
-
-    for ws in workspaces:
-
-        # Get layout name from file.
-        workspace_layout = layout.read(ws, directory, profile)
-        if "name" in workspace_layout and profile is None:
-            workspace_name = workspace_layout["name"]
-        else:
-            workspace_name = ws
-
-        # Switch to the workspace which we are loading.
-        i3.command(f'workspace --no-auto-back-and-forth "{workspace_name}"')
-
-        if target != "programs_only":
-            # Load workspace layout.
-            layout.restore(workspace_name, workspace_layout)
-
-        if target != "layout_only":
-            # Restore programs.
-            saved_programs = programs.read(ws, directory, profile)
-            programs.restore(workspace_name, saved_programs)
+    store = snapshot.Store(directory, profile, session)
+    # A session restores every workspace saved in it.
+    workspaces = None if session is not None else [workspace]
+    try:
+        saved = snapshot.Snapshot.load(store, workspaces, version, target)
+        snapshot.restore(
+            i3,
+            saved,
+            target,
+            background,
+            lazy,
+            visible_first=session is not None,
+            defer_hidden=defer_hidden,
+            startup_times=startup.from_config(store.root),
+            reuse=reuse,
+        )
+    except SNAPSHOT_ERRORS as e:
+        util.eprint(str(e))
+        sys.exit(1)
 
 
 @main.command("ls")
@@ -176,41 +353,130 @@ def restore_workspace(workspace, numeric, directory, profile, session, target):
     default=DEFAULT_DIRECTORY,
     help="The directory to search in.\n[default: ~/.i3/i3-resurrect]",
 )
+@click.option(
+    "--format",
+    "-f",
+    "output_format",
+    type=click.Choice(["text", "json", "lines"]),
+    default="text",
+    help=(
+        "The output format. json prints a list of records and lines prints one "
+        "tab separated record (kind, name, has_layout, has_programs, mtime) per "
+        "line.\n[default: text]"
+    ),
+)
 @click.argument(
     "item", type=click.Choice(["workspaces", "profiles", "sessions"]), default="workspaces"
 )
-def list_workspaces(directory, item):
+def list_workspaces(directory, output_format, item):
     """
     List saved workspaces or profiles.
     """
-    directory = util.resolve_directory(directory)
+    index = manifest.Manifest(util.resolve_directory(directory))
 
-    if item == "workspaces":
-        for workspace in util.get_list_of_workspaces(directory):
-            print(f'Workspace {workspace}')
+    if item == "sessions":
+        records = [
+            manifest.session_record(session, index.find("workspace", session))
+            for session in index.sessions()
+        ]
+    else:
+        kind = "workspace" if item == "workspaces" else "profile"
+        records = [manifest.to_record(entry) for entry in index.find(kind)]
+
+    if output_format == "json":
+        print(json.dumps(records, indent=2))
+    elif output_format == "lines":
+        for record in records:
+            print(
+                "\t".join(
+                    [
+                        record["kind"],
+                        record["name"],
+                        json.dumps(record["has_layout"]),
+                        json.dumps(record["has_programs"]),
+                        f'{record["mtime"] or 0:.0f}',
+                    ]
+                )
+            )
+    elif item == "workspaces":
+        for record in records:
+            print_files("Workspace", record)
     elif item == "profiles":
-        directory = directory / "profiles"
-        try:
-            for profile in util.get_list_of_workspaces(directory, is_profile=True):
-                print(f'Profile {profile}')
-        except FileNotFoundError:
+        if not records:
             print("No profiles found")
+        for record in records:
+            print_files("Profile", record)
     else:
-        directory = directory / "sessions"
-        try:
-            for entry in directory.iterdir():
-                if entry.is_dir():
-                    sessions = []
-                    name = entry.name
-                    sessions.append(f"Session {name}")
-                    for workspace in util.get_list_of_workspaces(directory/name):
-                        print(f'Workspace {workspace}')
-        except FileNotFoundError:
+        if not records:
             print("No sessions found")
+        for record in records:
+            print(f'Session {record["name"]}')
+            for workspace in record["workspaces"]:
+                print_files("Workspace", workspace)
+
+
+def print_files(label, record):
+    if record["has_layout"]:
+        print(f'{label} {record["name"]} layout')
+    if record["has_programs"]:
+        print(f'{label} {record["name"]} programs')
+
+
+@main.command("history")
+@click.option(
+    "--workspace",
+    "-w",
+    help="The saved workspace.\n[default: current workspace]",
+    shell_complete=complete_saved("workspace"),
+)
+@click.option(
+    "--directory",
+    "-d",
+    type=click.Path(file_okay=False),
+    default=DEFAULT_DIRECTORY,
+    help="The directory the workspace is saved in.\n[default: ~/.i3/i3-resurrect]",
+)
+@click.option(
+    "--profile",
+    "-p",
+    default=None,
+    help=("The saved profile."),
+    shell_complete=complete_saved("profile"),
+)
+@click.option(
+    "--session",
+    "-S",
+    default=None,
+    help=("The session the workspace is saved in."),
+    shell_complete=complete_saved("session"),
+)
+def list_history(workspace, directory, profile, session):
+    """
+    List the saved versions of a workspace or profile.
+    """
+    if workspace is None and profile is None:
+        i3 = i3ipc.Connection()
+        workspace = focused_workspace(i3)
+
+    directory = util.resolve_directory(directory, profile, session)
+    if session is not None:
+        directory = directory / session
+
+    versions = history.History(directory, util.saved_name(workspace, profile))
+    for entry in reversed(versions.versions()):
+        saved_at = datetime.fromtimestamp(entry["saved_at"])
+        files = ", ".join(sorted(entry["files"]))
+        print(f'Version {entry["version"]} {saved_at:%Y-%m-%d %H:%M:%S} {files}')
 
 
 @main.command("rm")
-@click.option("--workspace", "-w", default=None, help="The saved workspace to delete.")
+@click.option(
+    "--workspace",
+    "-w",
+    default=None,
+    help="The saved workspace to delete.",
+    shell_complete=complete_saved("workspace"),
+)
 @click.option(
     "--directory",
     "-d",
@@ -218,8 +484,20 @@ def list_workspaces(directory, item):
     default=DEFAULT_DIRECTORY,
     help="The directory to delete from.\n[default: ~/.i3/i3-resurrect]",
 )
-@click.option("--profile", "-p", default=None, help=("The profile to delete."))
-@click.option("--session", "-S", default=None, help=("The session to delete."))
+@click.option(
+    "--profile",
+    "-p",
+    default=None,
+    help=("The profile to delete."),
+    shell_complete=complete_saved("profile"),
+)
+@click.option(
+    "--session",
+    "-S",
+    default=None,
+    help=("The session to delete."),
+    shell_complete=complete_saved("session"),
+)
 @click.option(
     "--layout-only",
     "target",
@@ -236,32 +514,51 @@ def remove(workspace, directory, profile, session, target):
     """
     Remove saved layout or programs.
     """
+    root = util.resolve_directory(directory)
+    store = blobstore.from_config(root)
+    index = manifest.Manifest(root)
     directory = util.resolve_directory(directory, profile, session)
 
     if session is not None:
         session_dir = Path(directory) / session
-        shutil.rmtree(session_dir)
+        bundle_file = bundle.session_path(directory, session)
+        if bundle_file.exists():
+            bundle_file.unlink()
+            if session_dir.exists():
+                shutil.rmtree(session_dir)
+        else:
+            shutil.rmtree(session_dir)
+        index.remove(session=session)
+        index.save()
+        if store is not None:
+            store.gc()
         return
     elif profile is not None:
-        programs_filename = f"{profile}_programs.json"
-        layout_filename = f"{profile}_layout.json"
+        kind, name = "profile", profile
     elif workspace is not None:
-        workspace_id = util.filename_filter(workspace)
-        programs_filename = f"workspace_{workspace_id}_programs.json"
-        layout_filename = f"workspace_{workspace_id}_layout.json"
+        kind, name = "workspace", workspace
     else:
         util.eprint("--session, --profile, or --workspace must be specified.")
         sys.exit(1)
-    programs_file = Path(directory) / programs_filename
-    layout_file = Path(directory) / layout_filename
+    filename = util.saved_name(workspace, profile)
+    programs_file = Path(directory) / f"{filename}_programs.json"
+    layout_file = Path(directory) / f"{filename}_layout.json"
 
-    if target != "programs_only":
+    if target != "layout_only":
         # Delete programs file.
         programs_file.unlink()
+        index.remove(kind, name, filetype="programs")
 
-    if target != "layout_only":
+    if target != "programs_only":
         # Delete layout file.
         layout_file.unlink()
+        index.remove(kind, name, filetype="layout")
+
+    index.save()
+
+    if store is not None:
+        # Delete blobs which are no longer referenced.
+        store.gc()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,258 @@
+"""
+An index of everything saved in an i3-resurrect directory.
+
+`save` and `rm` keep `manifest.json` in the top level directory up to date
+with every saved workspace, profile and session workspace, which files it has,
+when they last changed and how many windows were saved. `ls` and
+`restore --session` read it instead of scanning directories and parsing file
+names, which also means workspace names containing underscores are handled
+correctly.
+
+If the manifest is missing or unreadable (e.g. the directory was written by
+an older version) it is rebuilt by scanning the directory once.
+"""
+
+import time
+from pathlib import Path
+
+from natsort import natsort_keygen
+
+from . import blobstore
+from . import bundle
+from . import serializer
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_FORMAT = "i3-resurrect-manifest"
+MANIFEST_VERSION = 1
+
+FILETYPES = ["layout", "programs"]
+
+
+class Manifest:
+    """
+    The manifest of a top level i3-resurrect directory.
+
+    Each entry is a dict with the keys:
+
+    - kind: "workspace" or "profile".
+    - name: The workspace or profile name.
+    - session: The session the workspace was saved in, if any.
+    - files: The mtime of each saved file, by file type.
+    - windows: The number of saved programs, if known.
+
+    Args:
+        root: The top level i3-resurrect directory.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.path = self.root / MANIFEST_FILE
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            try:
+                manifest = serializer.loads(self.path.read_bytes())
+                if manifest.get("version") != MANIFEST_VERSION:
+                    raise ValueError("unsupported manifest version")
+                self._entries = {_key(e): e for e in manifest["entries"]}
+            except (FileNotFoundError, ValueError, KeyError, TypeError):
+                self.rebuild()
+        return self._entries
+
+    def rebuild(self):
+        """
+        Rebuild the manifest by scanning the directory, and write it so that
+        the next read doesn't have to.
+        """
+        self._entries = {_key(e): e for e in scan(self.root)}
+        if self.root.is_dir():
+            self.save()
+
+    def find(self, kind=None, session=None):
+        """
+        Return the entries of a kind, naturally sorted by name. Workspaces
+        saved in a session are only returned if the session is given.
+        """
+        return sorted(
+            (
+                entry
+                for entry in self.entries.values()
+                if kind in (None, entry["kind"]) and entry.get("session") == session
+            ),
+            key=_sort_key,
+        )
+
+    def sessions(self):
+        """
+        Return the names of all saved sessions, naturally sorted.
+        """
+        names = {e["session"] for e in self.entries.values() if "session" in e}
+        return sorted(names, key=_natsort_key)
+
+    def entry(self, kind, name, session=None):
+        """
+        Get the entry for a workspace or profile which is being saved.
+
+        Args:
+            kind: "workspace" or "profile".
+            name: The workspace or profile name.
+            session: The session the workspace is being saved in.
+        """
+        key = (kind, session, name)
+        if key not in self.entries:
+            entry = {"kind": kind, "name": name, "files": {}}
+            if session is not None:
+                entry["session"] = session
+            self.entries[key] = entry
+        return Entry(self.entries[key])
+
+    def remove(self, kind=None, name=None, session=None, filetype=None):
+        """
+        Remove the entries for deleted files. Every argument which is None
+        matches anything, except that session workspaces are only removed if
+        a session is given.
+        """
+        for key, entry in list(self.entries.items()):
+            if (
+                kind in (None, entry["kind"])
+                and name in (None, entry["name"])
+                and entry.get("session") == session
+            ):
+                if filetype is not None:
+                    entry["files"].pop(filetype, None)
+                if filetype is None or not entry["files"]:
+                    del self.entries[key]
+
+    def save(self):
+        """
+        Write the manifest if it changed.
+        """
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "version": MANIFEST_VERSION,
+            "entries": sorted(self.entries.values(), key=_sort_key),
+        }
+        self.root.mkdir(parents=True, exist_ok=True)
+        blobstore.write(self.path, serializer.dumps(manifest, indent=2))
+
+
+def to_record(entry):
+    """
+    Convert a manifest entry to the record printed by `ls --format`.
+    """
+    record = {"kind": entry["kind"], "name": entry["name"]}
+    if "session" in entry:
+        record["session"] = entry["session"]
+    record["has_layout"] = "layout" in entry["files"]
+    record["has_programs"] = "programs" in entry["files"]
+    record["mtime"] = max(entry["files"].values(), default=None)
+    record["windows"] = entry.get("windows")
+    return record
+
+
+def session_record(session, entries):
+    """
+    Summarise the entries saved in a session as one `ls --format` record.
+    """
+    records = [to_record(entry) for entry in entries]
+    return {
+        "kind": "session",
+        "name": session,
+        "has_layout": any(r["has_layout"] for r in records),
+        "has_programs": any(r["has_programs"] for r in records),
+        "mtime": max((r["mtime"] for r in records), default=None),
+        "windows": sum(r["windows"] or 0 for r in records),
+        "workspaces": records,
+    }
+
+
+class Entry:
+    """
+    Records the files saved for one manifest entry.
+    """
+
+    def __init__(self, entry):
+        self.entry = entry
+
+    def add(self, filetype, changed, windows=None):
+        """
+        Record that a file ("layout" or "programs") was saved.
+
+        Args:
+            filetype: The type of file saved.
+            changed: Whether the file's contents changed.
+            windows: The number of saved programs.
+        """
+        files = self.entry["files"]
+        if changed or filetype not in files:
+            files[filetype] = time.time()
+        if windows is not None:
+            self.entry["windows"] = windows
+
+
+def scan(root):
+    """
+    Build manifest entries by scanning a directory and parsing file names.
+    """
+    root = Path(root)
+    entries = {}
+
+    def add(kind, name, filetype, mtime, session=None):
+        key = (kind, session, name)
+        if key not in entries:
+            entries[key] = {"kind": kind, "name": name, "files": {}}
+            if session is not None:
+                entries[key]["session"] = session
+        entries[key]["files"][filetype] = mtime
+
+    def scan_files(directory, kind, session=None):
+        for file in directory.glob("*.json"):
+            name, filetype = _parse_filename(file.name, kind)
+            if filetype in FILETYPES:
+                add(kind, name, filetype, file.stat().st_mtime, session)
+
+    if root.is_dir():
+        scan_files(root, "workspace")
+    if (root / "profiles").is_dir():
+        scan_files(root / "profiles", "profile")
+    sessions = root / "sessions"
+    if sessions.is_dir():
+        for entry in sessions.iterdir():
+            if entry.is_dir():
+                scan_files(entry, "workspace", entry.name)
+            elif entry.suffix == bundle.BUNDLE_SUFFIX:
+                session = entry.name[: -len(bundle.BUNDLE_SUFFIX)]
+                mtime = entry.stat().st_mtime
+                try:
+                    files = bundle.Bundle(entry).files()
+                except bundle.BundleError:
+                    continue
+                for name, filetype in files:
+                    add("workspace", name, filetype, mtime, session)
+    return list(entries.values())
+
+
+def _parse_filename(filename, kind):
+    """
+    Split a saved file name into the workspace or profile name and file type.
+    """
+    stem = filename[: -len(".json")]
+    name, _, filetype = stem.rpartition("_")
+    if kind == "workspace":
+        if not name.startswith("workspace_"):
+            return None, None
+        name = name[len("workspace_") :]
+    return name, filetype
+
+
+def _key(entry):
+    return (entry["kind"], entry.get("session"), entry["name"])
+
+
+_natsort_key = natsort_keygen()
+
+
+def _sort_key(entry):
+    return (entry.get("session") or "", entry["kind"], _natsort_key(entry["name"]))
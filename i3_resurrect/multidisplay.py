@@ -0,0 +1,167 @@
+"""
+Saving and restoring several X displays, each with its own i3, at once.
+
+save and restore take any number of --display options, each optionally
+paired with a --socket. Each display is saved or restored in a process of its
+own, with DISPLAY and I3SOCK set for it, so it has its own IPC connections,
+xprop lookups and window cache, and the displays run in parallel. The output
+of each display is printed, prefixed with the display, as soon as it has
+finished, so a display which hangs doesn't hold back the others, and with
+--timeout it is killed once the time is up.
+"""
+
+import io
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+import traceback
+from contextlib import contextmanager
+from contextlib import redirect_stderr
+from contextlib import redirect_stdout
+
+from . import util
+
+
+def targets(displays, sockets):
+    """
+    Get a label and the environment variables to set for each display.
+    Sockets are paired with the displays in order. A display without a socket
+    has I3SOCK unset, so that its i3 is found through the display.
+
+    Args:
+        displays: The X displays, e.g. ":1".
+        sockets: The i3 IPC socket paths.
+    """
+    # The display can't be found from a socket, and xprop and xdotool need it.
+    if sockets and len(displays) != len(sockets):
+        util.eprint("--socket must be given with a --display for each socket")
+        sys.exit(1)
+    found = []
+    for i, display in enumerate(displays):
+        socket = sockets[i] if sockets else None
+        found.append((display, {"I3SOCK": socket, "DISPLAY": display}))
+    return found
+
+
+def check_directories(directory, found):
+    """
+    Exit with an error if several displays would write to the same
+    directory.
+
+    Args:
+        directory: The directory given, in which $DISPLAY is expanded for
+            each display.
+        found: The labels and environments of the displays from targets().
+    """
+    seen = {}
+    for label, environ in found:
+        with _environment(environ):
+            resolved = util.resolve_directory(directory)
+        if resolved in seen:
+            util.eprint(
+                f'{seen[resolved]} and {label} would both save to "{resolved}", '
+                "put $DISPLAY in the directory to keep them apart, e.g. "
+                "-d '~/.i3/i3-resurrect/$DISPLAY'"
+            )
+            sys.exit(1)
+        seen[resolved] = label
+
+
+def run(function, params, displays, sockets, timeout=None, directory=None):
+    """
+    Call a command's function for each display in parallel and print their
+    output. Exits with an error if any of them failed or timed out.
+
+    Args:
+        function: The command's function.
+        params: The keyword arguments to call it with.
+        displays: The X displays to run it for.
+        sockets: The i3 IPC sockets to run it for.
+        timeout: The number of seconds after which a display is given up on,
+            or None to wait for every display.
+        directory: The directory the command writes to, if it writes, which
+            must differ between the displays.
+    """
+    found = targets(displays, sockets)
+    if directory is not None:
+        check_directories(directory, found)
+
+    # Fork, so that the workers start with this process' config.
+    context = multiprocessing.get_context("fork")
+    workers = {}
+    for label, environ in found:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(
+            target=_worker, args=(sender, function, params, environ)
+        )
+        process.start()
+        sender.close()
+        workers[receiver] = (label, process)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    failed = []
+    while workers:
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        ready = multiprocessing.connection.wait(list(workers), remaining)
+        if not ready:
+            for label, process in workers.values():
+                process.kill()
+                process.join()
+                util.eprint(f"{label}: Timed out after {timeout:g} seconds")
+                failed.append(label)
+            break
+        for receiver in ready:
+            label, process = workers.pop(receiver)
+            try:
+                code, stdout, stderr = receiver.recv()
+            except EOFError:
+                # The worker died without a result.
+                code, stdout, stderr = 1, "", ""
+            process.join()
+            for line in stdout.splitlines():
+                print(f"{label}: {line}")
+            for line in stderr.splitlines():
+                util.eprint(f"{label}: {line}")
+            if code != 0:
+                failed.append(label)
+
+    if failed:
+        util.eprint(f'Failed for {", ".join(failed)}')
+        sys.exit(1)
+
+
+@contextmanager
+def _environment(environ):
+    saved = {key: os.environ.get(key) for key in environ}
+    _set_environment(environ)
+    try:
+        yield
+    finally:
+        _set_environment(saved)
+
+
+def _set_environment(environ):
+    for key, value in environ.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
+
+def _worker(connection, function, params, environ):
+    _set_environment(environ)
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    code = 0
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            function(**params)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            traceback.print_exc()
+            code = 1
+    connection.send((code, stdout.getvalue(), stderr.getvalue()))
+    connection.close()
@@ -0,0 +1,964 @@
+"""
+Asynchronous save and restore pipelines.
+
+Saving a workspace involves an i3 IPC call, an xprop process per window,
+reading each window's process information and writing files. Run one after
+the other for every workspace in a session, the total time is the sum of all
+of them. Here the tree is fetched once for all workspaces, every window's PID
+is looked up concurrently and processes are inspected in worker threads
+(capture_async). The workspaces' files are then written concurrently in
+worker threads (write_async), so a session save takes about as long as its
+slowest operations.
+Windows whose processes were already looked up by an earlier save are taken
+from the window cache (see the windowcache module) instead.
+
+Restoring reads and validates every saved file before anything in i3 is
+changed, then prepares all workspaces at once: the layouts to append are
+written out and the programs already running in each workspace are looked up
+concurrently. The i3 commands which depend on the focused workspace are then
+sent in order, one workspace after another, while the remaining preparation
+continues in the background. A workspace's programs are launched as soon as
+its layout has been appended, so they start up while the next workspace's
+layout is being set up. Programs are launched at the priority set by the
+launch_priority config (see the priority module).
+
+Sessions are restored in order of visibility: the focused workspace first,
+then the workspaces visible on other outputs. Focus is then given back and the
+hidden workspaces are restored in the background mode.
+
+In the background mode, workspaces are restored without switching to them.
+i3 only appends layouts to the focused workspace, so a workspace which doesn't
+exist yet is appended whole (which i3 adds to the focused output without
+changing focus), while the layout for an existing workspace is appended with
+temporary marks and moved to it by mark in the same message, before i3 redraws.
+
+With reuse, the programs which are running on other workspaces are not
+launched again. Their windows are unmapped along with the workspace's own
+windows while its layout is appended, so that the placeholders swallow them
+when they are mapped again, and any which aren't swallowed are moved to the
+workspace. Windows are only taken from a workspace being restored if it
+doesn't need them itself.
+
+In the lazy mode, the workspaces are only restored as they are first visited,
+by listening for workspace events from i3. Similarly, the programs which were
+in hidden tabs can be left to be launched when their placeholders are first
+focused. Both keep a copy of the tree up to date from the events (see the
+treemirror module), rather than fetching it again after every event.
+
+The snapshot module is the public interface to these pipelines.
+"""
+
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+
+from . import history
+from . import ipc
+from . import layout
+from . import priority
+from . import profiling
+from . import programs
+from . import serializer
+from . import treemirror
+from . import treeutils
+from . import util
+from . import windowcache
+
+# Prefix of the temporary marks used to restore in the background. Marks which
+# start with an underscore aren't shown in window titles.
+MARK_PREFIX = "_i3-resurrect"
+
+
+async def capture_async(
+    workspaces,
+    numeric,
+    swallow_criteria,
+    target=None,
+    i3=None,
+):
+    """
+    Look up workspaces' layouts and running programs.
+
+    Args:
+        workspaces: The names of the workspaces, or None for every workspace.
+        numeric: Identify workspaces by number instead of name.
+        swallow_criteria: The swallow criteria to build the layouts with.
+        target: "layout_only", "programs_only" or None for both.
+        i3: An open ipc.AsyncConnection to send the requests over, or the i3
+            IPC socket to connect to (None to look it up).
+
+    Returns (workspace name, layout, programs) for each workspace, where the
+    layout (or the list of programs.Program) is None if it wasn't looked up.
+    """
+    async with ipc.connect(i3) as i3:
+        with profiling.phase("get_tree"):
+            root = await i3.get_tree()
+
+    if workspaces is None:
+        workspaces = [
+            ws["name"]
+            for ws in treeutils.iter_workspaces(root, include_scratchpad=False)
+        ]
+
+    semaphore = asyncio.Semaphore(programs.MAX_PROCESSES)
+    cache = windowcache.from_config()
+
+    async def capture_workspace(name):
+        workspace_tree = treeutils.find_workspace(root, name, numeric)
+        workspace_layout = saved_programs = None
+        if target != "layout_only":
+            saved_programs = await programs.get_programs_async(
+                workspace_tree, semaphore, cache
+            )
+        if target != "programs_only":
+            workspace_layout = layout.build(workspace_tree, swallow_criteria)
+        return name, workspace_layout, saved_programs
+
+    captured = await asyncio.gather(*(capture_workspace(name) for name in workspaces))
+    if cache is not None:
+        await asyncio.get_running_loop().run_in_executor(None, cache.save)
+    return captured
+
+
+async def write_async(
+    captured,
+    directory,
+    profile,
+    store=None,
+    bundle=None,
+    index=None,
+    session=None,
+):
+    """
+    Write captured workspaces' layouts and programs, each in a worker thread.
+
+    Args:
+        captured: (workspace name, layout, programs) for each workspace, as
+            returned by capture_async().
+        directory: The directory to save to.
+        profile: The profile to save to.
+        store: The blob store to write through, if any.
+        bundle: The session bundle to write to, if any.
+        index: The manifest to record saved files in, if any.
+        session: The session being saved, if any.
+
+    Returns whether each workspace's saved files changed, in the order of
+    captured.
+    """
+    loop = asyncio.get_running_loop()
+    # Phases can't be traced concurrently, so files are written one at a time
+    # while tracing memory.
+    write_lock = asyncio.Lock() if profiling.enabled() else None
+
+    async def save_workspace(name, workspace_layout, saved_programs):
+        entry = None
+        if index is not None:
+            if profile is not None:
+                entry = index.entry("profile", profile)
+            else:
+                entry = index.entry("workspace", name, session)
+
+        args = (
+            name,
+            directory,
+            profile,
+            store,
+            bundle,
+            entry,
+            workspace_layout,
+            saved_programs,
+        )
+        if write_lock is not None:
+            async with write_lock:
+                return write_workspace(*args)
+        return await loop.run_in_executor(None, write_workspace, *args)
+
+    changed = await asyncio.gather(*(save_workspace(*ws) for ws in captured))
+    names = [name for name, _, _ in captured]
+    if bundle is not None:
+        # Workspaces may have been added to the bundle in any order.
+        bundle.order = names
+    return changed
+
+
+def write_workspace(
+    name,
+    directory,
+    profile,
+    store,
+    bundle,
+    entry,
+    workspace_layout,
+    saved_programs,
+):
+    """
+    Write a workspace's layout and programs files, leaving out either if it
+    is None. Returns whether either changed.
+    """
+    versions = history.from_config(directory, util.saved_name(name, profile))
+    layout_changed = programs_changed = False
+
+    if workspace_layout is not None:
+        layout_changed = layout.save(
+            name,
+            directory,
+            profile,
+            workspace_layout,
+            store,
+            versions,
+            bundle,
+            entry,
+        )
+
+    if saved_programs is not None:
+        programs_changed = programs.save(
+            name,
+            directory,
+            profile,
+            saved_programs,
+            store,
+            versions,
+            bundle,
+            entry,
+        )
+
+    if versions is not None:
+        # Record a new version if anything changed.
+        versions.commit()
+
+    return layout_changed or programs_changed
+
+
+class PreparedWorkspace:
+    """
+    Everything needed to restore a workspace, worked out before any i3
+    commands are sent.
+    """
+
+    def __init__(self, name, layout):
+        self.name = name
+        self.layout = layout
+        # The id of the workspace's container, if it already exists.
+        self.con_id = None
+        self.layout_file = None
+        self.window_ids = []
+        self.placeholder_window_ids = []
+        self.exec_commands = []
+        # The temporary marks on the appended layout in the background mode.
+        self.marks = []
+        # The exec commands of programs in hidden tabs, by the mark on their
+        # placeholders.
+        self.deferred = {}
+        # The ids of the windows taken from other workspaces.
+        self.reused_window_ids = []
+
+
+def read(workspaces, directory, profile, target=None, version=None, bundle=None):
+    """
+    Read saved workspaces' layouts and programs. Raises the errors of
+    layout.read() and programs.read() if any file is missing or invalid.
+
+    Args:
+        workspaces: The names of the saved workspaces.
+        directory: The directory to read from.
+        profile: The profile to read from.
+        target: "layout_only", "programs_only" or None for both.
+        version: The version to read from the history, if any.
+        bundle: The session bundle to read from, if any.
+
+    Returns (workspace name, layout, programs) for each workspace, where the
+    programs are None if they weren't read.
+    """
+    saved = []
+    for ws in workspaces:
+        with profiling.phase("read_layout"):
+            workspace_layout = layout.read(ws, directory, profile, version, bundle)
+        saved_programs = None
+        if target != "layout_only":
+            with profiling.phase("read_programs"):
+                saved_programs = programs.read(ws, directory, profile, version, bundle)
+        # Profiles are restored to the given workspace, anything else to the
+        # workspace it was saved from.
+        if "name" in workspace_layout and profile is None:
+            name = workspace_layout["name"]
+        else:
+            name = ws
+        saved.append((name, workspace_layout, saved_programs))
+    return saved
+
+
+async def restore_async(
+    saved,
+    target=None,
+    background=False,
+    visible_first=False,
+    defer_hidden=False,
+    startup_times=None,
+    reuse=False,
+    i3=None,
+):
+    """
+    Restore workspaces which have already been read. Returns the
+    PreparedWorkspaces which were restored, in the order they were restored.
+
+    Args:
+        saved: (workspace name, layout, programs) for each workspace, in the
+            order to restore them.
+        target: "layout_only", "programs_only" or None for both.
+        background: Restore without switching to each workspace.
+        visible_first: Restore the focused workspace and those visible on
+            other outputs first, then give focus back and restore the rest in
+            the background.
+        defer_hidden: Launch the programs in hidden tabs when their
+            placeholders are focused, which returns once every program has
+            been launched or i3 exits.
+        startup_times: The startup.StartupTimes to launch the slowest
+            programs first by and to learn from, if any.
+        reuse: Take the windows of programs which are running on other
+            workspaces instead of launching them again.
+        i3: An open ipc.AsyncConnection to send the requests over, or the i3
+            IPC socket to connect to (None to look it up).
+    """
+    semaphore = asyncio.Semaphore(programs.MAX_PROCESSES)
+    launcher = priority.Launcher(startup_times)
+    restored = []
+    with tempfile.TemporaryDirectory(prefix="i3-resurrect_") as tmp:
+        async with ipc.connect(i3) as i3:
+            root = await i3.get_tree()
+            focused = treeutils.focused_workspace(root)
+            hidden = set()
+            if visible_first:
+                saved, hidden = visible_order(saved, await i3.get_workspaces())
+            plan = None
+            if reuse and target != "layout_only":
+                plan = ReusePlan(saved, await running_windows(root, semaphore))
+            pending = [
+                asyncio.ensure_future(
+                    prepare_workspace(
+                        root,
+                        name,
+                        workspace_layout,
+                        saved_programs,
+                        target,
+                        Path(tmp) / f"{i}.json",
+                        semaphore,
+                        f"{MARK_PREFIX}_{i}" if background or name in hidden else None,
+                        defer_mark(i) if defer_hidden else None,
+                        launcher,
+                        plan,
+                    )
+                )
+                for i, (name, workspace_layout, saved_programs) in enumerate(saved)
+            ]
+            deferred = DeferredPrograms(launcher)
+            switched = False
+            try:
+                for task in pending:
+                    workspace = await task
+                    deferred.add(workspace)
+                    in_background = background or workspace.name in hidden
+                    if in_background and switched and focused is not None:
+                        # Give focus back as soon as the visible workspaces
+                        # have been restored.
+                        await i3.command(
+                            f'workspace --no-auto-back-and-forth "{focused}"'
+                        )
+                        switched = False
+                    if await restore_workspace(
+                        i3, workspace, in_background, launcher
+                    ):
+                        switched = True
+                    restored.append(workspace)
+                if switched and (background or visible_first) and focused is not None:
+                    # Workspaces without a layout to restore are still
+                    # switched to, so that their programs open on them.
+                    await i3.command(
+                        f'workspace --no-auto-back-and-forth "{focused}"'
+                    )
+            finally:
+                for task in pending:
+                    task.cancel()
+            await deferred.run(i3)
+            await launcher.wait()
+    return restored
+
+
+def visible_order(saved, workspaces):
+    """
+    Order saved workspaces so that the focused workspace comes first, then
+    the workspaces visible on other outputs, then the rest in their saved
+    order. Returns the ordered list and the names of the hidden workspaces.
+
+    Args:
+        saved: (workspace name, layout, programs) for each workspace.
+        workspaces: The workspaces as returned by GET_WORKSPACES.
+    """
+    focused = {ws["name"] for ws in workspaces if ws["focused"]}
+    visible = {ws["name"] for ws in workspaces if ws["visible"]}
+
+    def rank(entry):
+        if entry[0] in focused:
+            return 0
+        if entry[0] in visible:
+            return 1
+        return 2
+
+    ordered = sorted(saved, key=rank)
+    return ordered, {entry[0] for entry in saved if rank(entry) == 2}
+
+
+async def restore_lazy(
+    saved,
+    target=None,
+    defer_hidden=False,
+    startup_times=None,
+    reuse=False,
+    i3=None,
+):
+    """
+    Restore workspaces which have already been read as they are first
+    visited, i.e. focused or created. Returns once every workspace has been
+    restored (and every deferred program launched) or i3 exits, with the
+    PreparedWorkspaces which were restored.
+
+    Args:
+        saved: (workspace name, layout, programs) for each workspace.
+        target: "layout_only", "programs_only" or None for both.
+        defer_hidden: Launch the programs in hidden tabs when their
+            placeholders are focused.
+        startup_times: The startup.StartupTimes to launch the slowest
+            programs first by and to learn from, if any.
+        reuse: Take the windows of programs which are running on other
+            workspaces instead of launching them again.
+        i3: An open ipc.AsyncConnection to send the requests over, or the i3
+            IPC socket to connect to (None to look it up).
+    """
+    pending = {
+        name: (workspace_layout, saved_programs)
+        for name, workspace_layout, saved_programs in saved
+    }
+    launcher = priority.Launcher(startup_times)
+    deferred = DeferredPrograms(launcher)
+    semaphore = asyncio.Semaphore(programs.MAX_PROCESSES)
+    restored = []
+    with tempfile.TemporaryDirectory(prefix="i3-resurrect_") as tmp:
+        async with ipc.connect(i3) as i3, ipc.AsyncConnection(
+            i3.socket_path
+        ) as events:
+            # The mirror needs every event which changes the tree.
+            await events.subscribe(DeferredPrograms.EVENTS)
+            mirror = treemirror.TreeMirror(i3)
+            # The focused workspace has already been visited.
+            visited = treeutils.focused_workspace(await mirror.get_tree())
+            while True:
+                if visited in pending:
+                    root = await mirror.get_tree()
+                    # A workspace which was created without being focused is
+                    # restored in the background.
+                    background = treeutils.focused_workspace(root) != visited
+                    workspace_layout, saved_programs = pending[visited]
+                    if not background or (
+                        target != "programs_only" and workspace_layout != {}
+                    ):
+                        del pending[visited]
+                        plan = None
+                        if reuse and target != "layout_only":
+                            # Every saved workspace keeps the windows it needs,
+                            # whether or not it has been restored yet.
+                            plan = ReusePlan(
+                                saved, await running_windows(root, semaphore)
+                            )
+                        workspace = await prepare_workspace(
+                            root,
+                            visited,
+                            workspace_layout,
+                            saved_programs,
+                            target,
+                            Path(tmp) / f"{len(restored)}.json",
+                            semaphore,
+                            f"{MARK_PREFIX}_{len(restored)}" if background else None,
+                            defer_mark(len(restored)) if defer_hidden else None,
+                            launcher,
+                            plan,
+                        )
+                        await restore_workspace(i3, workspace, background, launcher)
+                        mirror.invalidate()
+                        deferred.add(workspace)
+                        restored.append(workspace)
+
+                await deferred.launch_focused(i3, mirror)
+                if not pending and not deferred.commands:
+                    break
+
+                event = await events.read_event(
+                    deferred.until_poll() if deferred.commands else None
+                )
+                deferred.poll(mirror)
+                visited = None
+                if event is None:
+                    continue
+                name, payload = event
+                if name == "shutdown":
+                    break
+                mirror.apply(name, payload)
+                if name == "workspace" and payload.get("change") in ("focus", "init"):
+                    visited = payload["current"]["name"]
+            await launcher.wait()
+    return restored
+
+
+class DeferredPrograms:
+    """
+    The programs from hidden tabs, which are launched when their placeholders
+    are first focused.
+    """
+
+    EVENTS = treemirror.TreeMirror.EVENTS + ["binding", "shutdown"]
+    # i3 doesn't send events for every change of focus, e.g. clicking on a
+    # placeholder's tab, so the tree is polled this often (in seconds).
+    POLL_INTERVAL = 2
+
+    def __init__(self, launcher):
+        self.launcher = launcher
+        # The exec commands by the mark on their placeholder.
+        self.commands = {}
+        self._next_poll = None
+
+    def add(self, workspace):
+        self.commands.update(workspace.deferred)
+
+    async def launch_focused(self, i3, mirror):
+        """
+        Launch the program of the focused placeholder, if it is deferred, and
+        forget the placeholders which have been closed.
+
+        Args:
+            i3: The ipc.AsyncConnection to send commands over.
+            mirror: The treemirror.TreeMirror to look for the placeholders in.
+        """
+        if not self.commands:
+            return
+        marked = {}
+        for con in treeutils.iter_cons(await mirror.get_tree()):
+            for mark in con.get("marks", []):
+                if mark in self.commands:
+                    marked[mark] = con
+        for mark in list(self.commands):
+            if mark not in marked:
+                del self.commands[mark]
+            elif marked[mark].get("focused"):
+                await self.launcher.exec(i3, self.commands.pop(mark))
+                await i3.command(f"unmark {mark}")
+
+    async def run(self, i3):
+        """
+        Launch the programs as their placeholders are focused, until every
+        program has been launched or i3 exits.
+        """
+        if not self.commands:
+            return
+        async with ipc.AsyncConnection(i3.socket_path) as events:
+            await events.subscribe(self.EVENTS)
+            mirror = treemirror.TreeMirror(i3)
+            while True:
+                await self.launch_focused(i3, mirror)
+                if not self.commands:
+                    return
+                event = await events.read_event(self.until_poll())
+                self.poll(mirror)
+                if event is None:
+                    continue
+                if event[0] == "shutdown":
+                    return
+                mirror.apply(*event)
+
+    def until_poll(self):
+        """
+        Get the seconds until the tree is next polled for changes of focus.
+        """
+        now = asyncio.get_running_loop().time()
+        if self._next_poll is None:
+            self._next_poll = now + self.POLL_INTERVAL
+        return max(0, self._next_poll - now)
+
+    def poll(self, mirror):
+        """
+        Poll the tree if it is due, so that it is fetched again if no event
+        arrived since the last poll (see TreeMirror.poll()).
+        """
+        if self.commands and self.until_poll() == 0:
+            mirror.poll()
+            self._next_poll = None
+
+
+def defer_mark(index):
+    """
+    Get the prefix of the marks for the placeholders of the deferred programs
+    of the index-th workspace restored.
+    """
+    # The marks outlive the restore, so include the PID to keep them apart
+    # from those of any other restore.
+    return f"{MARK_PREFIX}_tab_{os.getpid()}_{index}"
+
+
+async def prepare_workspace(
+    root,
+    name,
+    workspace_layout,
+    saved_programs,
+    target,
+    layout_file,
+    semaphore,
+    mark=None,
+    defer_mark=None,
+    launcher=None,
+    plan=None,
+):
+    """
+    Work out how to restore a workspace from the tree as it was before
+    restoring.
+
+    Args:
+        root: The i3 tree.
+        name: The name of the workspace.
+        workspace_layout: The saved layout.
+        saved_programs: The saved programs, or None if they aren't restored.
+        target: "layout_only", "programs_only" or None for both.
+        layout_file: Where to write the layout to append.
+        semaphore: Limits the number of xprop processes running at once.
+        mark: The prefix of the temporary marks to restore the layout in the
+            background with, or None to restore it on the focused workspace.
+        defer_mark: The prefix of the marks to leave on the placeholders of
+            programs in hidden tabs, which are launched when the placeholder
+            is focused, or None to launch every program.
+        launcher: The priority.Launcher to build the exec commands with.
+        plan: The ReusePlan for taking windows from other workspaces, if any.
+    """
+    if launcher is None:
+        launcher = priority.Launcher()
+    loop = asyncio.get_running_loop()
+    workspace = PreparedWorkspace(name, workspace_layout)
+    workspace_tree = treeutils.find_workspace(root, name, False)
+    workspace.con_id = workspace_tree.get("id")
+    restore_layout = target != "programs_only" and workspace_layout != {}
+
+    if saved_programs is not None:
+        if plan is not None:
+            # Don't launch programs which are already running anywhere.
+            running_programs = plan.programs.get(name, [])
+            workspace.reused_window_ids = plan.windows.get(name, [])
+        else:
+            # Don't launch programs which are already running in the workspace.
+            running_programs = await programs.get_programs_async(
+                workspace_tree, semaphore
+            )
+        remaining = programs.remove_running(
+            [programs.Program.from_dict(entry) for entry in saved_programs],
+            running_programs,
+        )
+        if defer_mark is not None and restore_layout:
+            remaining = defer_hidden(workspace, remaining, defer_mark, launcher)
+        workspace.exec_commands = [
+            launcher.command(p) for p in launcher.order(remaining)
+        ]
+
+    if restore_layout:
+        (
+            workspace.window_ids,
+            workspace.placeholder_window_ids,
+        ) = layout.split_windows(workspace_tree)
+        if plan is not None:
+            # Leave alone the windows which other workspaces take.
+            workspace.window_ids = [
+                window_id
+                for window_id in workspace.window_ids
+                if window_id not in plan.taken
+            ]
+        if mark is not None:
+            data = serializer.dumps(background_layout(workspace, mark))
+        else:
+            data = serializer.dumps(layout.restorable_layout(workspace.layout))
+        await loop.run_in_executor(None, layout_file.write_bytes, data)
+        workspace.layout_file = layout_file
+
+    return workspace
+
+
+async def running_windows(root, semaphore):
+    """
+    Get the running programs of every workspace except the scratchpad, as
+    (workspace name, window container, Program) tuples.
+    """
+    workspaces = list(treeutils.iter_workspaces(root, include_scratchpad=False))
+    found = await asyncio.gather(
+        *(programs.get_window_programs_async(ws, semaphore) for ws in workspaces)
+    )
+    return [
+        (ws["name"], con, program)
+        for ws, windows in zip(workspaces, found)
+        for con, program in windows
+    ]
+
+
+class ReusePlan:
+    """
+    Which running windows each saved workspace keeps and which it takes from
+    other workspaces, so that only the programs which aren't running anywhere
+    are launched.
+
+    Every workspace first keeps the windows it already has for its saved
+    programs. Then, in order, each workspace takes a matching window which
+    nobody has kept or taken for each of its saved programs which is still
+    missing.
+
+    Args:
+        saved: (workspace name, layout, programs) for each saved workspace.
+        running: (workspace name, window container, Program) for each window,
+            as returned by running_windows().
+    """
+
+    def __init__(self, saved, running):
+        # The running programs which aren't launched again, by workspace.
+        self.programs = {}
+        # The ids of the windows each workspace takes from another.
+        self.windows = {}
+        # The ids of every window which is taken.
+        self.taken = set()
+
+        unclaimed = {}
+        for ws_name, con, program in running:
+            unclaimed.setdefault(program, []).append((ws_name, con))
+
+        missing = {}
+        for name, _, saved_programs in saved:
+            if saved_programs is None:
+                continue
+            self.programs[name] = []
+            missing[name] = []
+            for program in map(programs.Program.from_dict, saved_programs):
+                candidates = unclaimed.get(program, [])
+                here = next(
+                    (i for i, (ws_name, _) in enumerate(candidates) if ws_name == name),
+                    None,
+                )
+                if here is None:
+                    missing[name].append(program)
+                else:
+                    del candidates[here]
+                    self.programs[name].append(program)
+
+        for name, missing_programs in missing.items():
+            for program in missing_programs:
+                candidates = unclaimed.get(program)
+                if not candidates:
+                    continue
+                _, con = candidates.pop(0)
+                self.programs[name].append(program)
+                self.windows.setdefault(name, []).append(con["window"])
+                self.taken.add(con["window"])
+
+
+def defer_hidden(workspace, remaining, defer_mark, launcher):
+    """
+    Mark the placeholders of the programs which were in hidden tabs and
+    record their exec commands in workspace.deferred. Returns the programs to
+    launch straight away.
+
+    Args:
+        workspace: The PreparedWorkspace.
+        remaining: The programs to restore.
+        defer_mark: The prefix of the marks.
+        launcher: The priority.Launcher to build the exec commands with.
+    """
+    placeholders = layout.count_placeholders(workspace.layout)
+    marks = {}
+    launch = []
+    for program in remaining:
+        window = program.hidden_window
+        # The layout and programs may not have been saved together.
+        if window is None or window >= placeholders or window in marks:
+            launch.append(program)
+            continue
+        marks[window] = f"{defer_mark}_{window}"
+        workspace.deferred[marks[window]] = launcher.command(program)
+    if marks:
+        workspace.layout = layout.mark_windows(workspace.layout, marks)
+    return launch
+
+
+def background_layout(workspace, mark):
+    """
+    Build the layout to append for a workspace which is restored in the
+    background, and record the temporary marks it is moved with.
+
+    Args:
+        workspace: The PreparedWorkspace.
+        mark: The prefix of the temporary marks.
+    """
+    saved = workspace.layout
+    if workspace.con_id is None:
+        # Append the whole workspace, named as it is being restored.
+        workspace.marks = [mark]
+        node = dict(saved, name=workspace.name)
+        node["marks"] = list(saved.get("marks", [])) + [mark]
+        node.pop("output", None)
+        return node
+
+    # Mark each top level container so it can be moved to the workspace.
+    nodes = []
+    for i, node in enumerate(saved.get("nodes", []) + saved.get("floating_nodes", [])):
+        node_mark = f"{mark}_{i}"
+        workspace.marks.append(node_mark)
+        nodes.append(dict(node, marks=list(node.get("marks", [])) + [node_mark]))
+    return (nodes,)
+
+
+async def restore_workspace(i3, workspace, background=False, launcher=None):
+    """
+    Send the commands to restore a prepared workspace. Returns whether the
+    workspace was switched to.
+
+    Args:
+        i3: The ipc.AsyncConnection to send the commands over.
+        workspace: The PreparedWorkspace to restore.
+        background: Restore the layout without switching to the workspace.
+        launcher: The priority.Launcher the exec commands were built with.
+    """
+    if launcher is None:
+        launcher = priority.Launcher()
+    switch = not background or workspace.layout_file is None
+    if switch:
+        # Switch to the workspace which we are loading.
+        await i3.command(f'workspace --no-auto-back-and-forth "{workspace.name}"')
+
+    if workspace.layout_file is not None:
+        try:
+            await restore_layout(i3, workspace, background)
+        except Exception as e:
+            util.eprint(
+                "Error occurred restoring workspace layout. Note that if the layout "
+                "was saved by a version prior to 1.4.0 it must be recreated."
+            )
+            util.eprint(str(e))
+    await move_reused_windows(i3, workspace)
+
+    # The programs start up while the following workspaces are restored.
+    for command in workspace.exec_commands:
+        await launcher.exec(i3, command)
+
+    return switch
+
+
+async def restore_layout(i3, workspace, background=False):
+    """
+    Append a prepared workspace's layout. The workspace's windows are unmapped
+    while it is appended and then mapped again, so that i3 sees them as new
+    windows and the placeholders swallow them.
+    """
+    # Unmap all non-placeholder windows in workspace, and remove any remaining
+    # placeholder windows so that we don't have duplicates.
+    await asyncio.gather(
+        *(
+            layout.xdo_async("windowunmap", window_id)
+            for window_id in workspace.window_ids + workspace.reused_window_ids
+        ),
+        *(
+            layout.xdo_async("windowkill", window_id)
+            for window_id in workspace.placeholder_window_ids
+        ),
+    )
+
+    try:
+        if background:
+            await append_layout_background(i3, workspace)
+        else:
+            await append_layout(i3, workspace)
+    finally:
+        # Map all unmapped windows before moving on to the next workspace,
+        # whose placeholders must not swallow them, and no matter what, so
+        # that the user doesn't lose their windows.
+        await asyncio.gather(
+            *(
+                layout.xdo_async("windowmap", window_id)
+                for window_id in workspace.window_ids + workspace.reused_window_ids
+            )
+        )
+
+
+async def move_reused_windows(i3, workspace):
+    """
+    Move the windows taken from other workspaces which weren't swallowed by a
+    placeholder to the workspace.
+    """
+    window_ids = workspace.reused_window_ids
+    if not window_ids:
+        return
+    if workspace.layout_file is not None:
+        root = await i3.get_tree()
+        workspace_tree = treeutils.find_workspace(root, workspace.name, False)
+        swallowed = {con.get("window") for con in treeutils.iter_cons(workspace_tree)}
+        window_ids = [w for w in window_ids if w not in swallowed]
+    if window_ids:
+        # Move them all in one message, so that i3 only redraws once.
+        await i3.command(
+            "; ".join(
+                f'[id={window_id}] move container to workspace "{workspace.name}"'
+                for window_id in window_ids
+            )
+        )
+
+
+async def append_layout(i3, workspace):
+    """
+    Append a workspace's layout to the focused workspace.
+    """
+    # append_layout can only insert nodes so we must separately change the
+    # layout mode of the workspace node. A workspace which didn't exist before
+    # has just been created empty, so it is focused itself.
+    ws_layout_mode = workspace.layout.get("layout", "default")
+    if workspace.con_id is not None:
+        await i3.command(f"[con_id={workspace.con_id}] layout {ws_layout_mode}")
+    else:
+        await i3.command(f"layout {ws_layout_mode}")
+
+    # Create fresh placeholder windows by appending layout to workspace.
+    await i3.command(f"append_layout {workspace.layout_file}")
+
+    # Move workspace to original output
+    if "output" in workspace.layout:
+        await i3.command(
+            f'[workspace="{workspace.name}"] move workspace to output '
+            f'{workspace.layout["output"]}'
+        )
+
+
+async def append_layout_background(i3, workspace):
+    """
+    Append a workspace's layout without changing focus.
+    """
+    if workspace.con_id is None:
+        # The appended workspace node carries its own layout mode.
+        await i3.command(f"append_layout {workspace.layout_file}")
+        target = f'[con_mark="^{workspace.marks[0]}$"]'
+    else:
+        ws_layout_mode = workspace.layout.get("layout", "default")
+        await i3.command(f"[con_id={workspace.con_id}] layout {ws_layout_mode}")
+        # i3 redraws once per message, so the layout is never shown on the
+        # focused workspace.
+        moves = "".join(
+            f'; [con_mark="^{mark}$"] move container to workspace "{workspace.name}"'
+            for mark in workspace.marks
+        )
+        await i3.command(f"append_layout {workspace.layout_file}{moves}")
+        target = f"[con_id={workspace.con_id}]"
+
+    try:
+        # Move workspace to original output
+        if "output" in workspace.layout:
+            await i3.command(
+                f'{target} move workspace to output {workspace.layout["output"]}'
+            )
+    finally:
+        if workspace.marks:
+            await i3.command("; ".join(f"unmark {mark}" for mark in workspace.marks))
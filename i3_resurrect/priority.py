@@ -0,0 +1,376 @@
+"""
+Launching restored programs at a lower CPU and IO priority.
+
+Restoring a session launches every program at once, and while they start up
+they compete with i3 and the compositor, so the desktop stops responding. The
+launch_priority config runs each program through nice and ionice, and
+optionally in a transient systemd user scope with a CPU and IO weight, so that
+the desktop keeps priority. Each program is given its normal priority back as
+soon as its window appears, or once its grace period is up.
+
+Programs are launched through i3 rather than by us, so their processes are
+found again by an environment variable holding a token for the launch. The
+same tokens match new windows to the launches they came from, to measure how
+long programs take to start up (see the startup module).
+"""
+
+import asyncio
+import os
+import shutil
+import subprocess
+from collections import deque
+
+import psutil
+
+from . import config
+from . import ipc
+from . import programs
+from . import startup
+from . import util
+
+ENV_VAR = "I3_RESURRECT_LAUNCH"
+
+# The default number of seconds after which a program is given its normal
+# priority back, if its window hasn't appeared before then.
+GRACE_PERIOD = 30
+
+IONICE_CLASSES = {
+    "idle": ["-c", "3"],
+    "best-effort": ["-c", "2", "-n", "7"],
+}
+
+SCOPE_PROPERTIES = {
+    "cpu_weight": "CPUWeight",
+    "io_weight": "IOWeight",
+}
+# The kernel's default CPU and IO weight.
+NORMAL_WEIGHT = 100
+
+
+class ConfigError(Exception):
+    pass
+
+
+def get_rule(window_class):
+    """
+    Get the launch priority settings for a window class, which are the
+    top-level settings overridden by those for the class, if any.
+
+    Args:
+        window_class: The class of the program's window, or None if unknown.
+    """
+    settings = config.get("launch_priority", {})
+    rule = {key: value for key, value in settings.items() if key != "window_classes"}
+    rule.update(settings.get("window_classes", {}).get(window_class, {}))
+    return rule
+
+
+def validate():
+    """
+    Check the launch priority settings, raising ConfigError if they are
+    invalid.
+    """
+    settings = config.get("launch_priority", {})
+    rules = [settings] + list(settings.get("window_classes", {}).values())
+    for rule in rules:
+        ionice = rule.get("ionice")
+        if ionice is not None and ionice not in IONICE_CLASSES:
+            raise ConfigError(
+                f'Unknown ionice class "{ionice}" in launch_priority, expected one '
+                f'of {", ".join(IONICE_CLASSES)}'
+            )
+
+
+def scope_unit(token):
+    """
+    Get the name of the systemd scope a program is launched in.
+    """
+    return f"i3-resurrect-{token}.scope"
+
+
+def find_processes(tokens):
+    """
+    Find the processes which were launched with any of the given tokens.
+    Returns a dict of lists of psutil.Process by token.
+    """
+    found = {}
+    for process in psutil.process_iter(["environ"]):
+        # The environment of other users' processes can't be read.
+        environ = process.info["environ"]
+        token = environ.get(ENV_VAR) if environ else None
+        if token in tokens:
+            found.setdefault(token, []).append(process)
+    return found
+
+
+def window_processes(pid):
+    """
+    Get the token a window's process was launched with, if any, and the
+    process and its descendants.
+
+    Args:
+        pid: The PID of the window's process.
+    """
+    process = psutil.Process(pid)
+    token = process.environ().get(ENV_VAR)
+    return token, [process] + process.children(recursive=True)
+
+
+def reset(rule, token, processes, normal_nice):
+    """
+    Give launched processes their normal priority back. Returns whether
+    resetting the niceness of any of them was refused.
+
+    Args:
+        rule: The launch priority settings they were launched with.
+        token: The token of the launch.
+        processes: The psutil.Process objects to reset.
+        normal_nice: The niceness to reset them to.
+    """
+    refused = False
+    for process in processes:
+        try:
+            # Lowering the niceness again is only allowed up to the user's
+            # RLIMIT_NICE, so this may be refused.
+            if rule.get("nice"):
+                process.nice(normal_nice)
+        except psutil.AccessDenied:
+            refused = True
+        except psutil.Error:
+            pass
+        try:
+            if rule.get("ionice"):
+                process.ionice(psutil.IOPRIO_CLASS_NONE)
+        except psutil.Error:
+            pass
+
+    properties = [
+        f"{name}={NORMAL_WEIGHT}"
+        for key, name in SCOPE_PROPERTIES.items()
+        if rule.get(key) is not None
+    ]
+    if rule.get("systemd_scope") and properties:
+        # The scope is gone if the program has already exited.
+        subprocess.run(
+            ["systemctl", "--user", "set-property", "--runtime", scope_unit(token)]
+            + properties,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    return refused
+
+
+class Launcher:
+    """
+    Launches restored programs through i3 at their configured priority, and
+    gives them their normal priority back once their windows appear or their
+    grace period is up. If startup times are given, it also orders programs
+    by them and measures how long each program's window takes to appear.
+
+    Get each program's exec command with command() and send it with exec().
+    Without any launch_priority config, the commands are sent as they are.
+
+    Args:
+        startup_times: The startup.StartupTimes to order programs by and
+            record measurements in, if any.
+    """
+
+    EVENTS = ["window", "shutdown"]
+
+    def __init__(self, startup_times=None):
+        validate()
+        self.enabled = bool(config.get("launch_priority", {}))
+        self.startup_times = startup_times
+        # The rule and the deadline of each launch which hasn't been reset yet,
+        # by its token.
+        self.pending = {}
+        # The command key and launch time of each launch whose window hasn't
+        # appeared yet, by its token.
+        self.starting = {}
+        # The launches of each exec command which haven't been sent yet.
+        self._launches = {}
+        self._count = 0
+        self._tools = {}
+        self._normal_nice = psutil.Process().nice() if self.enabled else 0
+        self._nice_refused = False
+        self._task = None
+
+    def order(self, saved_programs):
+        """
+        Order programs slowest to start up first, if startup times are known.
+        """
+        if self.startup_times is None:
+            return saved_programs
+        return self.startup_times.slowest_first(saved_programs)
+
+    def command(self, program):
+        """
+        Get the i3 exec command which launches a saved program at its
+        priority.
+
+        Args:
+            program: The programs.Program to launch.
+        """
+        token = f"{os.getpid()}-{self._count}"
+        rule = get_rule(program.window_class) if self.enabled else {}
+        args = self._wrapper(rule, token)
+        key = None
+        if self.startup_times is not None:
+            key = startup.command_key(program)
+        if not args and key is None:
+            return programs.exec_command(program)
+
+        # The token also matches the program's window to its launch when its
+        # startup time is measured.
+        self._count += 1
+        wrapper = ["env", f"{ENV_VAR}={token}"] + args
+        command = programs.exec_command(program, wrapper)
+        launch = (token, rule if args else None, key)
+        self._launches.setdefault(command, deque()).append(launch)
+        return command
+
+    def _wrapper(self, rule, token):
+        args = []
+        if rule.get("systemd_scope") and self._available("systemd-run"):
+            args += ["systemd-run", "--user", "--scope", "--quiet"]
+            args.append(f"--unit={scope_unit(token)}")
+            if rule.get("slice"):
+                args.append(f'--slice={rule["slice"]}')
+            for key, name in SCOPE_PROPERTIES.items():
+                if rule.get(key) is not None:
+                    args += ["-p", f"{name}={rule[key]}"]
+        if rule.get("nice") and self._available("nice"):
+            args += ["nice", "-n", str(rule["nice"])]
+        if rule.get("ionice") and self._available("ionice"):
+            args += ["ionice"] + IONICE_CLASSES[rule["ionice"]]
+        return args
+
+    def _available(self, tool):
+        if tool not in self._tools:
+            self._tools[tool] = shutil.which(tool) is not None
+            if not self._tools[tool]:
+                util.eprint(
+                    f'Could not find "{tool}", so programs are launched without it'
+                )
+        return self._tools[tool]
+
+    async def exec(self, i3, command):
+        """
+        Send an exec command, and start watching for the program's window if
+        it is launched at a lower priority or its startup time is measured.
+
+        Args:
+            i3: The ipc.AsyncConnection to send the command over.
+            command: An exec command from command().
+        """
+        launches = self._launches.get(command)
+        if not launches:
+            await i3.command(command)
+            return
+        token, rule, key = launches.popleft()
+        if not launches:
+            del self._launches[command]
+
+        now = asyncio.get_running_loop().time()
+        if rule is not None:
+            self.pending[token] = (rule, now + rule.get("grace_period", GRACE_PERIOD))
+        if key is not None:
+            self.starting[token] = (key, now)
+        if self._task is None:
+            # Subscribe before launching, so that the window can't be missed.
+            events = await ipc.AsyncConnection(i3.socket_path).open()
+            await events.subscribe(self.EVENTS)
+            self._task = asyncio.ensure_future(self._run(events))
+        await i3.command(command)
+
+    async def wait(self):
+        """
+        Wait until every launched program has been given its normal priority
+        back and the windows being measured have appeared (or timed out), or
+        until i3 exits. Then save the measured startup times.
+        """
+        while self._task is not None:
+            await self._task
+        if self.startup_times is not None:
+            self.startup_times.save()
+
+    async def _run(self, events):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(programs.MAX_PROCESSES)
+        try:
+            while True:
+                now = loop.time()
+                expired = [
+                    token
+                    for token, (_, deadline) in self.pending.items()
+                    if deadline <= now
+                ]
+                if expired:
+                    found = await loop.run_in_executor(
+                        None, find_processes, set(expired)
+                    )
+                    for token in expired:
+                        await self._reset(token, found.get(token, []))
+                    continue
+
+                deadlines = [deadline for _, deadline in self.pending.values()]
+                if self.starting:
+                    deadlines += self._starting_deadlines(now)
+                if not deadlines:
+                    return
+
+                event = await events.read_event(min(deadlines) - now)
+                if event is None:
+                    continue
+                name, payload = event
+                if name == "shutdown":
+                    return
+                if payload.get("change") == "new":
+                    await self._window_appeared(
+                        payload["container"], loop.time(), semaphore
+                    )
+        finally:
+            # Anything launched from now on needs a new task.
+            self._task = None
+            await events.close()
+
+    def _starting_deadlines(self, now):
+        # Give up on the windows which haven't appeared in time, e.g. because
+        # the program handed over to an instance which was already running.
+        timeout = self.startup_times.timeout
+        for token, (_, launched) in list(self.starting.items()):
+            if launched + timeout <= now:
+                del self.starting[token]
+        return [launched + timeout for _, launched in self.starting.values()]
+
+    async def _window_appeared(self, con, now, semaphore):
+        # Windows which were remapped or taken from another workspace have no
+        # token of ours, so only the windows of our launches are matched.
+        if not self.pending and not self.starting:
+            return
+        pid = await programs.get_window_pid_async(con, semaphore)
+        if not pid:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            token, processes = await loop.run_in_executor(None, window_processes, pid)
+        except psutil.Error:
+            return
+        if token in self.starting:
+            key, launched = self.starting.pop(token)
+            self.startup_times.record(key, now - launched)
+        if token in self.pending:
+            await self._reset(token, processes)
+
+    async def _reset(self, token, processes):
+        rule, _ = self.pending.pop(token)
+        refused = await asyncio.get_running_loop().run_in_executor(
+            None, reset, rule, token, processes, self._normal_nice
+        )
+        if refused and not self._nice_refused:
+            self._nice_refused = True
+            util.eprint(
+                "Could not give programs launched with nice their normal priority "
+                "back, since RLIMIT_NICE doesn't allow it. Consider using "
+                "systemd_scope with cpu_weight instead."
+            )
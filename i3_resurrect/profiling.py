@@ -0,0 +1,165 @@
+"""
+Opt-in allocation profiling using tracemalloc.
+
+Code is instrumented unconditionally with `with profiling.phase("name"):`,
+which does nothing unless tracing has been enabled with enable(). Phases
+should not be nested, since each phase resets the peak counter.
+"""
+
+import linecache
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+_tracer = None
+
+
+class MemoryTracer:
+    """
+    Records peak and retained allocations for each named phase, aggregated
+    over every time the phase is entered, along with the source lines which
+    retained the most memory in each phase.
+    """
+
+    def __init__(self, top=5, frames=1):
+        self.top = top
+        self.phases = {}
+        self.sites = {}
+        tracemalloc.start(frames)
+        self._filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+
+    @contextmanager
+    def phase(self, name):
+        before_snapshot = tracemalloc.take_snapshot().filter_traces(self._filters)
+        # reset_peak() is only available from Python 3.9. Without it the peak
+        # is the highest point since tracing started.
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            after_snapshot = tracemalloc.take_snapshot().filter_traces(self._filters)
+
+            stats = self.phases.setdefault(
+                name, {"count": 0, "peak": 0, "retained": 0}
+            )
+            stats["count"] += 1
+            stats["peak"] = max(stats["peak"], peak - before)
+            stats["retained"] += current - before
+
+            sites = self.sites.setdefault(name, {})
+            for diff in after_snapshot.compare_to(before_snapshot, "lineno"):
+                if diff.size_diff == 0:
+                    continue
+                frame = diff.traceback[0]
+                key = (frame.filename, frame.lineno)
+                sites[key] = sites.get(key, 0) + diff.size_diff
+
+    def report(self, file=None):
+        """
+        Print a summary of every phase to stderr (or the given file).
+        """
+        file = file or sys.stderr
+        current, peak = tracemalloc.get_traced_memory()
+        print("Memory trace:", file=file)
+        print(
+            f"  {'phase':<24} {'calls':>6} {'peak':>12} {'retained':>12}", file=file
+        )
+        for name, stats in self.phases.items():
+            print(
+                f"  {name:<24} {stats['count']:>6} "
+                f"{format_size(stats['peak']):>12} "
+                f"{format_size(stats['retained']):>12}",
+                file=file,
+            )
+        print(
+            f"  {'total':<24} {'':>6} {format_size(peak):>12} "
+            f"{format_size(current):>12}",
+            file=file,
+        )
+
+        for name, sites in self.sites.items():
+            top = [site for site in sites.items() if site[1] > 0]
+            top = sorted(top, key=lambda s: s[1], reverse=True)[: self.top]
+            if not top:
+                continue
+            print(f"Top allocation sites in {name}:", file=file)
+            for (filename, lineno), size in top:
+                line = linecache.getline(filename, lineno).strip()
+                print(
+                    f"  {format_size(size):>12}  {shorten(filename)}:{lineno}  {line}",
+                    file=file,
+                )
+
+    def stop(self):
+        tracemalloc.stop()
+
+
+def enable(top=5):
+    """
+    Start tracing allocations.
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = MemoryTracer(top=top)
+    return _tracer
+
+
+def disable():
+    global _tracer
+    if _tracer is not None:
+        _tracer.stop()
+        _tracer = None
+
+
+def enabled():
+    return _tracer is not None
+
+
+def report(file=None):
+    """
+    Print the memory report if tracing is enabled.
+    """
+    if _tracer is not None:
+        _tracer.report(file)
+
+
+@contextmanager
+def phase(name):
+    """
+    Context manager which attributes allocations made inside it to a phase.
+    """
+    if _tracer is None:
+        yield
+        return
+    with _tracer.phase(name):
+        yield
+
+
+def format_size(size):
+    for unit in ["B", "KiB", "MiB"]:
+        if abs(size) < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "GiB"
+    return f"{size:.1f} {unit}"
+
+
+def shorten(filename):
+    """
+    Shorten a path for display, keeping it relative to the package if possible.
+    """
+    path = Path(filename)
+    package = Path(__file__).parent
+    try:
+        return str(path.relative_to(package.parent))
+    except ValueError:
+        return "/".join(path.parts[-2:])
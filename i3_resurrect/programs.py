@@ -1,114 +1,295 @@
-import json
+import asyncio
 import shlex
 import shutil
-import subprocess
 import sys
+from collections import Counter
 from pathlib import Path
 
-import i3ipc
 import psutil
 
+from . import blobstore
 from . import config
+from . import history
+from . import profiling
+from . import serializer
+from . import storage
 from . import treeutils
 from . import util
 
+# The maximum number of xprop processes to run at once.
+MAX_PROCESSES = 16
 
-def save(workspace, numeric, directory, profile):
+
+def save(
+    workspace,
+    directory,
+    profile,
+    programs,
+    store=None,
+    history=None,
+    bundle=None,
+    manifest=None,
+):
     """
-    Save the commands to launch the programs open in the specified workspace
-    to a file.
+    Save the commands to launch a workspace's programs to a file, or to a
+    session bundle if one is given.
+
+    Returns whether the saved file changed.
     """
-    workspace_id = util.filename_filter(workspace)
-    filename = f"workspace_{workspace_id}_programs.json"
-    if profile is not None:
-        filename = f"{profile}_programs.json"
+    filename = f"{util.saved_name(workspace, profile)}_programs.json"
     programs_file = Path(directory) / filename
 
-    window_command_mappings = config.get("window_command_mappings", [])
-
-    programs = get_programs(workspace, numeric)
-
     # Write list of commands to file as JSON.
-    with programs_file.open("w") as f:
-        f.write(json.dumps(programs, indent=2))
+    with profiling.phase("write_programs"):
+        data = serializer.dumps([p.to_dict() for p in programs], indent=2)
+        if bundle is not None:
+            changed = bundle.add(workspace, "programs", data)
+        else:
+            changed = blobstore.write(programs_file, data, store)
+        if history is not None:
+            history.add("programs", data)
+        if manifest is not None:
+            manifest.add("programs", changed, len(programs))
+    return changed
 
 
-def read(workspace, directory, profile):
+def read(workspace, directory, profile, version=None, bundle=None):
     """
-    Read saved programs file.
+    Read saved programs file, or a version of it from the history, or the
+    programs from a session bundle. Raises FileNotFoundError,
+    history.VersionNotFound or storage.FormatError, with a message saying
+    which programs, if they can't be read.
     """
-    workspace_id = util.filename_filter(workspace)
-    filename = f"workspace_{workspace_id}_programs.json"
-    if profile is not None:
-        filename = f"{profile}_programs.json"
-    programs_file = Path(directory) / filename
+    name = util.saved_name(workspace, profile)
+    programs_file = Path(directory) / f"{name}_programs.json"
 
-    programs = None
     try:
-        programs = json.loads(programs_file.read_text())
-    except FileNotFoundError:
+        if version is not None:
+            data = history.History(directory, name).read(version, "programs")
+        elif bundle is not None:
+            data = bundle.read(workspace, "programs")
+        else:
+            data = blobstore.read(programs_file)
+        return serializer.loads(data)
+    except history.VersionNotFound as e:
+        raise history.VersionNotFound(
+            f'Could not restore programs of "{name}": {str(e)}'
+        ) from e
+    except FileNotFoundError as e:
         if profile is not None:
-            util.eprint(f'Could not find saved programs for profile "{profile}"')
+            message = f'Could not find saved programs for profile "{profile}"'
         else:
-            util.eprint(f'Could not find saved programs for workspace "{workspace}"')
-        sys.exit(1)
-    return programs
+            message = f'Could not find saved programs for workspace "{workspace}"'
+        raise FileNotFoundError(message) from e
+    except (storage.FormatError, ValueError) as e:
+        raise storage.FormatError(
+            f'Could not read saved programs "{programs_file}": {str(e)}'
+        ) from e
+
 
+def exec_command(program, wrapper=None):
+    """
+    Get the i3 exec command which launches a saved program.
 
-def restore(workspace_name, saved_programs):
+    Args:
+        program: The Program to launch.
+        wrapper: Arguments to run the command with, e.g. ["nice", "-n", "10"].
+    """
+    cmdline = program.command
+    working_directory = program.working_directory
+
+    # If the working directory does not exist, set working directory to
+    # user's home directory.
+    if not Path(working_directory).exists():
+        working_directory = Path.home()
+
+    # If cmdline is array, join it into one string for use with i3's exec
+    # command.
+    if isinstance(cmdline, tuple):
+        # Quote each argument of the command in case some of
+        # them contain spaces. Also protect quotes contained in the
+        # arguments and those to be added from i3's command parser.
+        cmdline = [
+            '\\"' + arg.replace('"', '\\\\\\"') + '\\"'
+            for arg in cmdline
+            if arg != ""
+        ]
+        command = " ".join(cmdline)
+    else:
+        command = cmdline
+
+    if wrapper:
+        command = " ".join(wrapper) + " " + command
+
+    return f'exec "cd \\"{working_directory}\\" && {command}"'
+
+
+class Program:
     """
-    Restore the running programs from an i3 workspace.
+    A saved or running program: the command to launch it and its working
+    directory.
+
+    The command is kept as a tuple (or a string if it was saved as one) and
+    the executable and working directory are interned, since they are
+    usually shared by many windows. Programs are hashable so that running
+    programs can be matched against saved ones in linear time.
+
+    If the program's window was hidden behind another tab of a tabbed or
+    stacked container, hidden_window is the index of the window among the
+    workspace's windows (in the order of treeutils.get_leaves), which is also
+    the index of its placeholder in the saved layout. window_class is the
+    class of the program's window, which launch priorities are chosen by.
+    Neither is compared.
     """
-    # Remove already running programs from the list of program to restore.
-    running_programs = get_programs(workspace_name, False)
-    for program in running_programs:
-        if program in saved_programs:
-            saved_programs.remove(program)
-
-    i3 = i3ipc.Connection()
-    for entry in saved_programs:
-        cmdline = entry["command"]
-        working_directory = entry["working_directory"]
-
-        # If the working directory does not exist, set working directory to
-        # user's home directory.
-        if not Path(working_directory).exists():
-            working_directory = Path.home()
-
-        # If cmdline is array, join it into one string for use with i3's exec
-        # command.
-        if isinstance(cmdline, list):
-            # Quote each argument of the command in case some of
-            # them contain spaces. Also protect quotes contained in the
-            # arguments and those to be added from i3's command parser.
-            cmdline = [
-                '\\"' + arg.replace('"', '\\\\\\"') + '\\"'
-                for arg in cmdline
-                if arg != ""
-            ]
-            command = " ".join(cmdline)
+
+    __slots__ = ("command", "working_directory", "hidden_window", "window_class")
+
+    def __init__(
+        self, command, working_directory, hidden_window=None, window_class=None
+    ):
+        if isinstance(command, list):
+            command = tuple(command)
+        if isinstance(command, tuple) and command:
+            command = (sys.intern(command[0]),) + command[1:]
+        self.command = command
+        self.working_directory = sys.intern(str(working_directory))
+        self.hidden_window = hidden_window
+        self.window_class = window_class
+
+    @classmethod
+    def from_dict(cls, entry):
+        return cls(
+            entry["command"],
+            entry["working_directory"],
+            entry.get("hidden_window"),
+            entry.get("window_class"),
+        )
+
+    def to_dict(self):
+        command = self.command
+        if isinstance(command, tuple):
+            command = list(command)
+        entry = {"command": command, "working_directory": self.working_directory}
+        if self.hidden_window is not None:
+            entry["hidden_window"] = self.hidden_window
+        if self.window_class is not None:
+            entry["window_class"] = self.window_class
+        return entry
+
+    def __eq__(self, other):
+        if not isinstance(other, Program):
+            return NotImplemented
+        return (
+            self.command == other.command
+            and self.working_directory == other.working_directory
+        )
+
+    def __hash__(self):
+        return hash((self.command, self.working_directory))
+
+    def __repr__(self):
+        return f"Program({self.command!r}, {self.working_directory!r})"
+
+
+def remove_running(saved_programs, running_programs):
+    """
+    Remove one saved entry for each running program which matches it.
+
+    Args:
+        saved_programs: The list of saved programs to filter.
+        running_programs: The programs already running in the workspace.
+    """
+    running = Counter(running_programs)
+    remaining = []
+    for program in saved_programs:
+        if running[program] > 0:
+            running[program] -= 1
         else:
-            command = cmdline
+            remaining.append(program)
+    return remaining
+
 
-        # Execute command via i3 exec.
-        i3.command(f'exec "cd \\"{working_directory}\\" && {command}"')
+async def get_programs_async(workspace_tree, semaphore=None, cache=None):
+    """
+    Get the running programs in a workspace tree. The PIDs of all windows are
+    looked up concurrently and processes are inspected in worker threads.
+
+    Args:
+        workspace_tree: The workspace's layout tree.
+        semaphore: Limits the number of xprop processes running at once
+            (shared between workspaces when saving several at once).
+        cache: The windowcache.WindowCache to use, if any.
+    """
+    windows = await get_window_programs_async(workspace_tree, semaphore, cache)
+    return [program for _, program in windows]
 
 
-def get_programs(workspace, numeric):
+async def get_window_programs_async(workspace_tree, semaphore=None, cache=None):
     """
-    Get running programs in specified workspace.
+    Get the running programs in a workspace tree along with their windows, as
+    (window container, Program) pairs.
 
     Args:
-        workspace: The workspace to search.
-        numeric: Identify workspace by number instead of name.
+        workspace_tree: The workspace's layout tree.
+        semaphore: Limits the number of xprop processes running at once.
+        cache: The windowcache.WindowCache to use, if any. Only the windows
+            which aren't cached have their PIDs looked up with xprop.
     """
-    # Loop through windows and save commands to launch programs on saved
-    # workspace.
-    programs = []
-    for con, pid in windows_in_workspace(workspace, numeric):
-        if pid == 0:
-            continue
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_PROCESSES)
+    loop = asyncio.get_running_loop()
+    windows = list(treeutils.get_leaves(workspace_tree))
+
+    async def lookup(con):
+        if cache is not None and con["window"] is not None:
+            cached = await loop.run_in_executor(None, cache.lookup, con)
+            if cached is not None:
+                return cached[0].pid, cached
+        return await get_window_pid_async(con, semaphore), None
+
+    lookups = await asyncio.gather(*(lookup(con) for con in windows))
+    found = [
+        (i, con, pid, cached)
+        for i, (con, (pid, cached)) in enumerate(zip(windows, lookups))
+        if pid
+    ]
+    programs = await asyncio.gather(
+        *(
+            loop.run_in_executor(None, get_program, con, pid, cache, cached)
+            for _, con, pid, cached in found
+        )
+    )
+
+    # Record which programs' windows are in hidden tabs, so that launching
+    # them can be deferred.
+    hidden = set(treeutils.get_hidden_windows(workspace_tree))
+    for (i, con, _, _), program in zip(found, programs):
+        if program is not None and con["id"] in hidden:
+            program.hidden_window = i
+    return [
+        (con, program)
+        for (_, con, _, _), program in zip(found, programs)
+        if program is not None
+    ]
+
+
+def get_program(con, pid, cache=None, cached=None):
+    """
+    Get the command and working directory of a window's process, or None if
+    it shouldn't be saved.
 
+    Args:
+        con: The window container node.
+        pid: The PID of the window's process.
+        cache: The windowcache.WindowCache to add the process to, if any.
+        cached: The process and cache entry from WindowCache.lookup(), if the
+            window is cached.
+    """
+    entry = None
+    if cached is not None:
+        procinfo, entry = cached
+        cmdline, exe = entry["cmdline"], entry["exe"]
+    else:
         # Get process info for the window.
         procinfo = psutil.Process(pid)
 
@@ -118,76 +299,96 @@ def get_programs(workspace, numeric):
             exe = procinfo.exe()
         except Exception:
             pass
+        cmdline = procinfo.cmdline()
 
-        # Create command to launch program.
-        command = get_window_command(
-            con["window_properties"],
-            procinfo.cmdline(),
-            exe,
-        )
-        if command in ([], ""):
-            continue
-
-        # Remove empty string arguments from command.
-        command = [arg for arg in command if arg != ""]
+    # Create command to launch program.
+    command = get_window_command(
+        con["window_properties"],
+        cmdline,
+        exe,
+    )
+    if command in ([], ""):
+        if cache is not None and entry is None:
+            _add_to_cache(cache, con, procinfo, cmdline, exe)
+        return None
 
-        terminals = config.get("terminals", [])
+    # Remove empty string arguments from command.
+    command = [arg for arg in command if arg != ""]
 
-        try:
-            # Obtain working directory using psutil.
-            if con["window_properties"]["class"] in terminals:
-                # If the program is a terminal emulator, get the working
-                # directory from its first subprocess.
-                working_directory = procinfo.children()[0].cwd()
-            else:
-                working_directory = procinfo.cwd()
-        except Exception:
-            working_directory = str(Path.home())
+    terminals = config.get("terminals", [])
 
-        # Add the command to the list.
-        programs.append({"command": command, "working_directory": working_directory})
+    cwd_process = None
+    try:
+        # Obtain working directory using psutil.
+        if con["window_properties"]["class"] in terminals:
+            # If the program is a terminal emulator, get the working
+            # directory from its first subprocess. Finding the children means
+            # going through every process, so the one found is cached.
+            if entry is not None:
+                cwd_process = cache.cwd_process(entry)
+            if cwd_process is None:
+                cwd_process = procinfo.children()[0]
+            working_directory = cwd_process.cwd()
+        else:
+            working_directory = procinfo.cwd()
+    except Exception:
+        working_directory = str(Path.home())
 
-    return programs
+    if cache is not None:
+        _add_to_cache(cache, con, procinfo, cmdline, exe, cwd_process)
 
+    return Program(
+        command,
+        working_directory,
+        window_class=con["window_properties"].get("class"),
+    )
 
-def windows_in_workspace(workspace, numeric):
-    """
-    Generator to iterate over windows in a workspace.
 
-    Args:
-        workspace: The name of the workspace whose windows to iterate over.
-    """
-    ws = treeutils.get_workspace_tree(workspace, numeric)
-    for con in treeutils.get_leaves(ws):
-        pid = get_window_pid(con)
-        yield (con, pid)
+def _add_to_cache(cache, con, procinfo, cmdline, exe, cwd_process=None):
+    try:
+        cache.add(con, procinfo, cmdline, exe, cwd_process)
+    except psutil.Error:
+        # The process has exited, so there is nothing to cache.
+        pass
 
 
-def get_window_pid(con):
+async def get_window_pid_async(con, semaphore):
     """
-    Get window PID using xprop.
+    Get window PID using xprop without blocking the event loop.
 
     Args:
         con: The window container node whose PID to look up.
+        semaphore: Limits the number of xprop processes running at once.
     """
     window_id = con["window"]
     if window_id is None:
         return 0
 
-    try:
-        xprop_output = (
-            subprocess.check_output(
-                shlex.split(f"xprop _NET_WM_PID -id {window_id}"),
-                stderr=subprocess.DEVNULL,
-            )
-            .decode("utf-8")
-            .split(" ")
+    async with semaphore:
+        process = await asyncio.create_subprocess_exec(
+            "xprop",
+            "_NET_WM_PID",
+            "-id",
+            str(window_id),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
         )
-        pid = int(xprop_output[len(xprop_output) - 1])
-    except (subprocess.CalledProcessError, ValueError, IndexError):
+        xprop_output, _ = await process.communicate()
+    if process.returncode != 0:
         return 0
 
-    return pid
+    return parse_xprop_pid(xprop_output)
+
+
+def parse_xprop_pid(xprop_output):
+    """
+    Parse the PID out of xprop's output, e.g. "_NET_WM_PID(CARDINAL) = 1234".
+    Returns 0 if the window has no PID.
+    """
+    try:
+        return int(xprop_output.decode("utf-8").split(" ")[-1])
+    except (ValueError, IndexError):
+        return 0
 
 
 def get_window_command(window_properties, cmdline, exe):
@@ -0,0 +1,87 @@
+"""
+JSON encoding and decoding through the fastest available library.
+
+If orjson is installed it is used, otherwise the standard library json module.
+The backend can be forced with `"json_backend": "orjson"` or `"json"` in the
+config. Both backends produce the same JSON, apart from orjson writing
+non-ASCII characters as UTF-8 instead of escaping them.
+"""
+
+import json
+
+from . import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ["orjson", "json"]
+
+
+class StdlibBackend:
+    """
+    The standard library json module.
+    """
+
+    name = "json"
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj, indent=None, default=None):
+        """
+        Encode obj to bytes, minified unless an indent is given.
+        """
+        return self._encoder(indent, default).encode(obj).encode("utf-8")
+
+    def _encoder(self, indent, default):
+        separators = (",", ": ") if indent is not None else (",", ":")
+        return json.JSONEncoder(indent=indent, separators=separators, default=default)
+
+
+class OrjsonBackend:
+    """
+    orjson, which only supports an indent of 2 so falls back to the standard
+    library for any other indent.
+    """
+
+    name = "orjson"
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj, indent=None, default=None):
+        if indent not in (None, 2):
+            return StdlibBackend().dumps(obj, indent, default)
+        option = orjson.OPT_INDENT_2 if indent == 2 else 0
+        return orjson.dumps(obj, default=default, option=option)
+
+
+def get_backend(name=None):
+    """
+    Get a backend by name, or the configured (by default the fastest
+    available) backend.
+
+    Args:
+        name: One of BACKENDS, "auto" or None.
+    """
+    if name is None:
+        name = config.get("json_backend", "auto")
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("orjson is not installed")
+        return OrjsonBackend()
+    if name == "json":
+        return StdlibBackend()
+    raise ValueError(f'Unknown JSON backend "{name}"')
+
+
+def loads(data):
+    return get_backend().loads(data)
+
+
+def dumps(obj, indent=None, default=None):
+    return get_backend().dumps(obj, indent, default)
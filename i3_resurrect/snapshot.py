@@ -0,0 +1,559 @@
+"""
+The Python interface for saving and restoring workspaces.
+
+Scripts which already talk to i3 with i3ipc can save and restore workspaces
+in-process, rather than by running the i3-resurrect command:
+
+    import i3ipc
+    from i3_resurrect.snapshot import Snapshot, Store, restore
+
+    conn = i3ipc.Connection()
+    snapshot = Snapshot.capture(conn, workspaces=["1", "2"])
+    saved = snapshot.save(Store(session="work"))
+
+    snapshot = Snapshot.load(Store(session="work"))
+    restored = restore(conn, snapshot)
+
+The requests are sent over a connection of our own to the passed
+connection's socket, which is kept open for as long as the passed connection
+exists, so a script which saves and restores repeatedly only connects once.
+(i3ipc's own requests build objects for the whole tree, which costs more than
+connecting.) The async variants send the requests over an open
+ipc.AsyncConnection if one is passed instead. Events are read on connections
+of their own. Saved workspaces which are missing raise SnapshotError, versions
+which aren't in the history raise history.VersionNotFound, files which can't
+be read raise storage.FormatError and invalid launch_priority settings raise
+priority.ConfigError.
+"""
+
+import asyncio
+import contextlib
+import threading
+import weakref
+from pathlib import Path
+
+from . import blobstore
+from . import bundle
+from . import config
+from . import ipc
+from . import manifest
+from . import pipeline
+from . import profiling
+from . import programs
+from . import util
+
+DEFAULT_DIRECTORY = config.get("directory", "~/.i3/i3-resurrect/")
+DEFAULT_SWALLOW_CRITERIA = ["class", "instance"]
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Store:
+    """
+    Where workspaces are saved: a directory, and within it optionally a
+    profile or a session.
+
+    Args:
+        directory: The top level directory, ~/.i3/i3-resurrect by default.
+        profile: The profile to save to or restore from, if any.
+        session: The session to save to or restore from, if any.
+    """
+
+    def __init__(self, directory=None, profile=None, session=None):
+        if directory is None:
+            directory = DEFAULT_DIRECTORY
+        self.root = util.resolve_directory(directory)
+        self.profile = profile
+        self.session = session
+        # The directory the profiles or sessions are in.
+        self.parent = util.resolve_directory(directory, profile, session)
+        self.directory = self.parent if session is None else self.parent / session
+
+    def manifest(self):
+        return manifest.Manifest(self.root)
+
+    def bundle(self, version=None):
+        """
+        Get the session's bundle to restore from, or None if the session isn't
+        saved as a bundle or an older version is restored.
+        """
+        if self.session is None or version is not None:
+            return None
+        bundle_file = bundle.session_path(self.parent, self.session)
+        if not bundle_file.exists():
+            return None
+        return bundle.Bundle(bundle_file)
+
+    def workspaces(self, session_bundle=None):
+        """
+        Get the names of the workspaces saved in the session, raising
+        SnapshotError if it isn't found.
+
+        Args:
+            session_bundle: The session's bundle, if it is saved as one.
+        """
+        if session_bundle is not None:
+            # Only the index is read here.
+            return session_bundle.workspaces()
+        index = self.manifest()
+        entries = index.find("workspace", self.session)
+        if not entries:
+            # The session may have been copied in by hand.
+            index.rebuild()
+            entries = index.find("workspace", self.session)
+        if not entries:
+            raise SnapshotError(f'Could not find saved session "{self.session}"')
+        return [e["name"] for e in entries if "layout" in e["files"]]
+
+
+class WorkspaceSnapshot:
+    """
+    The layout and programs of a workspace.
+
+    Attributes:
+        name: The name of the workspace.
+        layout: The workspace's layout, which is {} for an empty workspace,
+            or None if it wasn't captured.
+        programs: The workspace's programs as a list of programs.Program, or
+            None if they weren't captured.
+    """
+
+    def __init__(self, name, layout=None, programs=None):
+        self.name = name
+        self._layout = layout
+        self.programs = programs
+
+    @property
+    def layout(self):
+        # Captured layouts are kept compact until they are looked at.
+        if self._layout is not None and not isinstance(self._layout, dict):
+            self._layout = self._layout.to_dict()
+        return self._layout
+
+    @property
+    def compact_layout(self):
+        """
+        The layout as it was captured, a treeutils.LayoutNode which can be
+        written without turning it into dicts first, or the layout if it is
+        already dicts.
+        """
+        return self._layout
+
+    def __repr__(self):
+        return f"WorkspaceSnapshot({self.name!r})"
+
+
+class SavedWorkspace:
+    """
+    The result of saving a workspace.
+
+    Attributes:
+        name: The name of the workspace.
+        changed: Whether its saved files changed.
+    """
+
+    def __init__(self, name, changed):
+        self.name = name
+        self.changed = changed
+
+    def __repr__(self):
+        return f"SavedWorkspace({self.name!r}, changed={self.changed!r})"
+
+
+class RestoredWorkspace:
+    """
+    The result of restoring a workspace.
+
+    Attributes:
+        name: The name of the workspace.
+        restored: Whether it was restored, which a lazy restore only does for
+            the workspaces which are visited.
+        launched: The number of programs launched straight away.
+        deferred: The number of programs in hidden tabs, which are launched
+            when their placeholders are focused.
+        reused: The number of windows taken from other workspaces.
+    """
+
+    def __init__(self, name, restored=False, launched=0, deferred=0, reused=0):
+        self.name = name
+        self.restored = restored
+        self.launched = launched
+        self.deferred = deferred
+        self.reused = reused
+
+    def __repr__(self):
+        return (
+            f"RestoredWorkspace({self.name!r}, restored={self.restored!r}, "
+            f"launched={self.launched!r}, deferred={self.deferred!r}, "
+            f"reused={self.reused!r})"
+        )
+
+
+class Snapshot:
+    """
+    The layouts and programs of some workspaces, captured from i3 or loaded
+    from a store.
+
+    Args:
+        workspaces: The WorkspaceSnapshots.
+        numeric: Whether the workspaces are identified by number.
+    """
+
+    def __init__(self, workspaces, numeric=False):
+        self.workspaces = list(workspaces)
+        self.numeric = numeric
+
+    @classmethod
+    def capture(
+        cls,
+        conn=None,
+        workspaces=None,
+        numeric=False,
+        swallow_criteria=DEFAULT_SWALLOW_CRITERIA,
+        target=None,
+    ):
+        """
+        Capture workspaces' layouts and running programs.
+
+        Args:
+            conn: The i3ipc connection to i3, or None to look up i3's socket.
+            workspaces: The names of the workspaces, or None for every
+                workspace.
+            numeric: Identify workspaces by number instead of name.
+            swallow_criteria: The swallow criteria to build the layouts with.
+            target: "layout_only", "programs_only" or None for both.
+        """
+        return _run(
+            conn,
+            lambda i3: cls.capture_async(
+                i3, workspaces, numeric, swallow_criteria, target
+            ),
+        )
+
+    @classmethod
+    async def capture_async(
+        cls,
+        conn=None,
+        workspaces=None,
+        numeric=False,
+        swallow_criteria=DEFAULT_SWALLOW_CRITERIA,
+        target=None,
+    ):
+        """
+        Like capture(), for use from a running event loop. conn may also be an
+        open ipc.AsyncConnection.
+        """
+        captured = await pipeline.capture_async(
+            workspaces, numeric, swallow_criteria, target, _ipc_target(conn)
+        )
+        return cls([WorkspaceSnapshot(*workspace) for workspace in captured], numeric)
+
+    @classmethod
+    def load(cls, store, workspaces=None, version=None, target=None):
+        """
+        Load saved workspaces. Raises SnapshotError if any of them isn't
+        saved or a version of a whole session is asked for,
+        history.VersionNotFound if the version isn't in the history and
+        storage.FormatError if any file is invalid.
+
+        Args:
+            store: The Store to load from.
+            workspaces: The names of the saved workspaces (for a profile, the
+                workspace to restore it to), or None for every workspace in
+                the store's session.
+            version: The version to load from the history, if any.
+            target: "layout_only" to leave out the programs.
+        """
+        if workspaces is None and version is not None:
+            # Each workspace's versions are numbered separately, so version N
+            # of each would make up a session which was never saved.
+            raise SnapshotError("A version of a whole session can't be loaded")
+        session_bundle = store.bundle(version)
+        if workspaces is None:
+            workspaces = store.workspaces(session_bundle)
+        try:
+            saved = pipeline.read(
+                workspaces,
+                store.directory,
+                store.profile,
+                target,
+                version,
+                session_bundle,
+            )
+        except FileNotFoundError as e:
+            raise SnapshotError(str(e)) from e
+        loaded = []
+        for name, workspace_layout, saved_programs in saved:
+            if saved_programs is not None:
+                saved_programs = [programs.Program.from_dict(p) for p in saved_programs]
+            loaded.append(WorkspaceSnapshot(name, workspace_layout, saved_programs))
+        return cls(loaded)
+
+    def save(self, store):
+        """
+        Save the workspaces. Returns a SavedWorkspace for each workspace. A
+        session saved as a bundle is replaced as a whole, and is left as it
+        was if saving fails; otherwise each workspace's files are replaced
+        one at a time, so some may already have been if saving fails.
+
+        Args:
+            store: The Store to save to.
+        """
+        return asyncio.run(self.save_async(store))
+
+    async def save_async(self, store):
+        """
+        Like save(), for use from a running event loop.
+        """
+        blobs = blobstore.from_config(store.root)
+        index = store.manifest()
+        session_bundle = None
+        if store.session is not None:
+            session_bundle = bundle.from_config(store.parent, store.session)
+        if session_bundle is None:
+            Path(store.directory).mkdir(parents=True, exist_ok=True)
+
+        captured = [
+            (ws.name, ws.compact_layout, ws.programs) for ws in self.workspaces
+        ]
+        try:
+            changed = await pipeline.write_async(
+                captured,
+                store.directory,
+                store.profile,
+                blobs,
+                session_bundle,
+                index,
+                store.session,
+            )
+        except BaseException:
+            # Leave the previously saved session as it was.
+            if session_bundle is not None:
+                session_bundle.abort()
+            raise
+
+        await asyncio.get_running_loop().run_in_executor(
+            None, _finish_save, session_bundle, index, blobs, any(changed)
+        )
+        return [
+            SavedWorkspace(ws.name, was_changed)
+            for ws, was_changed in zip(self.workspaces, changed)
+        ]
+
+    def __repr__(self):
+        names = [ws.name for ws in self.workspaces]
+        return f"Snapshot({names!r})"
+
+
+def restore(
+    conn,
+    snapshot,
+    target=None,
+    background=False,
+    lazy=False,
+    visible_first=False,
+    defer_hidden=False,
+    startup_times=None,
+    reuse=False,
+):
+    """
+    Restore a snapshot's workspaces. Returns a RestoredWorkspace for each
+    workspace, in the order they were restored, followed by those which
+    weren't.
+
+    Args:
+        conn: The i3ipc connection to i3, or None to look up i3's socket.
+        snapshot: The Snapshot to restore.
+        target: "layout_only", "programs_only" or None for both.
+        background: Restore without switching to each workspace.
+        lazy: Restore each workspace when it is first visited, which returns
+            once every workspace has been restored or i3 exits.
+        visible_first: Restore the focused workspace and those visible on
+            other outputs first, then give focus back and restore the rest in
+            the background.
+        defer_hidden: Launch the programs in hidden tabs when their
+            placeholders are focused, which returns once every program has
+            been launched or i3 exits.
+        startup_times: The startup.StartupTimes to launch the slowest
+            programs first by and to learn from, if any (see
+            startup.from_config()).
+        reuse: Take the windows of programs which are running on other
+            workspaces instead of launching them again.
+    """
+    saved = _saved(snapshot, target)
+
+    def restore_with(i3):
+        if lazy:
+            return pipeline.restore_lazy(
+                saved, target, defer_hidden, startup_times, reuse, i3
+            )
+        return pipeline.restore_async(
+            saved,
+            target,
+            background,
+            visible_first,
+            defer_hidden,
+            startup_times,
+            reuse,
+            i3,
+        )
+
+    with profiling.phase("restore"):
+        restored = _run(conn, restore_with)
+    return _results(snapshot, restored)
+
+
+async def restore_async(
+    conn,
+    snapshot,
+    target=None,
+    background=False,
+    visible_first=False,
+    defer_hidden=False,
+    startup_times=None,
+    reuse=False,
+):
+    """
+    Like restore(), for use from a running event loop, without the lazy mode.
+    conn may also be an open ipc.AsyncConnection.
+    """
+    restored = await pipeline.restore_async(
+        _saved(snapshot, target),
+        target,
+        background,
+        visible_first,
+        defer_hidden,
+        startup_times,
+        reuse,
+        _ipc_target(conn),
+    )
+    return _results(snapshot, restored)
+
+
+def _saved(snapshot, target):
+    saved = []
+    for ws in snapshot.workspaces:
+        saved_programs = None
+        if ws.programs is not None and target != "layout_only":
+            saved_programs = [program.to_dict() for program in ws.programs]
+        # Without a layout, only the programs are restored.
+        workspace_layout = {} if ws.layout is None else ws.layout
+        saved.append((ws.name, workspace_layout, saved_programs))
+    return saved
+
+
+def _results(snapshot, restored):
+    results = [
+        RestoredWorkspace(
+            workspace.name,
+            True,
+            len(workspace.exec_commands),
+            len(workspace.deferred),
+            len(workspace.reused_window_ids),
+        )
+        for workspace in restored
+    ]
+    names = {workspace.name for workspace in restored}
+    results += [
+        RestoredWorkspace(ws.name) for ws in snapshot.workspaces if ws.name not in names
+    ]
+    return results
+
+
+def _finish_save(session_bundle, index, blobs, changed):
+    if session_bundle is not None:
+        # Replace the saved session in one go.
+        session_bundle.commit()
+
+    index.save()
+
+    if blobs is not None and changed:
+        # Remove blobs that were replaced by this save.
+        blobs.gc()
+
+
+def _ipc_target(conn):
+    # An open connection is used as it is, otherwise i3's socket is connected to.
+    if conn is None or isinstance(conn, ipc.AsyncConnection):
+        return conn
+    return conn.socket_path
+
+
+# The connections kept open for the callers' i3ipc connections.
+_kept = weakref.WeakKeyDictionary()
+_kept_lock = threading.Lock()
+
+
+def _run(conn, function):
+    """
+    Run the coroutine function(i3) to completion, where i3 is the connection
+    kept open for conn, or None for the socket to be looked up if conn is None.
+    """
+    if conn is None:
+        return asyncio.run(function(None))
+    with _kept_lock:
+        kept = _kept.get(conn)
+        if kept is None:
+            kept = _kept[conn] = _KeptConnection(conn.socket_path)
+            weakref.finalize(conn, kept.close)
+    return kept.run(function)
+
+
+class _KeptConnection:
+    """
+    An ipc.AsyncConnection kept open on an event loop of its own, which the
+    synchronous functions run on.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.loop = asyncio.new_event_loop()
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def run(self, function):
+        with self.lock:
+            try:
+                return self.loop.run_until_complete(self._run(function))
+            finally:
+                # Like asyncio.run(), leave nothing running until the next call.
+                pending = asyncio.all_tasks(self.loop)
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    self.loop.run_until_complete(
+                        asyncio.gather(*pending, return_exceptions=True)
+                    )
+
+    async def _run(self, function):
+        if self.connection is None or not self.connection.is_open:
+            # Connect again if i3 closed the connection, e.g. when restarting.
+            await self._close()
+            self.connection = await ipc.AsyncConnection(self.socket_path).open()
+        return await function(self.connection)
+
+    async def _close(self):
+        if self.connection is not None:
+            with contextlib.suppress(OSError):
+                await self.connection.close()
+            self.connection = None
+
+    def close(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._close_loop()
+        else:
+            # The caller's connection can be collected while another event loop
+            # is running in this thread, which this one can't run inside.
+            thread = threading.Thread(target=self._close_loop)
+            thread.start()
+            thread.join()
+
+    def _close_loop(self):
+        with self.lock:
+            if not self.loop.is_closed():
+                self.loop.run_until_complete(self._close())
+                self.loop.close()
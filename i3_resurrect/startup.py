@@ -0,0 +1,159 @@
+"""
+Learned startup times of restored programs.
+
+Restoring measures how long each program takes from being launched to its
+window appearing, and keeps a moving average per command in
+`startup_times.json` in the top level directory. Later restores launch the
+slowest programs of each workspace first, so that the workspace is complete
+sooner. The file is bounded to the most recently measured commands. Restores
+of several displays may share the file, so it is updated under a lock.
+
+Learning is turned on with `"startup_times": true` in the config, since
+restoring then waits for the windows to appear, for up to `startup_timeout`
+seconds (30 by default). Programs are matched to their windows by a token in
+the environment they are launched with (see the priority module).
+"""
+
+import fcntl
+import shlex
+from pathlib import Path
+
+from . import blobstore
+from . import config
+from . import serializer
+
+STARTUP_TIMES_FILE = "startup_times.json"
+STARTUP_TIMES_LOCK = ".startup_times.lock"
+STARTUP_TIMES_FORMAT = "i3-resurrect-startup-times"
+STARTUP_TIMES_VERSION = 1
+
+# The number of commands to keep startup times for.
+MAX_ENTRIES = 256
+
+# The weight of a new measurement in the moving average.
+SMOOTHING = 0.5
+
+# The default number of seconds to wait for a launched program's window.
+TIMEOUT = 30
+
+
+def command_key(program):
+    """
+    Get the key which a program's startup time is stored under, which is its
+    command as a shell command line.
+    """
+    command = program.command
+    if isinstance(command, tuple):
+        return " ".join(shlex.quote(arg) for arg in command)
+    return command
+
+
+class StartupTimes:
+    """
+    The startup times stored in a top level i3-resurrect directory, in
+    seconds by command key, least recently measured first.
+
+    Args:
+        root: The top level i3-resurrect directory.
+        timeout: How long to wait for a launched program's window, in seconds.
+    """
+
+    def __init__(self, root, timeout=TIMEOUT):
+        self.root = Path(root)
+        self.timeout = timeout
+        self.path = self.root / STARTUP_TIMES_FILE
+        self._times = None
+        # The measurements made since the times were last saved.
+        self._recorded = []
+
+    @property
+    def times(self):
+        if self._times is None:
+            try:
+                data = serializer.loads(self.path.read_bytes())
+                if data.get("version") != STARTUP_TIMES_VERSION:
+                    raise ValueError("unsupported startup times version")
+                self._times = {
+                    str(key): float(seconds) for key, seconds in data["times"].items()
+                }
+            except (FileNotFoundError, ValueError, KeyError, TypeError, AttributeError):
+                # They are only an optimisation, so start again.
+                self._times = {}
+        return self._times
+
+    def get(self, program):
+        """
+        Get a program's learned startup time, or None if it hasn't been
+        measured.
+        """
+        return self.times.get(command_key(program))
+
+    def record(self, key, seconds):
+        """
+        Add a measured startup time.
+
+        Args:
+            key: The program's command key.
+            seconds: The time from launching the program to its window
+                appearing.
+        """
+        _add(self.times, key, seconds)
+        self._recorded.append((key, seconds))
+
+    def slowest_first(self, programs):
+        """
+        Order programs by their learned startup times, slowest first. Programs
+        which haven't been measured are assumed to take the average time of
+        those which have, and programs with the same time keep their order.
+        """
+        times = [self.get(program) for program in programs]
+        known = [seconds for seconds in times if seconds is not None]
+        if not known:
+            return list(programs)
+        average = sum(known) / len(known)
+        estimates = [average if seconds is None else seconds for seconds in times]
+        order = sorted(range(len(programs)), key=lambda i: -estimates[i])
+        return [programs[i] for i in order]
+
+    def save(self):
+        """
+        Write the startup times, if any were recorded. The measurements are
+        added to the times as they are in the file by then, so that those
+        saved by another restore in the meantime aren't lost.
+        """
+        if not self._recorded or not self.root.is_dir():
+            return
+        with open(self.root / STARTUP_TIMES_LOCK, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._times = None
+            for key, seconds in self._recorded:
+                _add(self.times, key, seconds)
+            data = {
+                "format": STARTUP_TIMES_FORMAT,
+                "version": STARTUP_TIMES_VERSION,
+                "times": self.times,
+            }
+            blobstore.write_atomic(self.path, serializer.dumps(data, indent=2))
+        self._recorded = []
+
+
+def _add(times, key, seconds):
+    """
+    Add a measured startup time to the moving average of its command.
+    """
+    previous = times.pop(key, None)
+    if previous is not None:
+        seconds = previous + SMOOTHING * (seconds - previous)
+    times[key] = seconds
+    while len(times) > MAX_ENTRIES:
+        del times[next(iter(times))]
+
+
+def from_config(root):
+    """
+    Get the startup times for a directory if learning them is enabled in the
+    config, otherwise None.
+    """
+    if config.get("startup_times", False):
+        return StartupTimes(root, config.get("startup_timeout", TIMEOUT))
+    return None
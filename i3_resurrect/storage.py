@@ -0,0 +1,182 @@
+"""
+Encoding and decoding of saved layout files.
+
+Two formats are supported:
+
+- "json": the original format, an indented JSON dump of the layout tree.
+- "compact": minified JSON wrapped in a versioned envelope, with every
+  attribute that holds i3's default value left out.
+
+Either format may additionally be compressed with zlib or lzma. Reading
+detects the compression and format from the file contents, so files written
+in any format (including by older versions) can always be read.
+"""
+
+import lzma
+import zlib
+
+from . import serializer
+from . import treeutils
+
+COMPACT_FORMAT = "i3-resurrect-compact"
+COMPACT_VERSION = 1
+
+FORMATS = ["json", "compact"]
+COMPRESSIONS = [None, "zlib", "lzma"]
+
+# Values which are left out of compact layouts, per format version. Only
+# attributes in treeutils.REQUIRED_ATTRIBUTES may appear here.
+LAYOUT_DEFAULTS = {
+    1: {
+        "border": "normal",
+        "current_border_width": -1,
+        "floating": "auto_off",
+        "fullscreen_mode": 0,
+        "geometry": {"x": 0, "y": 0, "width": 0, "height": 0},
+        "layout": "splith",
+        "marks": [],
+        "name": None,
+        "orientation": "none",
+        "percent": None,
+        "scratchpad_state": "none",
+        "sticky": False,
+        "type": "con",
+        "workspace_layout": "default",
+    },
+}
+
+# Defaults which must be copied rather than shared between nodes.
+MUTABLE_DEFAULTS = ["geometry", "marks"]
+
+LZMA_MAGIC = b"\xfd7zXZ\x00"
+# The second byte of a zlib header depends on the compression level.
+ZLIB_MAGIC = [b"\x78\x01", b"\x78\x5e", b"\x78\x9c", b"\x78\xda"]
+
+
+class FormatError(Exception):
+    pass
+
+
+def dump_layout(layout, fmt="json", compression=None):
+    """
+    Encode a layout (a dict or a treeutils.LayoutNode) to bytes.
+
+    Args:
+        layout: The layout to encode.
+        fmt: One of FORMATS.
+        compression: One of COMPRESSIONS.
+    """
+    if fmt == "compact":
+        defaults = LAYOUT_DEFAULTS[COMPACT_VERSION]
+        if isinstance(layout, dict):
+            layout = _elide_tree(layout, defaults)
+        envelope = {
+            "format": COMPACT_FORMAT,
+            "version": COMPACT_VERSION,
+            "layout": layout,
+        }
+        # LayoutNodes are expanded and elided one node at a time as they are
+        # written.
+        data = serializer.dumps(
+            envelope,
+            default=lambda value: elide_defaults(
+                treeutils.json_default(value), defaults
+            ),
+        )
+    elif fmt == "json":
+        data = serializer.dumps(layout, indent=2, default=treeutils.json_default)
+    else:
+        raise FormatError(f'Unknown layout format "{fmt}"')
+
+    return compress(data, compression)
+
+
+def load_layout(data):
+    """
+    Decode a layout file's contents in any supported format.
+
+    Args:
+        data: The file contents as bytes.
+    """
+    layout = serializer.loads(decompress(data))
+
+    if isinstance(layout, dict) and layout.get("format") == COMPACT_FORMAT:
+        version = layout.get("version")
+        if version not in LAYOUT_DEFAULTS:
+            raise FormatError(
+                f"Layout was saved in compact format version {version}, which is "
+                "not supported by this version of i3-resurrect"
+            )
+        layout = expand_defaults(layout["layout"], LAYOUT_DEFAULTS[version])
+
+    return layout
+
+
+def compress(data, compression):
+    if compression is None:
+        return data
+    if compression == "zlib":
+        return zlib.compress(data, 9)
+    if compression == "lzma":
+        return lzma.compress(data)
+    raise FormatError(f'Unknown compression "{compression}"')
+
+
+def decompress(data):
+    """
+    Decompress data if it starts with a zlib or lzma header.
+    """
+    try:
+        if data.startswith(LZMA_MAGIC):
+            return lzma.decompress(data)
+        if data[:2] in ZLIB_MAGIC:
+            return zlib.decompress(data)
+    except (lzma.LZMAError, zlib.error) as e:
+        raise FormatError(f"Corrupt compressed data: {str(e)}")
+    return data
+
+
+def elide_defaults(node, defaults):
+    """
+    Return a shallow copy of a layout node without attributes that hold their
+    default value.
+    """
+    return {
+        key: value
+        for key, value in node.items()
+        if key not in defaults or value != defaults[key]
+    }
+
+
+def _elide_tree(node, defaults):
+    node = elide_defaults(node, defaults)
+    for node_type in ["nodes", "floating_nodes"]:
+        if node_type in node:
+            node[node_type] = [_elide_tree(child, defaults) for child in node[node_type]]
+    return node
+
+
+def expand_defaults(node, defaults):
+    """
+    Fill in the attributes left out of a compact layout node, recursively.
+    """
+    if not node:
+        return node
+    expanded = {**defaults, **node}
+    for key in MUTABLE_DEFAULTS:
+        if key not in node and key in defaults:
+            expanded[key] = _copy(defaults[key])
+    for node_type in ["nodes", "floating_nodes"]:
+        if node_type in node:
+            expanded[node_type] = [
+                expand_defaults(child, defaults) for child in node[node_type]
+            ]
+    return expanded
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return list(value)
+    return value
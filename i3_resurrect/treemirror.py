@@ -0,0 +1,271 @@
+"""
+An in-memory copy of i3's layout tree, kept up to date from events.
+
+Processes which keep running after a restore (restore --lazy and
+--defer-hidden) look at the tree after every event. Rather than fetching and
+parsing the whole tree each time, a TreeMirror fetches it once and applies
+window, workspace and output events to it.
+
+Changes which events describe completely (titles, marks, focus, fullscreen,
+closed windows, workspaces and their contents) are applied in place. So are new
+windows: those which fill a placeholder take its place, and other focused
+tiling windows go where i3 puts them, after the focused container. i3's events
+don't say where moved containers or floating windows were put, output events
+say nothing at all, and there are no events for changes such as split layouts,
+so those changes mark the mirror as stale and it is fetched again the next
+time it is read. It is also fetched again every RESYNC_INTERVAL seconds to
+guard against any other drift.
+
+Some changes, such as focusing a container without a window by clicking on
+its tab, send no event at all. Processes which need to see them call poll()
+periodically, which fetches the tree again if no event arrived in between.
+"""
+
+import asyncio
+
+# Events which are applied in place. The rest mark the mirror as stale.
+WINDOW_CHANGES = [
+    "new",
+    "title",
+    "mark",
+    "urgent",
+    "fullscreen_mode",
+    "focus",
+    "close",
+]
+WORKSPACE_CHANGES = ["focus", "init", "rename", "urgent", "empty", "move"]
+
+
+class TreeMirror:
+    """
+    A copy of i3's tree, kept up to date by passing every event received to
+    apply().
+
+    Args:
+        i3: The ipc.AsyncConnection to fetch the tree over.
+    """
+
+    EVENTS = ["window", "workspace", "output"]
+    # Seconds after which the tree is fetched again anyway.
+    RESYNC_INTERVAL = 30
+
+    def __init__(self, i3):
+        self.i3 = i3
+        self.root = None
+        # Every container by id, and the id of each container's parent.
+        self._nodes = {}
+        self._parents = {}
+        self._focused = None
+        self._synced = None
+        # Whether an event arrived since the last poll().
+        self._event = False
+
+    def invalidate(self):
+        """
+        Fetch the tree again the next time it is read, e.g. after sending
+        commands which change it.
+        """
+        self.root = None
+
+    def poll(self):
+        """
+        Check for changes which i3 sends no events for: mark the mirror as
+        stale unless an event arrived since the last poll.
+        """
+        if not self._event:
+            self.invalidate()
+        self._event = False
+
+    async def get_tree(self):
+        """
+        Get the tree, fetching it if it is stale.
+        """
+        now = asyncio.get_running_loop().time()
+        if self.root is None or now - self._synced >= self.RESYNC_INTERVAL:
+            self._index(await self.i3.get_tree())
+            self._synced = now
+        return self.root
+
+    def apply(self, name, payload):
+        """
+        Apply an event.
+
+        Args:
+            name: The event type's name, e.g. "window".
+            payload: The event's payload.
+        """
+        self._event = True
+        if self.root is None:
+            return
+        change = payload.get("change")
+        if name == "window" and change in WINDOW_CHANGES:
+            applied = self._apply_window(change, payload["container"])
+        elif name == "workspace" and change in WORKSPACE_CHANGES:
+            applied = self._apply_workspace(change, payload)
+        else:
+            applied = False
+        if not applied:
+            self.invalidate()
+
+    def _apply_window(self, change, con):
+        if con.get("id") not in self._nodes:
+            return change == "new" and self._insert(con)
+        # A window which fills a placeholder keeps the placeholder's id.
+        if change == "close":
+            self._remove(con["id"])
+        else:
+            self._replace(con)
+            if change == "focus":
+                self._focus(con["id"])
+        return True
+
+    def _apply_workspace(self, change, payload):
+        current = payload.get("current")
+        if current is None:
+            return False
+        if change == "empty":
+            if current.get("id") in self._nodes:
+                self._remove(current["id"])
+            return True
+        known = current.get("id") in self._nodes
+        if change == "move" or not known:
+            if change not in ("init", "move"):
+                return False
+            # New workspaces go on their output's content container, as do
+            # workspaces moved to another output.
+            content = self._content(current.get("output"))
+            if content is None:
+                return False
+            if known:
+                self._remove(current["id"])
+            content.setdefault("nodes", []).append(current)
+            content.setdefault("focus", []).append(current["id"])
+            self._add(current, content["id"])
+        else:
+            self._replace(current)
+        if change == "focus":
+            # The workspace's payload includes its focused container.
+            focused = next(
+                (con["id"] for con in self._walk(current) if con.get("focused")),
+                current["id"],
+            )
+            self._focus(focused)
+        return True
+
+    def _insert(self, con):
+        # The event doesn't say where the window went, but i3 puts a new
+        # window which it focuses after the focused container, unless that is
+        # floating. Floating windows and those which aren't focused (e.g.
+        # assigned to another workspace) can't be placed.
+        if not con.get("focused") or str(con.get("floating")).endswith("_on"):
+            return False
+        focused = self._nodes.get(self._focused)
+        if focused is None:
+            return False
+        if focused.get("type") == "workspace":
+            parent = focused
+        else:
+            parent = self._nodes.get(self._parents.get(self._focused))
+        if parent is None or parent.get("type") not in ("con", "workspace"):
+            return False
+        if (
+            parent.get("type") == "workspace"
+            and parent.get("workspace_layout", "default") != "default"
+        ):
+            # i3 wraps it in a new split container.
+            return False
+        nodes = parent.setdefault("nodes", [])
+        ids = [node["id"] for node in nodes]
+        # After the first tiling container in the parent's focus stack.
+        after = next((i for i in parent.get("focus", []) if i in ids), None)
+        nodes.insert(len(nodes) if after is None else ids.index(after) + 1, con)
+        parent.setdefault("focus", []).append(con["id"])
+        self._add(con, parent["id"])
+        self._focus(con["id"])
+        return True
+
+    def _index(self, root):
+        self.root = root
+        self._nodes = {}
+        self._parents = {}
+        self._focused = None
+        self._add(root, None)
+
+    def _add(self, con, parent_id):
+        for node, parent in self._walk_with_parents(con, parent_id):
+            self._nodes[node["id"]] = node
+            self._parents[node["id"]] = parent
+            if node.get("focused"):
+                self._set_focused(node["id"])
+
+    def _replace(self, con):
+        node = self._nodes[con["id"]]
+        parent = self._parents[con["id"]]
+        for child in self._walk(node):
+            if child is not node:
+                self._nodes.pop(child["id"], None)
+                self._parents.pop(child["id"], None)
+        node.clear()
+        node.update(con)
+        self._add(node, parent)
+
+    def _remove(self, con_id):
+        parent = self._nodes.get(self._parents.get(con_id))
+        node = self._nodes[con_id]
+        for child in self._walk(node):
+            self._nodes.pop(child["id"], None)
+            self._parents.pop(child["id"], None)
+        if parent is None:
+            return
+        for key in ("nodes", "floating_nodes"):
+            parent[key] = [c for c in parent.get(key, []) if c is not node]
+        if con_id in parent.get("focus", []):
+            parent["focus"] = [i for i in parent["focus"] if i != con_id]
+        # i3 closes split containers and floating containers which are left
+        # empty, but not the content containers of outputs.
+        grandparent = self._nodes.get(self._parents.get(parent["id"]), {})
+        if (
+            parent.get("type") in ("con", "floating_con")
+            and grandparent.get("type") != "output"
+            and not parent.get("nodes")
+            and not parent.get("floating_nodes")
+            and parent.get("window") is None
+        ):
+            self._remove(parent["id"])
+
+    def _set_focused(self, con_id):
+        # Only one container is focused at a time.
+        previous = self._nodes.get(self._focused)
+        if previous is not None and self._focused != con_id:
+            previous["focused"] = False
+        self._nodes[con_id]["focused"] = True
+        self._focused = con_id
+
+    def _focus(self, con_id):
+        self._set_focused(con_id)
+        # Move the container to the front of its ancestors' focus stacks.
+        child = con_id
+        parent = self._parents.get(con_id)
+        while parent is not None:
+            node = self._nodes[parent]
+            node["focus"] = [child] + [i for i in node.get("focus", []) if i != child]
+            child = parent
+            parent = self._parents.get(parent)
+
+    def _content(self, output):
+        for node in self.root.get("nodes", []):
+            if node.get("name") == output:
+                for child in node.get("nodes", []):
+                    if child.get("type") == "con" and child.get("name") == "content":
+                        return child
+        return None
+
+    def _walk(self, con):
+        yield con
+        for node in con.get("nodes", []) + con.get("floating_nodes", []):
+            yield from self._walk(node)
+
+    def _walk_with_parents(self, con, parent_id):
+        yield con, parent_id
+        for node in con.get("nodes", []) + con.get("floating_nodes", []):
+            yield from self._walk_with_parents(node, con["id"])
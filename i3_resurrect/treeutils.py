@@ -1,7 +1,5 @@
-import json
 import re
-import shlex
-import subprocess
+import sys
 
 from . import config
 
@@ -51,21 +49,9 @@ def process_node(original, swallow):
 
     # Set swallow criteria if the node is a window.
     if "window_properties" in original:
-        processed["swallows"] = [{}]
-        # Local variable for swallow criteria.
-        swallow_criteria = swallow
-        # Get swallow criteria from config.
-        window_swallow_mappings = config.get("window_swallow_criteria", {})
-        window_class = original["window_properties"].get("class", "")
-        # Swallow criteria from config override the command line parameters
-        # if present.
-        if window_class in window_swallow_mappings:
-            swallow_criteria = window_swallow_mappings[window_class]
-        for criterion in swallow_criteria:
-            if criterion in original["window_properties"]:
-                # Escape special characters in swallow criteria.
-                escaped = re.escape(original["window_properties"][criterion])
-                processed["swallows"][0][criterion] = escaped
+        processed["swallows"] = [
+            dict(get_swallows(original["window_properties"], swallow))
+        ]
 
     # Recurse over child nodes (normal and floating).
     for node_type in ["nodes", "floating_nodes"]:
@@ -78,27 +64,249 @@ def process_node(original, swallow):
     return processed
 
 
-def get_workspace_tree(workspace, numeric):
+def get_swallows(window_properties, swallow):
     """
-    Get full workspace layout tree from i3.
+    Get the (criterion, escaped value) pairs to swallow a window with.
+
+    Args:
+        window_properties: The window_properties of the window's container.
+        swallow: The default swallow criteria.
+    """
+    # Local variable for swallow criteria.
+    swallow_criteria = swallow
+    # Get swallow criteria from config.
+    window_swallow_mappings = config.get("window_swallow_criteria", {})
+    window_class = window_properties.get("class", "")
+    # Swallow criteria from config override the command line parameters if
+    # present.
+    if window_class in window_swallow_mappings:
+        swallow_criteria = window_swallow_mappings[window_class]
+    swallows = []
+    for criterion in swallow_criteria:
+        if criterion in window_properties:
+            # Escape special characters in swallow criteria.
+            escaped = re.escape(window_properties[criterion])
+            swallows.append((criterion, escaped))
+    return swallows
+
+
+def intern(value):
+    """
+    Intern strings so that values repeated throughout a tree, such as layout,
+    border and window class, are only stored once.
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class LayoutNode:
+    """
+    Compact equivalent of the dicts built by process_node.
+
+    Attributes which are not set on the original node are left unset rather
+    than stored, repeated strings are interned, rects are stored as tuples and
+    children as tuples of LayoutNodes. Use to_dict() or json_default() to turn
+    it back into JSON serialisable data when it is written.
+    """
+
+    __slots__ = tuple(REQUIRED_ATTRIBUTES) + (
+        "output",
+        "rect",
+        "swallows",
+        "nodes",
+        "floating_nodes",
+    )
+
+    RECT_ATTRIBUTES = ("geometry", "rect")
+    RECT_KEYS = ("x", "y", "width", "height")
+    # Most containers have an all-zero geometry, so share one tuple for it.
+    ZERO_RECT = (0, 0, 0, 0)
+
+    @classmethod
+    def from_con(cls, original, swallow):
+        """
+        Build a LayoutNode from a container in an i3 tree. Returns None for an
+        empty container.
+        """
+        # Base case.
+        if original is None or original == {}:
+            return None
+
+        node = cls()
+
+        # Set attributes.
+        for attribute in REQUIRED_ATTRIBUTES:
+            if attribute in original:
+                value = original[attribute]
+                if type(value) is str:
+                    value = sys.intern(value)
+                elif type(value) is dict or type(value) is list:
+                    value = cls._compact(attribute, value)
+                setattr(node, attribute, value)
+
+        # Keep output attribute for workspace nodes and rect attribute for
+        # floating nodes.
+        con_type = original.get("type")
+        if con_type == "workspace":
+            node.output = intern(original["output"])
+        if con_type == "floating_con":
+            node.rect = cls._compact("rect", original["rect"])
+
+        # Set swallow criteria if the node is a window.
+        if "window_properties" in original:
+            swallows = get_swallows(original["window_properties"], swallow)
+            node.swallows = tuple(
+                (sys.intern(criterion), sys.intern(value))
+                for criterion, value in swallows
+            )
+
+        # Recurse over child nodes (normal and floating).
+        for node_type in ["nodes", "floating_nodes"]:
+            if original.get(node_type):
+                children = (cls.from_con(child, swallow) for child in original[node_type])
+                setattr(node, node_type, tuple(c for c in children if c is not None))
+
+        return node
+
+    @classmethod
+    def _compact(cls, attribute, value):
+        if attribute in cls.RECT_ATTRIBUTES and type(value) is dict:
+            try:
+                rect = (value["x"], value["y"], value["width"], value["height"])
+            except KeyError:
+                rect = tuple(value.get(key, 0) for key in cls.RECT_KEYS)
+            return cls.ZERO_RECT if rect == cls.ZERO_RECT else rect
+        if type(value) is list:
+            return tuple(map(intern, value)) if value else ()
+        return intern(value)
+
+    def json_default(self):
+        """
+        Shallow conversion for use as json.dump's default hook, so that the
+        dicts for child nodes are only built as they are being written.
+        """
+        result = {}
+        for attribute in self.__slots__:
+            try:
+                value = getattr(self, attribute)
+            except AttributeError:
+                continue
+            if attribute in self.RECT_ATTRIBUTES:
+                value = dict(zip(self.RECT_KEYS, value))
+            elif attribute == "swallows":
+                value = [dict(value)]
+            elif attribute == "marks":
+                value = list(value)
+            result[attribute] = value
+        return result
+
+    def to_dict(self):
+        """
+        Convert the whole tree to the same dicts as process_node builds.
+        """
+        result = self.json_default()
+        for node_type in ["nodes", "floating_nodes"]:
+            if node_type in result:
+                result[node_type] = [child.to_dict() for child in result[node_type]]
+        return result
+
+
+def json_default(value):
+    """
+    json.dump default hook which serialises LayoutNodes.
+    """
+    if isinstance(value, LayoutNode):
+        return value.json_default()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def find_workspace(root, workspace, numeric):
+    """
+    Find a workspace in a layout tree.
+
+    Args:
+        root: The root of the tree.
+        workspace: The name (or number) of the workspace.
+        numeric: Identify workspace by number instead of name.
+    """
+    for ws in iter_workspaces(root):
+        # Select workspace and trigger name and num field
+        if numeric:
+            if workspace.isdigit() and "num" in ws and ws["num"] == int(workspace):
+                return ws
+        elif ws["name"] == workspace:
+            return ws
+    return {}
+
+
+def iter_workspaces(root, include_scratchpad=True):
+    """
+    Iterate over the workspace nodes in a layout tree.
+
+    Args:
+        root: The root of the tree.
+        include_scratchpad: Whether to include i3's internal scratchpad
+            workspace, which is not listed by GET_WORKSPACES.
     """
-    root = json.loads(subprocess.check_output(shlex.split("i3-msg -t get_tree")))
     for output in root["nodes"]:
+        if output["name"] == "__i3" and not include_scratchpad:
+            continue
         for container in output["nodes"]:
-            if container["type"] != "con":
-                pass
             for ws in container["nodes"]:
-                # Select workspace and trigger name and num field
-                if numeric:
-                    if (
-                        workspace.isdigit()
-                        and "num" in ws
-                        and ws["num"] == int(workspace)
-                    ):
-                        return ws
-                elif ws["name"] == workspace:
-                    return ws
-    return {}
+                if ws.get("type") == "workspace":
+                    yield ws
+
+
+def focused_workspace(root):
+    """
+    Get the name of the focused workspace in a layout tree, or None.
+
+    Args:
+        root: The root of the tree.
+    """
+    for ws in iter_workspaces(root):
+        if any(con.get("focused") for con in iter_cons(ws)):
+            return ws["name"]
+    return None
+
+
+def iter_cons(container):
+    """
+    Iterate over a container and all of its descendants.
+    """
+    yield container
+    for node in container.get("nodes", []) + container.get("floating_nodes", []):
+        yield from iter_cons(node)
+
+
+def get_hidden_windows(container, hidden=False):
+    """
+    Recursive generator for retrieving the ids of a container's windows which
+    are hidden behind another tab of a tabbed or stacked container.
+
+    Args:
+        container: The container to traverse.
+        hidden: Whether the container itself is hidden.
+    """
+    nodes = container.get("nodes", [])
+    shown = None
+    if container.get("layout") in ("tabbed", "stacked") and nodes:
+        # The shown tab is the first tiling child in the focus stack.
+        ids = [node["id"] for node in nodes]
+        shown = next((i for i in container.get("focus", []) if i in ids), ids[0])
+
+    for node in nodes:
+        node_hidden = hidden or (shown is not None and node["id"] != shown)
+        yield from _hidden_windows(node, node_hidden)
+    for node in container.get("floating_nodes", []):
+        yield from _hidden_windows(node, hidden)
+
+
+def _hidden_windows(node, hidden):
+    if "window_properties" in node and hidden:
+        yield node["id"]
+    yield from get_hidden_windows(node, hidden)
 
 
 def get_leaves(container):
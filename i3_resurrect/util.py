@@ -1,5 +1,4 @@
 import sys
-from natsort import natsorted
 from os.path import expandvars
 from pathlib import Path
 
@@ -26,6 +25,15 @@ def filename_filter(filename):
     return filename
 
 
+def saved_name(workspace, profile=None):
+    """
+    Get the name that a saved workspace or profile's files start with.
+    """
+    if profile is not None:
+        return profile
+    return f"workspace_{filename_filter(workspace)}"
+
+
 def resolve_directory(directory, profile=None, session=None):
     directory = Path(expandvars(directory)).expanduser()
     if profile is not None:
@@ -33,36 +41,3 @@ def resolve_directory(directory, profile=None, session=None):
     if session is not None:
         directory = directory / "sessions"
     return directory
-
-
-def resolve_filetype(file):
-    """
-    Extract from file name if it is a layout of a program file.
-    """
-    name = file.name
-    name = name[name.index("_") + 1 :]
-    file_type = name[name.rfind("_") + 1 : name.index(".json")]
-    return file_type
-
-
-def resolve_workspace_name(file, is_profile=False):
-    """
-    Extract the name of the workspace or the profile from the file name.
-    """
-    name = file.name
-    if not is_profile:
-        name = name[name.index("_") + 1 :]
-    workspace = name[: name.rfind("_")]
-    return workspace
-
-
-def get_list_of_workspaces(directory, is_profile=False):
-    """
-    Generate a list of all the workspaces or profiles present in a directory
-    """
-    workspaces = []
-    for entry in directory.iterdir():
-        if entry.is_file():
-            workspaces.append(f'{resolve_workspace_name(entry, is_profile)} {resolve_filetype(entry)}')
-    workspaces = natsorted(workspaces)
-    return workspaces
@@ -0,0 +1,181 @@
+"""
+A cache of the processes of windows, kept between saves.
+
+Looking up a window's program means running xprop for its PID and reading the
+process' command line and executable. Windows usually stay open for much
+longer than the time between two saves, so these are cached by X window id,
+along with the window's class, the PID and the process' creation time, which
+tell whether the process has changed. A repeat save only runs xprop and
+inspects the processes of windows which are new or whose process changed. The
+working directory is always read again, but a terminal's shell is cached too,
+so that it doesn't need to search every process for the terminal's children.
+
+The cache is kept in $XDG_RUNTIME_DIR (or ~/.cache) per X display, since
+window ids and PIDs only mean anything within one session. It can be turned
+off with `"window_cache": false` in the config.
+"""
+
+import os
+import threading
+from pathlib import Path
+
+import psutil
+
+from . import blobstore
+from . import config
+from . import serializer
+from . import util
+
+CACHE_FORMAT = "i3-resurrect-window-cache"
+CACHE_VERSION = 1
+
+# The number of windows to keep, most recently seen first.
+MAX_ENTRIES = 1024
+
+
+def cache_path():
+    """
+    Get the path of the cache for the current X display.
+    """
+    directory = os.environ.get("XDG_RUNTIME_DIR") or Path("~/.cache").expanduser()
+    display = util.filename_filter(os.environ.get("DISPLAY", "")) or "default"
+    return Path(directory) / "i3-resurrect" / f"window_cache_{display}.json"
+
+
+class WindowCache:
+    """
+    The cached processes of windows, by X window id. Each entry is a dict
+    with the keys:
+
+    - class: The window's class.
+    - pid: The PID of the window's process.
+    - create_time: The process' creation time.
+    - cmdline: The process' command line.
+    - exe: The process' executable, or None if it couldn't be read.
+    - cwd_pid: The PID of the process to read the working directory of, if
+      it isn't the window's process (e.g. a terminal's shell).
+    - cwd_create_time: That process' creation time.
+
+    Lookups and updates may happen in worker threads.
+
+    Args:
+        path: The cache file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._entries = None
+        self._lock = threading.Lock()
+        self._changed = False
+
+    @property
+    def entries(self):
+        with self._lock:
+            if self._entries is None:
+                try:
+                    data = serializer.loads(self.path.read_bytes())
+                    if data.get("version") != CACHE_VERSION:
+                        raise ValueError("unsupported window cache version")
+                    self._entries = dict(data["windows"])
+                except (FileNotFoundError, ValueError, KeyError, TypeError):
+                    self._entries = {}
+            return self._entries
+
+    def lookup(self, con):
+        """
+        Get the process of a window and its cache entry, or None if it isn't
+        cached or its process has changed.
+
+        Args:
+            con: The window container node.
+        """
+        entry = self.entries.get(str(con["window"]))
+        if entry is None:
+            return None
+        if entry["class"] != con["window_properties"].get("class"):
+            # The window id has been reused.
+            return None
+        process = _process(entry["pid"], entry["create_time"])
+        if process is None:
+            return None
+        return process, entry
+
+    def cwd_process(self, entry):
+        """
+        Get the process to read the working directory of from a cache entry,
+        or None if it has changed.
+        """
+        if entry.get("cwd_pid") is None:
+            return None
+        return _process(entry["cwd_pid"], entry["cwd_create_time"])
+
+    def add(self, con, process, cmdline, exe, cwd_process=None):
+        """
+        Cache the process of a window.
+
+        Args:
+            con: The window container node.
+            process: The window's psutil.Process.
+            cmdline: The process' command line.
+            exe: The process' executable, or None.
+            cwd_process: The psutil.Process to read the working directory of,
+                if it isn't the window's process.
+        """
+        entry = {
+            "class": con["window_properties"].get("class"),
+            "pid": process.pid,
+            "create_time": process.create_time(),
+            "cmdline": list(cmdline),
+            "exe": exe,
+        }
+        if cwd_process is not None and cwd_process.pid != process.pid:
+            entry["cwd_pid"] = cwd_process.pid
+            entry["cwd_create_time"] = cwd_process.create_time()
+        key = str(con["window"])
+        entries = self.entries
+        with self._lock:
+            # Keep the most recently seen windows last.
+            entries.pop(key, None)
+            entries[key] = entry
+            while len(entries) > MAX_ENTRIES:
+                del entries[next(iter(entries))]
+            self._changed = True
+
+    def save(self):
+        """
+        Write the cache, if anything was added.
+        """
+        if not self._changed:
+            return
+        data = {
+            "format": CACHE_FORMAT,
+            "version": CACHE_VERSION,
+            "windows": self.entries,
+        }
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            blobstore.write_atomic(self.path, serializer.dumps(data))
+        except OSError:
+            # The cache is only an optimisation.
+            return
+        self._changed = False
+
+
+def _process(pid, create_time):
+    try:
+        process = psutil.Process(pid)
+        if process.create_time() != create_time:
+            # The PID has been reused.
+            return None
+        return process
+    except psutil.Error:
+        return None
+
+
+def from_config():
+    """
+    Get the window cache if it is enabled in the config, otherwise None.
+    """
+    if config.get("window_cache", True):
+        return WindowCache(cache_path())
+    return None
@@ -1,3 +1,18 @@
+from . import test_blobstore
+from . import test_bundle
+from . import test_e2e
+from . import test_history
+from . import test_ipc
 from . import test_layout
+from . import test_main
+from . import test_manifest
+from . import test_priority
+from . import test_profiling
 from . import test_programs
+from . import test_serializer
+from . import test_snapshot
+from . import test_startup
+from . import test_storage
+from . import test_treemirror
 from . import test_treeutils
+from . import test_windowcache
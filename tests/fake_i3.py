@@ -0,0 +1,721 @@
+"""
+A fake i3 which speaks the i3 IPC protocol on a UNIX socket.
+
+The fake serves get_tree/get_workspaces/get_outputs from a fixture tree,
+records every command it receives and simulates windows appearing after
+`exec` commands, so that save and restore can be run end-to-end without an X
+server or a real i3.
+
+Typical use:
+
+    with FakeI3(fixture("tree.json"), window_delay=0.05) as i3:
+        with i3.environment(tmp_path):
+            main(["save", "--session", "test", "-d", str(tmp_path)])
+        assert i3.execs == []
+"""
+
+import json
+import os
+import pickle
+import re
+import shlex
+import socketserver
+import stat
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+MAGIC = b"i3-ipc"
+HEADER = struct.Struct("=6sII")
+
+COMMAND = 0
+GET_WORKSPACES = 1
+SUBSCRIBE = 2
+GET_OUTPUTS = 3
+GET_TREE = 4
+GET_MARKS = 5
+GET_VERSION = 7
+SEND_TICK = 10
+SYNC = 11
+
+EVENT_WORKSPACE = 0x80000000
+EVENT_WINDOW = 0x80000003
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+
+def fixture(name):
+    """
+    Load a JSON fixture from tests/fixtures.
+    """
+    return json.loads((FIXTURES_DIR / name).read_text())
+
+
+def default_window_properties(command):
+    """
+    Derive window properties for a window launched by an exec command from the
+    basename of the executable.
+    """
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        argv = command.split()
+    if "&&" in argv:
+        argv = argv[argv.index("&&") + 1 :]
+    name = os.path.basename(argv[0]) if argv else "unknown"
+    return {"class": name.capitalize(), "instance": name, "title": name}
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        fake = self.server.fake
+        sock = self.request
+        with fake._lock:
+            fake.connections += 1
+        try:
+            while True:
+                header = _recv_exactly(sock, HEADER.size)
+                if header is None:
+                    return
+                magic, length, msg_type = HEADER.unpack(header)
+                if magic != MAGIC:
+                    return
+                payload = _recv_exactly(sock, length) if length else b""
+                if payload is None:
+                    return
+                # Replies and events share the lock so that an event can never
+                # be written in the middle of, or ahead of, a reply.
+                with fake._lock:
+                    reply = fake.handle_message(sock, msg_type, payload.decode("utf-8"))
+                    fake.send(sock, msg_type, reply)
+        except OSError:
+            return
+        finally:
+            fake.unsubscribe(sock)
+
+
+def _recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeI3:
+    """
+    In-process fake i3 IPC server.
+
+    Args:
+        tree: The tree to serve, as returned by `i3-msg -t get_tree`.
+        socket_path: Where to create the socket. A temporary path is used if
+            not given.
+        window_delay: Seconds between an exec command and its window
+            appearing, or None for windows never to appear. May also be a
+            callable taking the exec command.
+        window_properties: Callable mapping an exec command to the
+            window_properties of the window it creates.
+    """
+
+    def __init__(
+        self,
+        tree,
+        socket_path=None,
+        window_delay=0.0,
+        window_properties=default_window_properties,
+    ):
+        # Pickled, since unpickling is much faster than copy.deepcopy().
+        self._initial_tree = pickle.dumps(tree)
+        self.window_delay = window_delay
+        self.window_properties = window_properties
+        if socket_path is None:
+            self._tmpdir = tempfile.TemporaryDirectory(prefix="fake-i3-")
+            socket_path = os.path.join(self._tmpdir.name, "ipc.sock")
+        else:
+            self._tmpdir = None
+        self.socket_path = str(socket_path)
+        self._lock = threading.RLock()
+        self._subscribers = {}
+        self._timers = []
+        self._server = None
+        self._thread = None
+        self._pid_dir = None
+        self._processes = []
+        self.reset()
+
+    def reset(self):
+        """
+        Restore the initial tree and clear all recorded calls.
+        """
+        with self._lock:
+            for timer in self._timers:
+                timer.cancel()
+            self._timers = []
+            self.tree = pickle.loads(self._initial_tree)
+            self._next_id = max(_ids(self.tree), default=1) + 1
+            self._next_window = (
+                max((w for w in _windows(self.tree) if w), default=0x3000000) + 1
+            )
+            focused = next(
+                (ws for ws in self.iter_workspaces() if _focused_in(ws)), None
+            )
+            if focused is None:
+                focused = next(self.iter_workspaces(), None)
+            self.focused_workspace = focused["name"] if focused else None
+            # The workspace last shown on each output.
+            self._shown = {focused["output"]: focused["name"]} if focused else {}
+            self.connections = 0
+            self.messages = []
+            self.commands = []
+            self.layouts = []
+            self.execs = []
+            self.windows_spawned = []
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = _Server(self.socket_path, _Handler)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            for timer in self._timers:
+                timer.cancel()
+        self._kill_processes()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @contextmanager
+    def environment(self, bin_dir, pid=None):
+        """
+        Point i3ipc at this server and put fake xprop/xdotool executables on
+        the PATH for the duration of the block. The runtime directory, where
+        the window cache is kept, is moved next to bin_dir.
+
+        The fake xprop reports the given pid (the current process by default)
+        for every window, and the fake xdotool does nothing. Windows of exec
+        commands which set I3_RESURRECT_LAUNCH get a process of their own
+        with it in its environment instead, as the launched program would.
+        """
+        bin_dir = Path(bin_dir)
+        bin_dir.mkdir(parents=True, exist_ok=True)
+        self._pid_dir = bin_dir / "pids"
+        self._pid_dir.mkdir(exist_ok=True)
+        write_x11_shims(bin_dir, os.getpid() if pid is None else pid, self._pid_dir)
+        keys = ("I3SOCK", "PATH", "XDG_RUNTIME_DIR")
+        saved = {key: os.environ.get(key) for key in keys}
+        os.environ["I3SOCK"] = self.socket_path
+        os.environ["PATH"] = f"{bin_dir}{os.pathsep}{saved['PATH'] or ''}"
+        os.environ["XDG_RUNTIME_DIR"] = str(bin_dir.parent / "runtime")
+        try:
+            yield self
+        finally:
+            self._kill_processes()
+            self._pid_dir = None
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+    def wait_for_windows(self, count, timeout=5.0):
+        """
+        Block until at least count windows have been spawned by exec commands.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if len(self.windows_spawned) >= count:
+                    return True
+            time.sleep(0.005)
+        return False
+
+    def clear_workspaces(self):
+        """
+        Remove every window and container from every workspace, leaving focus
+        on the (now empty) focused workspace.
+        """
+        with self._lock:
+            for ws in self.iter_workspaces():
+                ws["nodes"] = []
+                ws["floating_nodes"] = []
+                ws["focus"] = []
+                ws["focused"] = ws["name"] == self.focused_workspace
+
+    # Tree helpers.
+
+    def iter_workspaces(self):
+        for output in self.tree.get("nodes", []):
+            for content in output.get("nodes", []):
+                if content.get("type") != "con":
+                    continue
+                yield from content.get("nodes", [])
+
+    def find_workspace(self, name):
+        return next((ws for ws in self.iter_workspaces() if ws["name"] == name), None)
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def _new_workspace(self, name):
+        output = next(
+            o for o in self.tree["nodes"] if not o.get("name", "").startswith("__")
+        )
+        content = next(c for c in output["nodes"] if c.get("type") == "con")
+        ws = _con(self._new_id(), "workspace", name, output["name"])
+        ws["num"] = int(name) if name.isdigit() else -1
+        content["nodes"].append(ws)
+        self.emit(EVENT_WORKSPACE, {"change": "init", "current": ws})
+        return ws
+
+    def _focus(self, name):
+        previous = self.find_workspace(self.focused_workspace)
+        ws = self.find_workspace(name) or self._new_workspace(name)
+        for node in _walk(self.tree):
+            node["focused"] = False
+        ws["focused"] = True
+        self.focused_workspace = name
+        self._shown[ws["output"]] = name
+        self.emit(
+            EVENT_WORKSPACE, {"change": "focus", "current": ws, "old": previous}
+        )
+        return ws
+
+    # Protocol.
+
+    def send(self, sock, msg_type, payload):
+        data = json.dumps(payload).encode("utf-8")
+        sock.sendall(HEADER.pack(MAGIC, len(data), msg_type) + data)
+
+    def emit(self, event_type, payload):
+        name = {EVENT_WORKSPACE: "workspace", EVENT_WINDOW: "window"}[event_type]
+        for sock, events in list(self._subscribers.items()):
+            if name in events:
+                try:
+                    self.send(sock, event_type, payload)
+                except OSError:
+                    self.unsubscribe(sock)
+
+    def unsubscribe(self, sock):
+        self._subscribers.pop(sock, None)
+
+    def handle_message(self, sock, msg_type, payload):
+        with self._lock:
+            self.messages.append((msg_type, payload))
+            if msg_type == COMMAND:
+                return [self.run_command(c) for c in _split_commands(payload)]
+            if msg_type == GET_WORKSPACES:
+                return self.workspaces_reply()
+            if msg_type == GET_OUTPUTS:
+                return self.outputs_reply()
+            if msg_type == GET_TREE:
+                return self.tree
+            if msg_type == SUBSCRIBE:
+                self._subscribers[sock] = set(json.loads(payload))
+                return {"success": True}
+            if msg_type == GET_MARKS:
+                return sorted({m for n in _walk(self.tree) for m in n.get("marks", [])})
+            if msg_type == GET_VERSION:
+                return {
+                    "major": 4,
+                    "minor": 20,
+                    "patch": 0,
+                    "human_readable": "4.20 (fake)",
+                    "loaded_config_file_name": "",
+                }
+            if msg_type in (SEND_TICK, SYNC):
+                return {"success": True}
+            return {"success": False, "error": f"unsupported message {msg_type}"}
+
+    def visible_workspaces(self):
+        """
+        Get the names of the workspaces shown on each output: the one last
+        focused there, or else the first.
+        """
+        visible = set()
+        for output in self.tree.get("nodes", []):
+            for content in output.get("nodes", []):
+                if content.get("type") != "con":
+                    continue
+                names = [ws["name"] for ws in content.get("nodes", [])]
+                shown = self._shown.get(output.get("name"))
+                if shown not in names:
+                    shown = names[0] if names else None
+                if shown is not None:
+                    visible.add(shown)
+        return visible
+
+    def workspaces_reply(self):
+        visible = self.visible_workspaces()
+        return [
+            {
+                "id": ws["id"],
+                "num": ws.get("num", -1),
+                "name": ws["name"],
+                "visible": ws["name"] in visible,
+                "focused": ws["name"] == self.focused_workspace,
+                "urgent": False,
+                "rect": ws["rect"],
+                "output": ws.get("output"),
+            }
+            for ws in self.iter_workspaces()
+            if not ws["name"].startswith("__")
+        ]
+
+    def outputs_reply(self):
+        return [
+            {
+                "name": output["name"],
+                "active": not output["name"].startswith("__"),
+                "primary": False,
+                "current_workspace": None,
+                "rect": output["rect"],
+            }
+            for output in self.tree.get("nodes", [])
+        ]
+
+    def run_command(self, command):
+        command = command.strip()
+        self.commands.append(command)
+
+        # Strip leading criteria, e.g. [con_id="1"] or [workspace="2"].
+        criteria = None
+        match = re.match(r"^\[(.*?)\]\s*", command)
+        if match:
+            criteria = match.group(1)
+            command = command[match.end() :]
+
+        if command.startswith("exec "):
+            return self._exec(command[len("exec ") :])
+        if command.startswith("workspace "):
+            name = command.split(" ", 1)[1]
+            name = name.replace("--no-auto-back-and-forth", "").strip()
+            self._focus(_unquote(name))
+            return {"success": True}
+        if command.startswith("append_layout "):
+            return self._append_layout(command.split(" ", 1)[1].strip())
+        if command.startswith("unmark "):
+            mark = _unquote(command.split(" ", 1)[1])
+            for node in _walk(self.tree):
+                if mark in node.get("marks", []):
+                    node["marks"].remove(mark)
+            return {"success": True}
+
+        # Only con_id, con_mark and id criteria are matched, other criteria leave
+        # the command without effect as before.
+        matched = self._match(criteria)
+        if command.startswith("layout "):
+            if criteria is None:
+                matched = [self.find_workspace(self.focused_workspace)]
+            for con in matched:
+                con["layout"] = command.split(" ", 1)[1]
+        elif command.startswith("move container to workspace "):
+            name = _unquote(command[len("move container to workspace ") :])
+            for con in matched:
+                target = self.find_workspace(name) or self._new_workspace(name)
+                self._detach(con)
+                key = "floating_nodes" if con.get("type") == "floating_con" else "nodes"
+                target[key].append(con)
+        elif command == "focus":
+            for con in matched[:1]:
+                ws = self._workspace_of(con)
+                self._focus(ws["name"])
+                for node in _walk(self.tree):
+                    node["focused"] = node is con
+                self.emit(EVENT_WINDOW, {"change": "focus", "container": con})
+        elif command.startswith("move workspace to output "):
+            output = command[len("move workspace to output ") :].strip()
+            for con in matched:
+                ws = self._workspace_of(con)
+                self._move_workspace(ws, output)
+        return {"success": True}
+
+    def _match(self, criteria):
+        if criteria is None:
+            return []
+        match = re.match(r'^(con_id|con_mark|id)="?([^"]*)"?$', criteria.strip())
+        if match is None:
+            return []
+        key, value = match.groups()
+        if key == "con_id":
+            return [n for n in _walk(self.tree) if str(n.get("id")) == value]
+        if key == "id":
+            return [n for n in _walk(self.tree) if str(n.get("window")) == value]
+        return [
+            n
+            for n in _walk(self.tree)
+            if any(re.search(value, mark) for mark in n.get("marks", []))
+        ]
+
+    def _parent(self, con):
+        for node in _walk(self.tree):
+            if any(c is con for c in node.get("nodes", []) + node.get("floating_nodes", [])):
+                return node
+        return None
+
+    def _detach(self, con):
+        parent = self._parent(con)
+        for key in ("nodes", "floating_nodes"):
+            parent[key] = [c for c in parent.get(key, []) if c is not con]
+
+    def _workspace_of(self, con):
+        while con is not None and con.get("type") != "workspace":
+            con = self._parent(con)
+        return con
+
+    def _move_workspace(self, ws, output_name):
+        output = next(
+            (o for o in self.tree["nodes"] if o.get("name") == output_name), None
+        )
+        if ws is None or output is None:
+            return
+        content = next(c for c in output["nodes"] if c.get("type") == "con")
+        self._detach(ws)
+        content["nodes"].append(ws)
+        for node in _walk(ws):
+            node["output"] = output_name
+
+    def _exec(self, command):
+        if command.startswith("--no-startup-id "):
+            command = command[len("--no-startup-id ") :]
+        command = _unquote(command)
+        self.execs.append(command)
+        delay = self.window_delay
+        if callable(delay):
+            delay = delay(command)
+        if delay is None:
+            return {"success": True}
+        workspace = self.focused_workspace
+        timer = threading.Timer(delay, self._spawn_window, (workspace, command))
+        timer.daemon = True
+        self._timers.append(timer)
+        timer.start()
+        return {"success": True}
+
+    def _append_layout(self, path):
+        try:
+            content = Path(path).read_text()
+        except OSError as e:
+            return {"success": False, "error": str(e)}
+        try:
+            nodes = json.loads(content)
+        except json.JSONDecodeError:
+            # append_layout also accepts several concatenated JSON values.
+            decoder = json.JSONDecoder()
+            nodes, index = [], 0
+            while index < len(content):
+                value, index = decoder.raw_decode(content, index)
+                nodes.append(value)
+                while index < len(content) and content[index].isspace():
+                    index += 1
+        self.layouts.append(nodes)
+        ws = self.find_workspace(self.focused_workspace)
+        for node in _flatten_layout(nodes):
+            if node.get("type") == "workspace":
+                self._add_layout_workspace(ws, node)
+            else:
+                self._add_layout_node(ws, node)
+        return {"success": True}
+
+    def _add_layout_workspace(self, focused, node):
+        # Like i3, append a workspace to the focused output without changing
+        # focus, renaming it if a workspace with its name already exists.
+        name = base = node.get("name") or "unnamed"
+        count = 1
+        while self.find_workspace(name) is not None:
+            name = f"{base}_{count}"
+            count += 1
+        output = next(o for o in self.tree["nodes"] if o.get("name") == focused["output"])
+        content = next(c for c in output["nodes"] if c.get("type") == "con")
+        ws = _con(self._new_id(), "workspace", name, output["name"])
+        ws["num"] = int(name) if name.isdigit() else -1
+        for key in ("layout", "marks"):
+            if key in node:
+                ws[key] = node[key]
+        content["nodes"].append(ws)
+        for child in node.get("nodes", []) + node.get("floating_nodes", []):
+            self._add_layout_node(ws, child)
+        self.emit(EVENT_WORKSPACE, {"change": "init", "current": ws})
+
+    def _add_layout_node(self, parent, node):
+        con = _con(self._new_id(), node.get("type", "con"), node.get("name"), parent.get("output"))
+        for key in ("layout", "border", "marks", "percent", "swallows"):
+            if key in node:
+                con[key] = node[key]
+        key = "floating_nodes" if node.get("type") == "floating_con" else "nodes"
+        parent[key].append(con)
+        for child in node.get("nodes", []) + node.get("floating_nodes", []):
+            self._add_layout_node(con, child)
+
+    def _spawn_window(self, workspace_name, command):
+        with self._lock:
+            ws = self.find_workspace(workspace_name)
+            if ws is None:
+                return
+            properties = self.window_properties(command)
+            self._next_window += 1
+            # Like i3, placeholders on any workspace may swallow the window.
+            con = _find_swallower(self.tree, properties)
+            if con is None:
+                con = _con(self._new_id(), "con", properties.get("title"), ws.get("output"))
+                ws["nodes"].append(con)
+            else:
+                workspace_name = self._workspace_of(con)["name"]
+            con["swallows"] = []
+            con["name"] = properties.get("title")
+            con["window"] = self._next_window
+            con["window_properties"] = properties
+            self.windows_spawned.append((workspace_name, command, con["window"]))
+            self._start_process(command, con["window"])
+            self.emit(EVENT_WINDOW, {"change": "new", "container": con})
+
+    def _start_process(self, command, window):
+        match = re.search(r"I3_RESURRECT_LAUNCH=(\S+)", command)
+        if match is None or self._pid_dir is None:
+            return
+        env = dict(os.environ, I3_RESURRECT_LAUNCH=match.group(1))
+        process = subprocess.Popen(["sleep", "60"], env=env)
+        self._processes.append(process)
+        (self._pid_dir / str(window)).write_text(str(process.pid))
+
+    def _kill_processes(self):
+        with self._lock:
+            processes, self._processes = self._processes, []
+        for process in processes:
+            process.kill()
+            process.wait()
+
+
+def write_x11_shims(bin_dir, pid, pid_dir):
+    """
+    Write fake xprop and xdotool executables into bin_dir. xprop reports the
+    PID in pid_dir/<window> if there is one, and pid otherwise.
+    """
+    scripts = {
+        "xprop": (
+            f"#!/bin/sh\npid={pid}\n"
+            f'if [ -f "{pid_dir}/$3" ]; then pid=$(cat "{pid_dir}/$3"); fi\n'
+            'echo "_NET_WM_PID(CARDINAL) = $pid"\n'
+        ),
+        "xdotool": "#!/bin/sh\nexit 0\n",
+    }
+    for name, content in scripts.items():
+        path = Path(bin_dir) / name
+        path.write_text(content)
+        path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def _con(con_id, con_type, name, output):
+    return {
+        "id": con_id,
+        "type": con_type,
+        "orientation": "horizontal",
+        "scratchpad_state": "none",
+        "percent": None,
+        "urgent": False,
+        "focused": False,
+        "output": output,
+        "layout": "splith",
+        "workspace_layout": "default",
+        "last_split_layout": "splith",
+        "border": "normal",
+        "current_border_width": -1,
+        "rect": {"x": 0, "y": 0, "width": 0, "height": 0},
+        "deco_rect": {"x": 0, "y": 0, "width": 0, "height": 0},
+        "window_rect": {"x": 0, "y": 0, "width": 0, "height": 0},
+        "geometry": {"x": 0, "y": 0, "width": 0, "height": 0},
+        "name": name,
+        "window": None,
+        "nodes": [],
+        "floating_nodes": [],
+        "focus": [],
+        "fullscreen_mode": 0,
+        "sticky": False,
+        "floating": "auto_off",
+        "swallows": [],
+        "marks": [],
+    }
+
+
+def _walk(node):
+    yield node
+    for child in node.get("nodes", []) + node.get("floating_nodes", []):
+        yield from _walk(child)
+
+
+def _ids(tree):
+    return (node.get("id", 0) for node in _walk(tree))
+
+
+def _windows(tree):
+    return (node.get("window") for node in _walk(tree))
+
+
+def _focused_in(node):
+    return any(n.get("focused") for n in _walk(node))
+
+
+def _flatten_layout(nodes):
+    """
+    append_layout accepts a single node, a list of nodes, or (as written by
+    layout.restorable_layout) a list wrapped in a tuple-turned-list.
+    """
+    if isinstance(nodes, dict):
+        return [nodes]
+    result = []
+    for node in nodes:
+        result.extend(_flatten_layout(node))
+    return result
+
+
+def _find_swallower(ws, properties):
+    for node in _walk(ws):
+        for swallow in node.get("swallows") or []:
+            if all(
+                re.search(pattern, str(properties.get(criterion, "")))
+                for criterion, pattern in swallow.items()
+            ):
+                return node
+    return None
+
+
+def _split_commands(payload):
+    # Commands containing exec are passed through whole, since their
+    # arguments may legitimately contain semicolons.
+    if re.match(r"^\s*(\[[^\]]*\]\s*)?exec ", payload) or ";" not in payload:
+        return [payload]
+    return [c for c in payload.split(";") if c.strip()]
+
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        value = value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return value
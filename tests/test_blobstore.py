@@ -0,0 +1,38 @@
+from i3_resurrect import blobstore
+
+
+def test_blob_store(tmp_path):
+    store = blobstore.BlobStore(tmp_path)
+    profile = tmp_path / 'profiles' / 'work_layout.json'
+    session = tmp_path / 'sessions' / 'monday' / 'workspace_1_layout.json'
+    profile.parent.mkdir(parents=True)
+    session.parent.mkdir(parents=True)
+
+    store.write(profile, b'{"layout": 1}')
+    store.write(session, b'{"layout": 1}')
+    blobs = [p for p in store.blobs.rglob('*') if p.is_file()]
+    assert len(blobs) == 1
+    assert blobstore.read(profile) == blobstore.read(session) == b'{"layout": 1}'
+
+    # Saving identical state doesn't write anything.
+    mtime = profile.stat().st_mtime_ns
+    blob_mtime = blobs[0].stat().st_mtime_ns
+    store.write(profile, b'{"layout": 1}')
+    assert profile.stat().st_mtime_ns == mtime
+    assert blobs[0].stat().st_mtime_ns == blob_mtime
+
+    # Replaced and deleted blobs are garbage collected.
+    store.write(profile, b'{"layout": 2}')
+    assert store.gc() == 0
+    session.unlink()
+    assert store.gc() == 1
+    assert blobstore.read(profile) == b'{"layout": 2}'
+
+    # Plain files are read as they are.
+    plain = tmp_path / 'workspace_2_layout.json'
+    assert blobstore.write(plain, b'{}')
+    assert blobstore.read(plain) == b'{}'
+    mtime = plain.stat().st_mtime_ns
+    assert not blobstore.write(plain, b'{}')
+    assert plain.stat().st_mtime_ns == mtime
+    assert store.gc() == 0
@@ -0,0 +1,47 @@
+import pytest
+
+from i3_resurrect import bundle
+
+
+def test_bundle(tmp_path):
+    path = bundle.session_path(tmp_path, 'work')
+    writer = bundle.BundleWriter(path)
+    writer.add('1', 'layout', b'{"layout": 1}')
+    writer.add('1', 'programs', b'[1]')
+    writer.add('3 chat', 'layout', b'{"layout": 3}')
+    writer.add('3 chat', 'programs', b'[3]')
+    writer.commit()
+
+    saved = bundle.Bundle(path)
+    assert saved.workspaces() == ['1', '3 chat']
+    assert saved.read('3 chat', 'layout') == b'{"layout": 3}'
+    with pytest.raises(FileNotFoundError):
+        saved.read('2', 'layout')
+
+    # Files which aren't saved again are carried over.
+    writer = bundle.BundleWriter(path)
+    writer.add('1', 'layout', b'{"layout": 2}')
+    writer.commit()
+    saved = bundle.Bundle(path)
+    assert saved.read('1', 'layout') == b'{"layout": 2}'
+    assert saved.read('1', 'programs') == b'[1]'
+    assert saved.read('3 chat', 'programs') == b'[3]'
+
+    # Saving identical files leaves the bundle untouched.
+    mtime = path.stat().st_mtime_ns
+    writer = bundle.BundleWriter(path)
+    assert not writer.add('1', 'layout', b'{"layout": 2}')
+    writer.commit()
+    assert path.stat().st_mtime_ns == mtime
+
+    # An aborted save leaves the previous bundle untouched.
+    writer = bundle.BundleWriter(path)
+    writer.add('1', 'layout', b'{"layout": 4}')
+    writer.abort()
+    assert bundle.Bundle(path).read('1', 'layout') == b'{"layout": 2}'
+    assert [p.name for p in tmp_path.iterdir()] == ['work.bundle']
+
+    # Truncated bundles are detected.
+    path.write_bytes(path.read_bytes()[:-3])
+    with pytest.raises(bundle.BundleError):
+        bundle.Bundle(path).workspaces()
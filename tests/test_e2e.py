@@ -0,0 +1,473 @@
+import json
+import socket
+import threading
+import time
+
+import i3ipc
+import pytest
+from click.testing import CliRunner
+
+from i3_resurrect import config
+from i3_resurrect import main
+from i3_resurrect import snapshot
+from i3_resurrect import treeutils
+
+from .fake_i3 import COMMAND
+from .fake_i3 import GET_TREE
+from .fake_i3 import FakeI3
+from .fake_i3 import fixture
+
+COMMAND_MAPPINGS = [
+    {'class': 'Alacritty', 'command': 'alacritty'},
+    {'class': 'Firefox', 'command': 'firefox'},
+    {'class': 'Code', 'command': 'code'},
+    {'class': 'Zathura', 'command': 'zathura'},
+    {'class': 'mpv', 'command': 'mpv'},
+    {'class': 'Slack', 'command': 'slack'},
+]
+
+
+def window_properties(command):
+    # Map the launched command back to the window class it was saved from.
+    name = command.split('&&')[-1].split()[-1].strip('"')
+    classes = {m['command']: m['class'] for m in COMMAND_MAPPINGS}
+    window_class = classes.get(name, name)
+    return {'class': window_class, 'instance': name, 'title': name}
+
+
+def use_config(monkeypatch, **settings):
+    monkeypatch.setattr(
+        config,
+        '_config',
+        {'window_command_mappings': COMMAND_MAPPINGS, 'terminals': [], **settings},
+    )
+
+
+@pytest.fixture
+def i3(monkeypatch, tmp_path):
+    use_config(monkeypatch)
+    with FakeI3(fixture('tree.json'), window_properties=window_properties) as i3:
+        with i3.environment(tmp_path / 'bin'):
+            yield i3
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return tmp_path / 'data'
+
+
+def invoke(directory, *args):
+    return CliRunner().invoke(main.main, [*args, '-d', str(directory)])
+
+
+def save_session(directory):
+    result = invoke(directory, 'save', '--session', 'test')
+    assert result.exit_code == 0, result.output
+    return result
+
+
+def restore_session(directory, *args):
+    return invoke(directory, 'restore', '--session', 'test', *args)
+
+
+def in_thread(function):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(function()))
+    thread.start()
+    return thread, results
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_save_and_restore_session(monkeypatch, i3, directory):
+    use_config(monkeypatch, window_swallow_criteria={})
+    save_session(directory)
+
+    session_dir = directory / 'sessions' / 'test'
+    saved = sorted(f.name for f in session_dir.iterdir())
+    assert saved == [
+        'workspace_1_layout.json',
+        'workspace_1_programs.json',
+        'workspace_2_layout.json',
+        'workspace_2_programs.json',
+        'workspace_3 chat_layout.json',
+        'workspace_3 chat_programs.json',
+    ]
+    programs = json.loads((session_dir / 'workspace_2_programs.json').read_text())
+    assert [p['command'] for p in programs] == [['code'], ['zathura'], ['mpv']]
+
+    # Empty every workspace so that restore has to launch everything.
+    i3.clear_workspaces()
+
+    result = restore_session(directory)
+    assert result.exit_code == 0, result.output
+    assert i3.wait_for_windows(6)
+
+    assert sorted(i3.execs, key=lambda c: c.split('&&')[-1]) == [
+        f'cd "{programs[0]["working_directory"]}" && "{name}"'
+        for name in sorted(['alacritty', 'code', 'firefox', 'mpv', 'slack', 'zathura'])
+    ]
+    assert len(i3.layouts) == 3
+    # Every launched window was swallowed by a placeholder from the layout.
+    assert all(
+        not node.get('swallows')
+        for ws in i3.iter_workspaces()
+        for node in ws['nodes'] + ws['floating_nodes']
+        if node.get('window')
+    )
+
+
+def test_save_and_restore_session_bundle(monkeypatch, i3, directory):
+    use_config(monkeypatch, window_swallow_criteria={}, session_format='bundle')
+    save_session(directory)
+    sessions = directory / 'sessions'
+    assert [f.name for f in sessions.iterdir()] == ['test.bundle']
+
+    result = invoke(directory, 'ls', 'sessions')
+    assert result.output.splitlines()[:3] == [
+        'Session test',
+        'Workspace 1 layout',
+        'Workspace 1 programs',
+    ]
+
+    i3.clear_workspaces()
+
+    result = restore_session(directory)
+    assert result.exit_code == 0, result.output
+    assert i3.wait_for_windows(6)
+
+    result = invoke(directory, 'rm', '--session', 'test')
+    assert result.exit_code == 0, result.output
+    assert list(sessions.iterdir()) == []
+
+    assert len(i3.execs) == 6
+    assert len(i3.layouts) == 3
+
+
+def test_save_skips_unchanged(i3, directory):
+    result = save_session(directory)
+    assert result.output.splitlines() == [
+        'Saved workspace 1',
+        'Saved workspace 2',
+        'Saved workspace 3 chat',
+    ]
+    session_dir = directory / 'sessions' / 'test'
+    mtimes = {f: f.stat().st_mtime_ns for f in session_dir.iterdir()}
+
+    # Saving again writes nothing.
+    result = save_session(directory)
+    assert result.output == ''
+    assert {f: f.stat().st_mtime_ns for f in session_dir.iterdir()} == mtimes
+
+
+def test_save_single_workspace(i3, directory):
+    result = invoke(directory, 'save', '-w', '2')
+    assert result.exit_code == 0, result.output
+    assert result.output == 'Saved workspace 2\n'
+
+    saved = sorted(f.name for f in directory.iterdir() if f.suffix == '.json')
+    assert saved == [
+        'manifest.json',
+        'workspace_2_layout.json',
+        'workspace_2_programs.json',
+    ]
+
+
+def test_save_focused_workspace(i3, directory):
+    result = invoke(directory, 'save')
+    assert result.exit_code == 0, result.output
+    assert result.output == f'Saved workspace {i3.focused_workspace}\n'
+    # The focused workspace is found without fetching the tree.
+    assert [t for t, _ in i3.messages].count(GET_TREE) == 1
+
+
+def test_save_uses_window_cache(i3, directory, tmp_path):
+    save_session(directory)
+    programs_file = directory / 'sessions' / 'test' / 'workspace_2_programs.json'
+    saved = programs_file.read_text()
+
+    # Windows which are cached don't need xprop.
+    (tmp_path / 'bin' / 'xprop').write_text('#!/bin/sh\nexit 1\n')
+    save_session(directory)
+    assert programs_file.read_text() == saved
+
+
+def test_save_several_displays(i3, tmp_path):
+    directory = tmp_path / 'data' / '$DISPLAY'
+    # A socket which accepts connections but never replies.
+    hung = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    hung.bind(str(tmp_path / 'hung.sock'))
+    hung.listen()
+
+    with FakeI3(fixture('tree.json'), window_properties=window_properties) as i3_2:
+        result = CliRunner().invoke(
+            main.main,
+            ['save', '--session', 'test', '-d', str(directory)]
+            + ['--display', 'first', '--socket', i3.socket_path]
+            + ['--display', 'second', '--socket', i3_2.socket_path]
+            + ['--display', 'hung', '--socket', str(tmp_path / 'hung.sock')]
+            + ['--timeout', '3'],
+            catch_exceptions=False,
+        )
+    hung.close()
+
+    assert result.exit_code == 1
+    for display in ('first', 'second'):
+        assert f'{display}: Saved workspace 1' in result.output
+        session_dir = tmp_path / 'data' / display / 'sessions' / 'test'
+        assert (session_dir / 'workspace_1_layout.json').exists()
+    assert 'hung: Timed out after 3 seconds' in result.output
+
+
+def test_snapshot_api(i3, directory):
+    store = snapshot.Store(directory, session='test')
+
+    conn = i3ipc.Connection()
+    captured = snapshot.Snapshot.capture(conn, workspaces=['1', '2'])
+    assert [ws.name for ws in captured.workspaces] == ['1', '2']
+    programs = captured.workspaces[1].programs
+    assert [p.command for p in programs] == [('code',), ('zathura',), ('mpv',)]
+    saved = captured.save(store)
+    assert [(ws.name, ws.changed) for ws in saved] == [('1', True), ('2', True)]
+
+    i3.clear_workspaces()
+    loaded = snapshot.Snapshot.load(store)
+    restored = snapshot.restore(conn, loaded)
+    assert [(ws.name, ws.restored, ws.launched) for ws in restored] == [
+        ('1', True, 2),
+        ('2', True, 3),
+    ]
+    assert i3.wait_for_windows(5)
+    assert len(i3.layouts) == 2
+
+
+def test_snapshot_api_keeps_connection(i3, directory):
+    conn = i3ipc.Connection()
+    captured = snapshot.Snapshot.capture(conn, workspaces=['1'])
+    connections = i3.connections
+    # The API's own connection is kept open and used again.
+    for _ in range(2):
+        captured = snapshot.Snapshot.capture(conn, workspaces=['1'])
+    assert len(captured.workspaces) == 1
+    assert i3.connections == connections
+
+    i3.clear_workspaces()
+    snapshot.restore(conn, captured)
+    assert i3.wait_for_windows(2)
+    assert i3.connections == connections
+
+
+def test_restore_session_reads_everything_first(i3, directory):
+    save_session(directory)
+    (directory / 'sessions' / 'test' / 'workspace_3 chat_programs.json').unlink()
+    i3.clear_workspaces()
+    commands = list(i3.commands)
+
+    result = restore_session(directory)
+    assert result.exit_code == 1
+    assert 'Could not find saved programs' in result.output
+    # Nothing was restored.
+    assert i3.commands == commands
+
+
+def test_restore_session_background(i3, directory):
+    save_session(directory)
+    i3.clear_workspaces()
+    # Workspace 2 no longer exists, so it is appended whole.
+    for output in i3.tree['nodes']:
+        for content in output['nodes']:
+            content['nodes'] = [ws for ws in content['nodes'] if ws['name'] != '2']
+    commands = len(i3.commands)
+
+    result = restore_session(directory, '--background')
+    assert result.exit_code == 0, result.output
+    assert i3.wait_for_windows(6)
+
+    # Focus never left the original workspace.
+    switches = [c for c in i3.commands[commands:] if c.startswith('workspace ')]
+    assert switches == []
+    assert i3.focused_workspace == '1'
+
+    ws = i3.find_workspace('2')
+    assert ws['output'] == 'HDMI-1'
+    assert ws['nodes'][0]['layout'] == 'tabbed'
+    assert len(ws['floating_nodes']) == 1
+    chat = i3.find_workspace('3 chat')
+    assert [n['window_properties']['class'] for n in chat['nodes']] == ['Slack']
+    # The temporary marks were removed.
+    assert not any(
+        mark.startswith('_i3-resurrect')
+        for ws in i3.iter_workspaces()
+        for node in [ws] + ws['nodes'] + ws['floating_nodes']
+        for mark in node['marks']
+    )
+
+
+def test_restore_session_lazy(i3, directory):
+    save_session(directory)
+    i3.clear_workspaces()
+
+    thread, results = in_thread(lambda: restore_session(directory, '--lazy'))
+
+    # Only the focused workspace is restored straight away.
+    assert wait_for(lambda: len(i3.windows_spawned) == 2)
+    assert len(i3.layouts) == 1
+    assert thread.is_alive()
+
+    i3.handle_message(None, COMMAND, 'workspace "3 chat"')
+    assert wait_for(lambda: len(i3.windows_spawned) == 3)
+    assert i3.windows_spawned[-1][0] == '3 chat'
+
+    i3.handle_message(None, COMMAND, 'workspace "2"')
+    thread.join(5)
+    assert not thread.is_alive()
+
+    assert results[0].exit_code == 0, results[0].output
+    assert len(i3.layouts) == 3
+    assert [w[0] for w in i3.windows_spawned[3:]] == ['2'] * 3
+
+
+def test_restore_session_visible_first(i3, directory):
+    save_session(directory)
+    i3.clear_workspaces()
+    # Show "3 chat" on HDMI-1 and focus workspace 2, which is then hidden.
+    i3.handle_message(None, COMMAND, 'workspace "3 chat"')
+    i3.handle_message(None, COMMAND, 'workspace "1"')
+    i3.handle_message(None, COMMAND, 'workspace "2"')
+    commands = len(i3.commands)
+
+    result = restore_session(directory)
+    assert result.exit_code == 0, result.output
+
+    restored = [
+        c.split(' ', 1)[1]
+        for c in i3.commands[commands:]
+        if c.startswith(('workspace ', '[con_mark'))
+    ]
+    assert restored == [
+        '--no-auto-back-and-forth "2"',
+        '--no-auto-back-and-forth "1"',
+        # Focus is given back before the hidden workspace is restored in the
+        # background.
+        '--no-auto-back-and-forth "2"',
+        'move container to workspace "3 chat"',
+    ]
+    assert i3.focused_workspace == '2'
+
+
+def test_restore_session_defer_hidden(i3, directory):
+    save_session(directory)
+    programs = json.loads(
+        (directory / 'sessions' / 'test' / 'workspace_2_programs.json').read_text()
+    )
+    # Zathura is behind code's tab.
+    assert [p.get('hidden_window') for p in programs] == [None, 1, None]
+    i3.clear_workspaces()
+
+    thread, results = in_thread(lambda: restore_session(directory, '--defer-hidden'))
+    assert i3.wait_for_windows(5)
+    assert not any('zathura' in command for command in i3.execs)
+    assert thread.is_alive()
+
+    placeholder = next(
+        node
+        for ws in i3.iter_workspaces()
+        for node in treeutils.iter_cons(ws)
+        if any(m.startswith('_i3-resurrect_tab') for m in node['marks'])
+    )
+    assert placeholder['swallows'][0]['class'] == 'Zathura'
+    i3.handle_message(None, COMMAND, f'[con_id={placeholder["id"]}] focus')
+    thread.join(5)
+    assert not thread.is_alive()
+
+    assert results[0].exit_code == 0, results[0].output
+    assert 'zathura' in i3.execs[-1]
+    assert placeholder['marks'] == []
+
+
+def test_restore_session_launch_priority(monkeypatch, i3, directory):
+    use_config(
+        monkeypatch,
+        launch_priority={
+            'nice': 10,
+            'ionice': 'idle',
+            'grace_period': 0.5,
+            'window_classes': {'Slack': {'nice': 0, 'ionice': None}},
+        },
+    )
+    save_session(directory)
+    i3.clear_workspaces()
+
+    result = restore_session(directory)
+    assert result.exit_code == 0, result.output
+    assert i3.wait_for_windows(6)
+
+    wrapped = [command for command in i3.execs if 'nice -n 10 ionice -c 3' in command]
+    assert len(wrapped) == 5
+    assert all(' && env I3_RESURRECT_LAUNCH=' in command for command in wrapped)
+    # Slack is launched at its normal priority.
+    unwrapped = [command for command in i3.execs if command not in wrapped]
+    assert len(unwrapped) == 1
+    assert unwrapped[0].endswith('&& "slack"')
+
+
+def test_restore_session_slowest_first(monkeypatch, i3, directory):
+    use_config(monkeypatch, startup_times=True)
+    i3.window_delay = lambda command: 0.3 if 'mpv' in command else 0.0
+    save_session(directory)
+
+    for _ in range(2):
+        i3.clear_workspaces()
+        i3.execs.clear()
+        result = restore_session(directory)
+        assert result.exit_code == 0, result.output
+
+        # Restoring waits for the windows to learn their startup times.
+        times = json.loads((directory / 'startup_times.json').read_text())
+        assert sorted(times['times']) == [
+            'alacritty',
+            'code',
+            'firefox',
+            'mpv',
+            'slack',
+            'zathura',
+        ]
+        assert times['times']['mpv'] > 0.2
+        # Windows are matched to their launches by a token.
+        assert all(' && env I3_RESURRECT_LAUNCH=' in c for c in i3.execs)
+
+    # mpv was saved last in workspace 2, and is launched first once it is known
+    # to be the slowest.
+    workspace_2 = [
+        command.split()[-1].strip('"')
+        for command in i3.execs
+        if any(name in command for name in ('code', 'zathura', 'mpv'))
+    ]
+    assert workspace_2[0] == 'mpv'
+
+
+def test_restore_session_reuse(i3, directory):
+    save_session(directory)
+
+    # Move code from workspace 2 to a workspace which isn't saved, and mpv to
+    # workspace 1.
+    i3.handle_message(None, COMMAND, '[id=50331651] move container to workspace "9"')
+    i3.handle_message(None, COMMAND, '[id=50331653] move container to workspace "1"')
+
+    result = restore_session(directory, '--reuse')
+    assert result.exit_code == 0, result.output
+
+    windows = {
+        con['window']: ws['name']
+        for ws in i3.iter_workspaces()
+        for con in treeutils.iter_cons(ws)
+        if con.get('window')
+    }
+    assert i3.execs == []
+    assert windows[50331651] == '2'
+    assert windows[50331653] == '2'
@@ -0,0 +1,51 @@
+import json
+
+from i3_resurrect import history
+
+
+def layout(value):
+    return json.dumps({"nodes": [{"name": str(i)} for i in range(50)] + [value]},
+                      indent=2).encode('utf-8')
+
+
+def test_history(tmp_path):
+    versions = history.History(tmp_path, 'workspace_1')
+    versions.add('layout', layout(0))
+    versions.add('programs', b'[]')
+    assert versions.commit(versions=3) == 1
+
+    # Nothing is recorded if nothing changed.
+    versions.add('layout', layout(0))
+    assert versions.commit(versions=3) is None
+
+    # Unchanged files are carried over from the previous version.
+    for i in range(1, 5):
+        versions.add('layout', layout(i))
+        assert versions.commit(versions=3, checkpoint_interval=2) == i + 1
+
+    # Reading the history back from disk.
+    versions = history.History(tmp_path, 'workspace_1')
+    assert [v['version'] for v in versions.versions()] == [3, 4, 5]
+    for i in range(2, 5):
+        assert versions.read(i + 1, 'layout') == layout(i)
+        assert versions.read(i + 1, 'programs') == b'[]'
+
+    # Delta chains are bounded by the checkpoint interval and pruned objects
+    # are deleted.
+    objects = versions.index['objects']
+    assert max(o['depth'] for o in objects.values()) < 2
+    assert sorted(p.name for p in versions.objects.iterdir()) == sorted(objects)
+
+    try:
+        versions.read(1, 'layout')
+        assert False
+    except history.VersionNotFound:
+        pass
+
+
+def test_delta():
+    old = layout('old')
+    new = layout('new').replace(b'"1"', b'"one"')
+    delta = history.make_delta(old, new)
+    assert history.apply_delta(old, delta) == new
+    assert len(json.dumps(delta)) < len(new) / 4
@@ -0,0 +1,50 @@
+import asyncio
+import copy
+
+from i3_resurrect import ipc
+from i3_resurrect import treeutils
+
+from .fake_i3 import FakeI3
+from .fake_i3 import fixture
+
+
+def test_get_tree_large_reply():
+    tree = fixture('tree.json')
+    workspace = treeutils.find_workspace(tree, '1', False)
+    window = workspace['nodes'][0]
+    original = len(workspace['nodes'])
+    # Make the reply much larger than a socket buffer.
+    for i in range(2000):
+        clone = copy.deepcopy(window)
+        clone['id'] = 10 ** 6 + i
+        workspace['nodes'].append(clone)
+
+    async def get_tree(socket_path):
+        async with ipc.AsyncConnection(socket_path) as i3:
+            return await asyncio.gather(i3.get_tree(), i3.get_tree())
+
+    with FakeI3(tree) as i3:
+        trees = asyncio.run(get_tree(i3.socket_path))
+
+    assert trees[0] == trees[1]
+    workspace = treeutils.find_workspace(trees[0], '1', False)
+    assert len(workspace['nodes']) == original + 2000
+
+
+def test_find_socket_path(monkeypatch, tmp_path):
+    socket_path = tmp_path / 'ipc-socket'
+    socket_path.touch()
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    xprop = bin_dir / 'xprop'
+    xprop.write_text(f'#!/bin/sh\necho \'I3_SOCKET_PATH = "{socket_path}"\'\n')
+    xprop.chmod(0o755)
+    monkeypatch.setenv('PATH', str(bin_dir))
+    monkeypatch.delenv('I3SOCK', raising=False)
+    assert asyncio.run(ipc.find_socket_path()) == str(socket_path)
+
+    monkeypatch.setenv('I3SOCK', str(tmp_path / 'missing'))
+    assert asyncio.run(ipc.find_socket_path()) == str(socket_path)
+
+    xprop.unlink()
+    assert asyncio.run(ipc.find_socket_path()) is None
@@ -0,0 +1,89 @@
+import json
+
+import click
+from click.testing import CliRunner
+
+from i3_resurrect import main
+from i3_resurrect import manifest
+
+
+def save(directory):
+    index = manifest.Manifest(directory)
+    index.entry('profile', 'work').add('layout', True)
+    index.entry('profile', 'web').add('programs', True, windows=2)
+    index.entry('workspace', '1', 'monday').add('layout', True)
+    index.save()
+
+
+def test_ls_format(tmp_path):
+    save(tmp_path)
+    runner = CliRunner()
+
+    result = runner.invoke(
+        main.main, ['ls', 'profiles', '-f', 'json', '-d', str(tmp_path)])
+    records = json.loads(result.output)
+    assert [(r['name'], r['has_layout'], r['has_programs'], r['windows'])
+            for r in records] == [('web', False, True, 2),
+                                  ('work', True, False, None)]
+
+    result = runner.invoke(
+        main.main, ['ls', 'sessions', '-f', 'lines', '-d', str(tmp_path)])
+    [line] = result.output.splitlines()
+    assert line.split('\t')[:4] == ['session', 'monday', 'true', 'false']
+
+
+def test_complete_saved(tmp_path):
+    save(tmp_path)
+    ctx = click.Context(main.main)
+    ctx.params = {'directory': str(tmp_path)}
+    assert main.complete_saved('profile')(ctx, None, 'w') == ['web', 'work']
+    assert main.complete_saved('profile')(ctx, None, 'wo') == ['work']
+    assert main.complete_saved('session')(ctx, None, '') == ['monday']
+    ctx.params['session'] = 'monday'
+    assert main.complete_saved('workspace')(ctx, None, '') == ['1']
+
+
+def test_save_displays_checked(tmp_path):
+    runner = CliRunner()
+
+    # The displays would overwrite each other's saved workspaces.
+    result = runner.invoke(
+        main.main,
+        ['save', '--session', 'test', '-d', str(tmp_path),
+         '--display', ':1', '--display', ':2'])
+    assert result.exit_code == 1
+    assert 'would both save to' in result.output
+
+    # A socket alone doesn't say which display to look windows up on.
+    result = runner.invoke(
+        main.main,
+        ['save', '--session', 'test', '-d', str(tmp_path / '$DISPLAY'),
+         '--socket', str(tmp_path / 'ipc.sock')])
+    assert result.exit_code == 1
+    assert 'with a --display for each socket' in result.output
+
+
+def test_rm_target(tmp_path):
+    runner = CliRunner()
+    for filetype in ['layout', 'programs']:
+        (tmp_path / f'workspace_1_{filetype}.json').write_text('[]')
+
+    result = runner.invoke(
+        main.main, ['rm', '-w', '1', '--layout-only', '-d', str(tmp_path)])
+    assert result.exit_code == 0
+    assert not (tmp_path / 'workspace_1_layout.json').exists()
+    assert (tmp_path / 'workspace_1_programs.json').exists()
+
+    result = runner.invoke(
+        main.main, ['rm', '-w', '1', '--programs-only', '-d', str(tmp_path)])
+    assert result.exit_code == 0
+    assert not (tmp_path / 'workspace_1_programs.json').exists()
+
+
+def test_restore_session_version(tmp_path):
+    runner = CliRunner()
+    result = runner.invoke(
+        main.main,
+        ['restore', '--session', 'test', '-V', '2', '-d', str(tmp_path)])
+    assert result.exit_code == 1
+    assert "--version can't be used with --session" in result.output
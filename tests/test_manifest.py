@@ -0,0 +1,42 @@
+from i3_resurrect import manifest
+
+
+def test_manifest(tmp_path):
+    index = manifest.Manifest(tmp_path)
+    entry = index.entry('workspace', 'my_workspace', 'work')
+    entry.add('layout', True)
+    entry.add('programs', True, windows=3)
+    index.entry('profile', 'code').add('layout', True)
+    index.save()
+
+    index = manifest.Manifest(tmp_path)
+    [saved] = index.find('workspace', 'work')
+    assert saved['name'] == 'my_workspace'
+    assert sorted(saved['files']) == ['layout', 'programs']
+    assert saved['windows'] == 3
+    assert index.find('workspace') == []
+    assert index.sessions() == ['work']
+
+    # Removing the last file of an entry removes the entry.
+    index.remove('profile', 'code', filetype='layout')
+    index.remove(session='work')
+    assert index.find() == []
+
+
+def test_scan(tmp_path):
+    for name in [
+        'workspace_1_layout.json',
+        'workspace_10_programs.json',
+        'workspace_2_layout.json',
+        'profiles/my_profile_programs.json',
+        'sessions/work/workspace_3 chat_layout.json',
+        'sessions/work/workspace_a_b_programs.json',
+    ]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text('{}')
+
+    # The manifest is rebuilt by scanning when it doesn't exist.
+    index = manifest.Manifest(tmp_path)
+    assert [e['name'] for e in index.find('workspace')] == ['1', '2', '10']
+    assert [e['name'] for e in index.find('profile')] == ['my_profile']
+    assert [e['name'] for e in index.find('workspace', 'work')] == ['3 chat', 'a_b']
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import psutil
+import pytest
+
+from i3_resurrect import config
+from i3_resurrect import priority
+from i3_resurrect import programs
+from i3_resurrect import startup
+
+
+def test_get_rule(monkeypatch):
+    monkeypatch.setattr(
+        config,
+        '_config',
+        {
+            'launch_priority': {
+                'nice': 10,
+                'ionice': 'idle',
+                'window_classes': {'Firefox': {'nice': 5}},
+            },
+        },
+    )
+    assert priority.get_rule('Firefox') == {'nice': 5, 'ionice': 'idle'}
+    assert priority.get_rule(None) == {'nice': 10, 'ionice': 'idle'}
+
+
+def test_launcher_command(monkeypatch):
+    monkeypatch.setattr(
+        config,
+        '_config',
+        {
+            'launch_priority': {
+                'nice': 10,
+                'window_classes': {'Slack': {'nice': 0}},
+            },
+        },
+    )
+    launcher = priority.Launcher()
+    firefox = programs.Program(['firefox'], '/', window_class='Firefox')
+    slack = programs.Program(['slack'], '/', window_class='Slack')
+
+    token = f'{os.getpid()}-0'
+    assert launcher.command(firefox) == (
+        f'exec "cd \\"/\\" && env {priority.ENV_VAR}={token} nice -n 10 '
+        '\\"firefox\\""'
+    )
+    assert launcher.command(slack) == programs.exec_command(slack)
+
+
+def test_launcher_command_measured(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, '_config', {})
+    launcher = priority.Launcher(startup.StartupTimes(tmp_path))
+    firefox = programs.Program(['firefox'], '/', window_class='Firefox')
+
+    # Without any launch priority, the token is still set to find the
+    # program's window by.
+    token = f'{os.getpid()}-0'
+    assert launcher.command(firefox) == (
+        f'exec "cd \\"/\\" && env {priority.ENV_VAR}={token} \\"firefox\\""'
+    )
+
+
+def test_find_and_reset():
+    token = f'test-{os.getpid()}'
+    env = dict(os.environ, **{priority.ENV_VAR: token})
+    process = subprocess.Popen(
+        ['ionice', '-c', '3', sys.executable, '-c', 'import time; time.sleep(30)'],
+        env=env,
+    )
+    try:
+        # Wait for ionice to exec the program.
+        for _ in range(100):
+            found = priority.find_processes({token})
+            if found and psutil.Process(process.pid).name() != 'ionice':
+                break
+            time.sleep(0.05)
+        assert [p.pid for p in found[token]] == [process.pid]
+        assert psutil.Process(process.pid).ionice().ioclass == psutil.IOPRIO_CLASS_IDLE
+
+        priority.reset({'ionice': 'idle'}, token, found[token], 0)
+        assert psutil.Process(process.pid).ionice().ioclass == psutil.IOPRIO_CLASS_NONE
+    finally:
+        process.kill()
+        process.wait()
+
+
+class Unprivileged:
+    def nice(self, value):
+        raise psutil.AccessDenied()
+
+
+def test_reset_refused(monkeypatch, capsys):
+    monkeypatch.setattr(config, '_config', {'launch_priority': {'nice': 10}})
+    rule = {'nice': 10}
+    assert priority.reset(rule, 'token', [Unprivileged()], 0)
+    assert not priority.reset({}, 'token', [Unprivileged()], 0)
+
+    async def reset_twice():
+        launcher = priority.Launcher()
+        for token in ['a', 'b']:
+            launcher.pending[token] = (rule, 0)
+            await launcher._reset(token, [Unprivileged()])
+
+    asyncio.run(reset_twice())
+    assert capsys.readouterr().err.count('RLIMIT_NICE') == 1
+
+
+def test_validate(monkeypatch):
+    monkeypatch.setattr(config, '_config', {'launch_priority': {'ionice': 'low'}})
+    with pytest.raises(priority.ConfigError, match='Unknown ionice class "low"'):
+        priority.validate()
@@ -0,0 +1,26 @@
+import io
+
+from i3_resurrect import profiling
+
+
+def test_phase_report():
+    # Phases are no-ops while tracing is disabled.
+    with profiling.phase("disabled"):
+        pass
+
+    tracer = profiling.enable()
+    try:
+        for _ in range(2):
+            with profiling.phase("allocate"):
+                data = [{"node": i} for i in range(1000)]
+        report = io.StringIO()
+        profiling.report(report)
+    finally:
+        profiling.disable()
+
+    assert "disabled" not in tracer.phases
+    assert tracer.phases["allocate"]["count"] == 2
+    assert tracer.phases["allocate"]["peak"] > 0
+    assert "allocate" in report.getvalue()
+    assert "test_profiling.py" in report.getvalue()
+    assert len(data) == 1000
@@ -157,3 +157,22 @@ def test_get_window_command(monkeypatch):
         '--app=http://instacalc.com',
         '--user-data-dir=.config',
     ]
+
+
+def test_remove_running():
+    saved = [
+        programs.Program.from_dict({'command': ['vim'], 'working_directory': '/a'}),
+        programs.Program(['vim'], '/a'),
+        programs.Program('some-program arg1', '/b'),
+        programs.Program(['firefox'], '/c'),
+    ]
+    running = [
+        programs.Program(['vim'], '/a'),
+        programs.Program(['firefox'], '/home'),
+        programs.Program('some-program arg1', '/b'),
+    ]
+    assert programs.remove_running(saved, running) == [
+        programs.Program(['vim'], '/a'),
+        programs.Program(['firefox'], '/c'),
+    ]
+    assert saved[0].to_dict() == {'command': ['vim'], 'working_directory': '/a'}
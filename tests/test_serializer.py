@@ -0,0 +1,44 @@
+import pytest
+
+from i3_resurrect import serializer
+from i3_resurrect import treeutils
+
+BACKENDS = [
+    name for name in serializer.BACKENDS
+    if name != 'orjson' or serializer.orjson is not None
+]
+
+TREE = {
+    'type': 'workspace',
+    'name': '1',
+    'output': 'eDP-1',
+    'window_properties': {'class': 'Firefox', 'title': 'Ünïcode'},
+    'rect': {'x': 0, 'y': 0, 'width': 1920, 'height': 1080},
+    'nodes': [{'type': 'con', 'percent': 0.5, 'nodes': []}],
+    'floating_nodes': [],
+}
+
+
+@pytest.mark.parametrize('name', BACKENDS)
+def test_backend(name):
+    backend = serializer.get_backend(name)
+    layout = treeutils.LayoutNode.from_con(TREE, ['class'])
+    expected = treeutils.process_node(TREE, ['class'])
+
+    for indent in [None, 2]:
+        data = backend.dumps(layout, indent, treeutils.json_default)
+        assert isinstance(data, bytes)
+        assert backend.loads(data) == expected
+
+
+def test_backends_match():
+    ascii_tree = dict(TREE, window_properties={'class': 'Firefox'})
+    outputs = {
+        serializer.get_backend(name).dumps(ascii_tree, indent)
+        for name in BACKENDS
+        for indent in [2]
+    }
+    assert len(outputs) == 1
+
+    with pytest.raises(ValueError):
+        serializer.get_backend('yaml')
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from i3_resurrect import config
+from i3_resurrect import history
+from i3_resurrect import programs
+from i3_resurrect import snapshot
+from i3_resurrect import treeutils
+
+
+def workspace_layout(name):
+    return {'type': 'workspace', 'name': name, 'layout': 'splith', 'nodes': []}
+
+
+def test_store(tmp_path):
+    store = snapshot.Store(tmp_path)
+    assert store.root == tmp_path
+    assert store.directory == tmp_path
+
+    store = snapshot.Store(tmp_path, profile='web')
+    assert store.directory == tmp_path / 'profiles'
+
+    store = snapshot.Store(tmp_path, session='work')
+    assert store.parent == tmp_path / 'sessions'
+    assert store.directory == tmp_path / 'sessions' / 'work'
+
+
+def test_save_and_load(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, '_config', {})
+    store = snapshot.Store(tmp_path, session='work')
+    saved = snapshot.Snapshot(
+        [
+            snapshot.WorkspaceSnapshot(
+                '1', workspace_layout('1'), [programs.Program(['firefox'], '/home')]
+            ),
+            snapshot.WorkspaceSnapshot('2', workspace_layout('2'), []),
+        ]
+    )
+    assert [(ws.name, ws.changed) for ws in saved.save(store)] == [
+        ('1', True),
+        ('2', True),
+    ]
+    # Nothing changed the second time.
+    assert not any(ws.changed for ws in asyncio.run(saved.save_async(store)))
+
+    loaded = snapshot.Snapshot.load(store)
+    assert [ws.name for ws in loaded.workspaces] == ['1', '2']
+    assert loaded.workspaces[0].layout['layout'] == 'splith'
+    assert loaded.workspaces[0].programs == [programs.Program(['firefox'], '/home')]
+
+    loaded = snapshot.Snapshot.load(store, ['2'], target='layout_only')
+    assert [ws.name for ws in loaded.workspaces] == ['2']
+    assert loaded.workspaces[0].programs is None
+
+
+def test_captured_layout():
+    con = {'type': 'workspace', 'name': '1', 'output': 'eDP-1', 'layout': 'tabbed'}
+    node = treeutils.LayoutNode.from_con(con, ['class'])
+    workspace = snapshot.WorkspaceSnapshot('1', node)
+    # The compact layout is only turned into dicts when it is looked at.
+    assert workspace.compact_layout is node
+    assert workspace.layout == node.to_dict()
+    assert workspace.layout['layout'] == 'tabbed'
+
+
+def test_load_errors(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, '_config', {})
+    with pytest.raises(snapshot.SnapshotError, match='Could not find saved session'):
+        snapshot.Snapshot.load(snapshot.Store(tmp_path, session='work'))
+
+    # Each workspace's versions are numbered separately.
+    with pytest.raises(snapshot.SnapshotError, match='whole session'):
+        snapshot.Snapshot.load(snapshot.Store(tmp_path, session='work'), version=1)
+
+    store = snapshot.Store(tmp_path)
+    with pytest.raises(snapshot.SnapshotError, match='for workspace "3"'):
+        snapshot.Snapshot.load(store, ['3'])
+
+    workspace = snapshot.WorkspaceSnapshot('3', workspace_layout('3'), [])
+    snapshot.Snapshot([workspace]).save(store)
+    with pytest.raises(history.VersionNotFound):
+        snapshot.Snapshot.load(store, ['3'], version=5)
@@ -0,0 +1,64 @@
+import json
+
+from i3_resurrect import programs
+from i3_resurrect import startup
+
+
+def test_record_and_save(tmp_path):
+    times = startup.StartupTimes(tmp_path)
+    times.record('firefox', 4.0)
+    times.record('firefox', 2.0)
+    times.save()
+
+    saved = json.loads((tmp_path / startup.STARTUP_TIMES_FILE).read_text())
+    assert saved['times'] == {'firefox': 3.0}
+    assert startup.StartupTimes(tmp_path).times == {'firefox': 3.0}
+
+
+def test_bounded(monkeypatch, tmp_path):
+    monkeypatch.setattr(startup, 'MAX_ENTRIES', 2)
+    times = startup.StartupTimes(tmp_path)
+    times.record('a', 1.0)
+    times.record('b', 1.0)
+    times.record('a', 1.0)
+    times.record('c', 1.0)
+    # The least recently measured command is dropped.
+    assert list(times.times) == ['a', 'c']
+
+
+def test_invalid_file(tmp_path):
+    (tmp_path / startup.STARTUP_TIMES_FILE).write_text('{"version": 2}')
+    assert startup.StartupTimes(tmp_path).times == {}
+
+
+def test_slowest_first(tmp_path):
+    times = startup.StartupTimes(tmp_path)
+    times.record('slow', 10.0)
+    times.record('fast', 0.1)
+    saved = [
+        programs.Program(['fast'], '/'),
+        programs.Program(['unknown'], '/'),
+        programs.Program(['slow'], '/'),
+        programs.Program('new', '/'),
+    ]
+    ordered = times.slowest_first(saved)
+    # Unknown programs are assumed to take the average time.
+    assert [p.command for p in ordered] == [('slow',), ('unknown',), 'new', ('fast',)]
+
+
+def test_command_key():
+    program = programs.Program(['/opt/Pulse SMS/pulse-sms', '--x'], '/')
+    assert startup.command_key(program) == "'/opt/Pulse SMS/pulse-sms' --x"
+
+
+def test_concurrent_save(tmp_path):
+    # Restores of two displays load the times before either saves.
+    first = startup.StartupTimes(tmp_path)
+    second = startup.StartupTimes(tmp_path)
+    assert first.times == second.times == {}
+    first.record('firefox', 4.0)
+    second.record('slack', 2.0)
+    second.record('firefox', 2.0)
+    first.save()
+    second.save()
+    assert startup.StartupTimes(tmp_path).times == {'slack': 2.0, 'firefox': 3.0}
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from i3_resurrect import config
+from i3_resurrect import storage
+from i3_resurrect import treeutils
+
+WORKSPACE = {
+    'type': 'workspace',
+    'output': 'HDMI-1-1',
+    'border': 'normal',
+    'current_border_width': -1,
+    'floating': 'auto_off',
+    'fullscreen_mode': 0,
+    'geometry': {'x': 0, 'y': 0, 'width': 0, 'height': 0},
+    'layout': 'tabbed',
+    'marks': [],
+    'name': '1',
+    'orientation': 'horizontal',
+    'percent': None,
+    'scratchpad_state': 'none',
+    'sticky': False,
+    'workspace_layout': 'default',
+    'nodes': [
+        {
+            'type': 'con',
+            'border': 'pixel',
+            'current_border_width': 2,
+            'floating': 'auto_off',
+            'fullscreen_mode': 0,
+            'geometry': {'x': 0, 'y': 0, 'width': 724, 'height': 412},
+            'layout': 'splith',
+            'marks': [],
+            'name': 'vim',
+            'orientation': 'none',
+            'percent': 1.0,
+            'scratchpad_state': 'none',
+            'sticky': False,
+            'workspace_layout': 'default',
+            'window_properties': {'class': 'Alacritty', 'instance': 'Alacritty'},
+        },
+    ],
+}
+
+
+@pytest.mark.parametrize('fmt', storage.FORMATS)
+@pytest.mark.parametrize('compression', storage.COMPRESSIONS)
+def test_layout_round_trip(monkeypatch, fmt, compression):
+    monkeypatch.setattr(config, '_config', {'window_swallow_criteria': {}})
+    processed = treeutils.process_node(WORKSPACE, ['class'])
+    compact = treeutils.LayoutNode.from_con(WORKSPACE, ['class'])
+
+    for layout in [processed, compact]:
+        data = storage.dump_layout(layout, fmt, compression)
+        assert storage.load_layout(data) == processed
+
+
+def test_compact_layout_elides_defaults(monkeypatch):
+    monkeypatch.setattr(config, '_config', {'window_swallow_criteria': {}})
+    processed = treeutils.process_node(WORKSPACE, ['class'])
+    data = storage.dump_layout(processed, 'compact')
+    envelope = json.loads(data)
+    assert envelope['version'] == storage.COMPACT_VERSION
+    assert envelope['layout']['nodes'][0] == {
+        'border': 'pixel',
+        'current_border_width': 2,
+        'geometry': {'x': 0, 'y': 0, 'width': 724, 'height': 412},
+        'name': 'vim',
+        'percent': 1.0,
+        'swallows': [{'class': 'Alacritty'}],
+    }
+    assert len(data) < len(storage.dump_layout(processed, 'json')) / 2
+
+
+def test_load_legacy_and_unknown_layouts():
+    assert storage.load_layout(b'{}') == {}
+    assert storage.load_layout(json.dumps(WORKSPACE, indent=2).encode()) == WORKSPACE
+    with pytest.raises(storage.FormatError):
+        storage.load_layout(
+            json.dumps({'format': storage.COMPACT_FORMAT, 'version': 99}).encode()
+        )
@@ -0,0 +1,183 @@
+import asyncio
+import copy
+
+from i3_resurrect import treemirror
+
+
+class Connection:
+    def __init__(self, tree):
+        self.tree = tree
+        self.calls = 0
+
+    async def get_tree(self):
+        self.calls += 1
+        return copy.deepcopy(self.tree)
+
+
+def con(con_id, nodes=(), **kwargs):
+    return {'id': con_id, 'type': 'con', 'nodes': list(nodes), 'focus': [], **kwargs}
+
+
+def window(con_id, focused=False, **kwargs):
+    return con(con_id, window=con_id * 10, focused=focused, **kwargs)
+
+
+def tree():
+    workspace = con(
+        4,
+        [window(5, focused=True), con(6, [window(7), window(8)])],
+        type='workspace',
+        name='1',
+        focus=[5, 6],
+    )
+    content = con(3, [workspace], name='content', focus=[4])
+    output = con(2, [content], type='output', name='eDP-1', focus=[3])
+    return con(1, [output], type='root', focus=[2])
+
+
+def find(root, con_id):
+    if root['id'] == con_id:
+        return root
+    for node in root['nodes']:
+        found = find(node, con_id)
+        if found is not None:
+            return found
+    return None
+
+
+def mirror_of(tree):
+    i3 = Connection(tree)
+    mirror = treemirror.TreeMirror(i3)
+    root = asyncio.run(mirror.get_tree())
+    return mirror, i3, root
+
+
+def test_cached():
+    mirror, i3, root = mirror_of(tree())
+    assert asyncio.run(mirror.get_tree()) is root
+    assert i3.calls == 1
+
+    mirror.invalidate()
+    assert asyncio.run(mirror.get_tree()) == tree()
+    assert i3.calls == 2
+
+
+def test_window_title():
+    mirror, i3, root = mirror_of(tree())
+    mirror.apply('window', {'change': 'title', 'container': window(7, name='vim')})
+    assert find(root, 7)['name'] == 'vim'
+    assert asyncio.run(mirror.get_tree()) is root
+
+
+def test_window_focus():
+    mirror, i3, root = mirror_of(tree())
+    mirror.apply('window', {'change': 'focus', 'container': window(8, focused=True)})
+    assert not find(root, 5)['focused']
+    assert find(root, 8)['focused']
+    assert find(root, 6)['focus'][0] == 8
+    assert find(root, 4)['focus'] == [6, 5]
+    assert asyncio.run(mirror.get_tree()) is root
+
+
+def test_window_close():
+    mirror, i3, root = mirror_of(tree())
+    mirror.apply('window', {'change': 'close', 'container': window(7)})
+    assert find(root, 7) is None
+    mirror.apply('window', {'change': 'close', 'container': window(8)})
+    # The split container which was left empty is closed too.
+    assert find(root, 6) is None
+    assert [node['id'] for node in find(root, 4)['nodes']] == [5]
+    assert find(root, 4)['focus'] == [5]
+    assert asyncio.run(mirror.get_tree()) is root
+
+
+def test_window_new_placeholder():
+    mirror, i3, root = mirror_of(tree())
+    # A window which fills a placeholder takes over its container.
+    new = window(7, name='vim', focused=True)
+    mirror.apply('window', {'change': 'new', 'container': new})
+    assert find(root, 6)['nodes'][0]['name'] == 'vim'
+    assert find(root, 7)['focused']
+    assert not find(root, 5)['focused']
+    assert asyncio.run(mirror.get_tree()) is root
+
+
+def test_window_new():
+    mirror, i3, root = mirror_of(tree())
+    mirror.apply('window', {'change': 'focus', 'container': window(7, focused=True)})
+    new = window(9, focused=True, floating='auto_off')
+    mirror.apply('window', {'change': 'new', 'container': new})
+    # It goes after the focused window, in the same split container.
+    assert [node['id'] for node in find(root, 6)['nodes']] == [7, 9, 8]
+    assert find(root, 6)['focus'][0] == 9
+    assert find(root, 9)['focused']
+    assert not find(root, 7)['focused']
+    assert asyncio.run(mirror.get_tree()) is root
+
+
+def test_window_new_stale():
+    # Where windows which aren't focused, or are floating, went isn't known.
+    for new in [window(9), window(9, focused=True, floating='auto_on')]:
+        mirror, i3, root = mirror_of(tree())
+        mirror.apply('window', {'change': 'new', 'container': new})
+        assert asyncio.run(mirror.get_tree()) is not root
+
+
+def test_workspace_init():
+    mirror, i3, root = mirror_of(tree())
+    workspace = con(9, type='workspace', name='2', output='eDP-1')
+    mirror.apply('workspace', {'change': 'init', 'current': workspace})
+    assert find(root, 3)['nodes'][-1]['name'] == '2'
+
+    mirror.apply('workspace', {'change': 'empty', 'current': workspace})
+    assert find(root, 9) is None
+    assert asyncio.run(mirror.get_tree()) is root
+
+
+def test_workspace_move():
+    two_outputs = tree()
+    content = con(11, name='content')
+    two_outputs['nodes'].append(con(10, [content], type='output', name='HDMI-1'))
+    mirror, i3, root = mirror_of(two_outputs)
+    workspace = find(root, 4)
+    moved = {**workspace, 'output': 'HDMI-1'}
+    mirror.apply('workspace', {'change': 'move', 'current': moved})
+    assert find(root, 3)['nodes'] == []
+    # The content container stays, though it is empty.
+    assert find(root, 3)['focus'] == []
+    assert [node['id'] for node in find(root, 11)['nodes']] == [4]
+    assert find(root, 8) is not None
+    mirror.apply('window', {'change': 'title', 'container': window(8, name='vim')})
+    assert find(root, 8)['name'] == 'vim'
+    assert asyncio.run(mirror.get_tree()) is root
+
+
+def test_stale():
+    mirror, i3, root = mirror_of(tree())
+    mirror.apply('window', {'change': 'move', 'container': window(7)})
+    assert asyncio.run(mirror.get_tree()) is not root
+    assert i3.calls == 2
+
+    # Events about containers it doesn't know about can't be applied.
+    root = asyncio.run(mirror.get_tree())
+    mirror.apply('window', {'change': 'title', 'container': window(9)})
+    assert asyncio.run(mirror.get_tree()) is not root
+
+
+def test_resync(monkeypatch):
+    monkeypatch.setattr(treemirror.TreeMirror, 'RESYNC_INTERVAL', 0)
+    mirror, i3, root = mirror_of(tree())
+    asyncio.run(mirror.get_tree())
+    assert i3.calls == 2
+
+
+def test_poll():
+    mirror, i3, root = mirror_of(tree())
+    mirror.apply('window', {'change': 'title', 'container': window(7, name='vim')})
+    # An event arrived since the last poll, so the mirror is kept.
+    mirror.poll()
+    assert asyncio.run(mirror.get_tree()) is root
+
+    mirror.poll()
+    assert asyncio.run(mirror.get_tree()) is not root
+    assert i3.calls == 2
@@ -1,3 +1,4 @@
+from i3_resurrect import config
 from i3_resurrect import treeutils
 
 
@@ -346,3 +347,63 @@ def test_windows_in_container():
     }
     windows = treeutils.get_leaves(workspace_tree)
     assert windows is not None
+
+
+def test_layout_node_matches_process_node(monkeypatch):
+    monkeypatch.setattr(config, '_config', {'window_swallow_criteria': {}})
+    window = {
+        'type': 'con',
+        'layout': 'splith',
+        'border': 'pixel',
+        'marks': ['editor'],
+        'geometry': {'x': 0, 'y': 0, 'width': 724, 'height': 412},
+        'name': 'vim',
+        'window_properties': {'class': 'Alacritty', 'instance': 'Alacritty'},
+    }
+    floating = {
+        'type': 'floating_con',
+        'rect': {'x': 10, 'y': 20, 'width': 300, 'height': 200},
+        'nodes': [dict(window, name='floating vim')],
+    }
+    workspace = {
+        'type': 'workspace',
+        'output': 'HDMI-1-1',
+        'layout': 'tabbed',
+        'geometry': {'x': 0, 'y': 0, 'width': 0, 'height': 0},
+        'nodes': [window, dict(window)],
+        'floating_nodes': [floating],
+    }
+    node = treeutils.LayoutNode.from_con(workspace, ['class', 'instance'])
+    assert node.to_dict() == treeutils.process_node(
+        workspace, ['class', 'instance']
+    )
+    # Repeated values are shared between nodes.
+    assert node.nodes[0].layout is node.nodes[1].layout
+    assert node.geometry is treeutils.LayoutNode.ZERO_RECT
+    assert treeutils.LayoutNode.from_con({}, ['class']) is None
+
+
+def test_get_hidden_windows():
+    def window(con_id):
+        return {'id': con_id, 'window_properties': {'class': 'Code'}}
+
+    tabs = {
+        'id': 10,
+        'layout': 'stacked',
+        'focus': [3, 2],
+        'nodes': [
+            window(2),
+            window(3),
+            {'id': 4, 'layout': 'splith', 'nodes': [window(5), window(6)]},
+        ],
+    }
+    workspace = {
+        'id': 1,
+        'layout': 'tabbed',
+        # The floating container comes first in the focus stack but isn't a
+        # tab.
+        'focus': [20, 10, 7],
+        'nodes': [tabs, window(7)],
+        'floating_nodes': [{'id': 20, 'nodes': [window(21)]}],
+    }
+    assert list(treeutils.get_hidden_windows(workspace)) == [2, 5, 6, 7]
@@ -0,0 +1,65 @@
+import os
+
+import psutil
+
+from i3_resurrect import windowcache
+
+
+def window(window_id=1, window_class='Firefox'):
+    return {'window': window_id, 'window_properties': {'class': window_class}}
+
+
+def test_lookup(tmp_path):
+    cache = windowcache.WindowCache(tmp_path / 'cache.json')
+    process = psutil.Process(os.getpid())
+    assert cache.lookup(window()) is None
+
+    cache.add(window(), process, ['firefox'], '/usr/bin/firefox')
+    cache.save()
+
+    cache = windowcache.WindowCache(tmp_path / 'cache.json')
+    found, entry = cache.lookup(window())
+    assert found.pid == process.pid
+    assert entry['cmdline'] == ['firefox']
+    assert entry['exe'] == '/usr/bin/firefox'
+    # A window id which has been reused for another window.
+    assert cache.lookup(window(window_class='Alacritty')) is None
+
+
+def test_lookup_process_changed(tmp_path):
+    cache = windowcache.WindowCache(tmp_path / 'cache.json')
+    cache.add(window(), psutil.Process(os.getpid()), ['firefox'], None)
+    # The PID has been reused by another process.
+    cache.entries['1']['create_time'] -= 1
+    assert cache.lookup(window()) is None
+
+
+def test_cwd_process(tmp_path):
+    cache = windowcache.WindowCache(tmp_path / 'cache.json')
+    parent = psutil.Process(os.getppid())
+    child = psutil.Process(os.getpid())
+    cache.add(window(), parent, ['alacritty'], None, child)
+    _, entry = cache.lookup(window())
+    assert cache.cwd_process(entry).pid == child.pid
+
+    # The window's own process isn't recorded separately.
+    cache.add(window(), child, ['firefox'], None, child)
+    _, entry = cache.lookup(window())
+    assert cache.cwd_process(entry) is None
+
+
+def test_bounded(monkeypatch, tmp_path):
+    monkeypatch.setattr(windowcache, 'MAX_ENTRIES', 2)
+    cache = windowcache.WindowCache(tmp_path / 'cache.json')
+    process = psutil.Process(os.getpid())
+    for window_id in [1, 2, 1, 3]:
+        cache.add(window(window_id), process, ['firefox'], None)
+    # The least recently seen window is dropped.
+    assert list(cache.entries) == ['1', '3']
+
+
+def test_cache_path(monkeypatch, tmp_path):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    monkeypatch.setenv('DISPLAY', ':1')
+    path = tmp_path / 'i3-resurrect' / 'window_cache_1.json'
+    assert windowcache.cache_path() == path